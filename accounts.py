@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# bcrypt work factor for new hashes, existing hashes are upgraded on login
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
+# Hashes computed at once, bcrypt releases the GIL so this bounds CPU use
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', str(os.cpu_count() or 2)))
+
+# Hashes allowed to wait for a worker before requests are turned away
+HASH_QUEUE_SIZE = int(os.getenv('HASH_QUEUE_SIZE', '64'))
+
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '10000'))
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv('PROFILE_CACHE_TTL_SECONDS', '30'))
+
+# Part of a user document that /userAccount returns
+PROFILE_FIELDS = {'_id': 0, 'email': 1, 'plan': 1}
+
+
+class HasherBusy(Exception):
+    pass
+
+
+# Work factor of a bcrypt hash like $2b$12$...
+def hash_rounds(hashed):
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+# Runs bcrypt on a small dedicated pool so a burst of sign-ups cannot take
+# over every request thread. The pool queue is capped, past it callers get
+# HasherBusy instead of waiting behind hundreds of hashes.
+class PasswordHasher:
+    def __init__(self, rounds=BCRYPT_ROUNDS, max_workers=HASH_WORKERS, max_queued=HASH_QUEUE_SIZE):
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _hash(self, password):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds)).decode('utf-8')
+
+    def _check(self, hashed, password):
+        if not hashed or not password:
+            return False
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        except ValueError:
+            # Malformed stored hash
+            return False
+
+    def hash(self, password):
+        return self._submit(self._hash, password).result()
+
+    def check(self, hashed, password):
+        return self._submit(self._check, hashed, password).result()
+
+    # Coroutine versions for the ASGI app, the event loop is not blocked
+    async def hash_async(self, password):
+        return await asyncio.wrap_future(self._submit(self._hash, password))
+
+    async def check_async(self, hashed, password):
+        return await asyncio.wrap_future(self._submit(self._check, hashed, password))
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    # Re-hash with the current work factor in the background and hand the
+    # new hash to on_done, the login response does not wait for it
+    def rehash_later(self, password, on_done):
+        def rehash():
+            try:
+                on_done(self._hash(password))
+            except Exception:
+                logger.exception("Password rehash failed")
+        try:
+            self._submit(rehash)
+        except HasherBusy:
+            # Upgrading can wait for the next login
+            pass
+
+
+# Short-lived cache of the public part of user documents, so repeated
+# /userAccount calls do not each cost a Mongo round-trip
+class ProfileCache:
+    def __init__(self, collection, max_entries=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL_SECONDS):
+        self.collection = collection
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        profile = self._cached(username)
+        if profile is not None:
+            return profile
+        return self._remember(username, self.collection.find_one({'username': username}, PROFILE_FIELDS))
+
+    # Same as get() for the ASGI app, `collection` is a Motor collection
+    async def get_async(self, username, collection):
+        profile = self._cached(username)
+        if profile is not None:
+            return profile
+        return self._remember(username, await collection.find_one({'username': username}, PROFILE_FIELDS))
+
+    def _cached(self, username):
+        with self._lock:
+            return self._cache.get(username)
+
+    def _remember(self, username, user):
+        if user is None:
+            # Unknown users are not cached, they may register right after
+            return None
+        profile = {'email': user.get('email'), 'plan': user.get('plan')}
+        with self._lock:
+            self._cache[username] = profile
+        return profile
+
+    def invalidate(self, username):
+        with self._lock:
+            self._cache.pop(username, None)
+
+
+# Which unique field a DuplicateKeyError on `users` is about, None if the
+# error does not say
+def duplicate_field(error):
+    key_pattern = (error.details or {}).get('keyPattern') or {}
+    if key_pattern:
+        return next(iter(key_pattern))
+    # Servers before 4.4 only name the index in the message
+    for field in ('email', 'username'):
+        if f'index: {field}_' in str(error):
+            return field
+    return None
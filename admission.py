@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import Future
+
+from telemetry import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT_SECONDS = histogram(
+    'flashy_queue_wait_seconds', 'Time waiting for a job worker or a Gemini slot', ['queue', 'tier']
+)
+ADMISSIONS = counter('flashy_admissions_total', 'Generation requests admitted or shed', ['tier', 'outcome'])
+
+# Scheduling weight, concurrent generation requests per user and jobs
+# allowed to wait, per plan. Both tiers get slots while both wait, premium
+# `weight` times as many.
+Tier = namedtuple('Tier', ['weight', 'max_user_jobs', 'max_queued'])
+
+
+def tier_from_env(name, weight, max_user_jobs, max_queued):
+    prefix = name.upper()
+    return Tier(
+        weight=float(os.getenv(f'{prefix}_WEIGHT', str(weight))),
+        max_user_jobs=int(os.getenv(f'{prefix}_USER_JOBS', str(max_user_jobs))),
+        max_queued=int(os.getenv(f'{prefix}_QUEUE_LIMIT', str(max_queued)))
+    )
+
+
+TIERS = {
+    'premium': tier_from_env('premium', weight=4, max_user_jobs=4, max_queued=80),
+    'free': tier_from_env('free', weight=1, max_user_jobs=1, max_queued=20)
+}
+DEFAULT_TIER = 'free'
+WEIGHTS = {name: tier.weight for name, tier in TIERS.items()}
+
+# Bounds of the Retry-After sent when shedding, and its value before any wait was measured
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+DEFAULT_RETRY_AFTER = 5
+
+
+# Plans without a tier of their own, including anonymous users, are free
+def tier_of(plan):
+    return plan if plan in TIERS else DEFAULT_TIER
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Smoothed queue wait per tier, the basis of Retry-After
+_wait_estimates = {}
+
+
+def observe_wait(queue_name, tier, seconds):
+    QUEUE_WAIT_SECONDS.observe(seconds, queue=queue_name, tier=tier)
+    if queue_name == 'jobs':
+        previous = _wait_estimates.get(tier, seconds)
+        _wait_estimates[tier] = 0.8 * previous + 0.2 * seconds
+
+
+def retry_after(tier):
+    estimate = _wait_estimates.get(tier)
+    if estimate is None:
+        return DEFAULT_RETRY_AFTER
+    return max(MIN_RETRY_AFTER, min(MAX_RETRY_AFTER, math.ceil(estimate)))
+
+
+# Items of several tiers taken in weighted fair order (stride scheduling).
+# Taking an item advances its tier's pass by 1 / weight and the waiting tier
+# with the lowest pass goes next. Not thread-safe, owners hold their own lock.
+class FairQueue:
+    def __init__(self, weights=WEIGHTS):
+        self.weights = weights
+        self._queues = {name: deque() for name in weights}
+        self._passes = dict.fromkeys(weights, 0.0)
+        self._pass = 0.0
+
+    def __len__(self):
+        return sum(len(items) for items in self._queues.values())
+
+    def queued(self, tier=None):
+        if tier is None:
+            return len(self)
+        return len(self._queues[tier_of(tier)])
+
+    def push(self, tier, item):
+        tier = tier_of(tier)
+        if not self._queues[tier]:
+            # A tier that was idle does not bank the turns it skipped
+            self._passes[tier] = max(self._passes[tier], self._pass)
+        self._queues[tier].append((time.monotonic(), item))
+
+    # Returns (tier, seconds waited, item), or None when empty
+    def pop(self):
+        waiting = [name for name, items in self._queues.items() if items]
+        if not waiting:
+            return None
+        tier = min(waiting, key=self._passes.get)
+        self._pass = self._passes[tier]
+        self._passes[tier] += 1 / self.weights[tier]
+        enqueued_at, item = self._queues[tier].popleft()
+        return tier, time.monotonic() - enqueued_at, item
+
+
+# Thread pool that starts queued calls in weighted fair order by tier, so a
+# burst of free tier calls cannot hold back premium ones. submit() returns a
+# concurrent.futures.Future like ThreadPoolExecutor.submit.
+class FairExecutor:
+    def __init__(self, max_workers, weights=WEIGHTS, thread_name_prefix='fair', queue_name='llm'):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.queue_name = queue_name
+        self._queue = FairQueue(weights)
+        self._condition = threading.Condition()
+        self._workers = []
+
+    def submit(self, fn, *args, tier=DEFAULT_TIER, **kwargs):
+        future = Future()
+        with self._condition:
+            self._start_workers()
+            self._queue.push(tier, (future, fn, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def queued(self, tier=None):
+        with self._condition:
+            return self._queue.queued(tier)
+
+    # Must be called with the condition held
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._work, name=f'{self.thread_name_prefix}_{len(self._workers)}', daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                entry = self._queue.pop()
+                while entry is None:
+                    self._condition.wait()
+                    entry = self._queue.pop()
+            tier, waited, (future, fn, args, kwargs) = entry
+            observe_wait(self.queue_name, tier, waited)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+# asyncio counterpart of FairExecutor: `async with slots.slot(tier)` waits
+# for one of `size` slots, handed out in weighted fair order by tier.
+# Must be used from one event loop.
+class AsyncFairSlots:
+    def __init__(self, size, weights=WEIGHTS, queue_name='llm'):
+        self.size = size
+        self.queue_name = queue_name
+        self._free = size
+        self._queue = FairQueue(weights)
+
+    def queued(self, tier=None):
+        return self._queue.queued(tier)
+
+    def in_use(self):
+        return self.size - self._free
+
+    async def acquire(self, tier=DEFAULT_TIER):
+        if self._free > 0 and not len(self._queue):
+            self._free -= 1
+            observe_wait(self.queue_name, tier_of(tier), 0.0)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._queue.push(tier, waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Cancelled after the slot was handed over, pass it on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        entry = self._queue.pop()
+        while entry is not None:
+            tier, waited, waiter = entry
+            if not waiter.done():
+                observe_wait(self.queue_name, tier, waited)
+                waiter.set_result(None)
+                return
+            entry = self._queue.pop()
+        self._free += 1
+
+    def slot(self, tier=DEFAULT_TIER):
+        return _Slot(self, tier)
+
+
+class _Slot:
+    def __init__(self, slots, tier):
+        self.slots = slots
+        self.tier = tier
+
+    async def __aenter__(self):
+        await self.slots.acquire(self.tier)
+
+    async def __aexit__(self, *exc):
+        self.slots.release()
+
+
+# An admitted generation request. `release` frees the user's slot and is
+# safe to call more than once.
+class Ticket:
+    def __init__(self, admission, tier, user):
+        self.admission = admission
+        self.tier = tier
+        self.user = user
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.admission._release(self.tier, self.user)
+
+
+# Sheds generation requests before they are queued: a user may only have
+# `max_user_jobs` requests in progress, and a tier only `max_queued` jobs
+# waiting. `queued(tier)` counts the jobs of a tier waiting for a worker.
+class Admission:
+    def __init__(self, queued, tiers=TIERS):
+        self.queued = queued
+        self.tiers = tiers
+        self._active = Counter()
+        self._lock = threading.Lock()
+
+    # Admit a request of `user` on `plan`, returns a Ticket or raises Overloaded
+    def admit(self, user, plan):
+        tier = tier_of(plan)
+        limits = self.tiers[tier]
+        if self.queued(tier) >= limits.max_queued:
+            ADMISSIONS.inc(tier=tier, outcome='queue_full')
+            raise Overloaded('The server is busy, please try again shortly.', retry_after(tier))
+        with self._lock:
+            if self._active[tier, user] >= limits.max_user_jobs:
+                ADMISSIONS.inc(tier=tier, outcome='user_limit')
+                raise Overloaded(
+                    'Too many generation requests in progress, please wait for one to finish.', retry_after(tier)
+                )
+            self._active[tier, user] += 1
+        ADMISSIONS.inc(tier=tier, outcome='admitted')
+        return Ticket(self, tier, user)
+
+    def _release(self, tier, user):
+        with self._lock:
+            self._active[tier, user] -= 1
+            if self._active[tier, user] <= 0:
+                del self._active[tier, user]
+
+    # Requests in progress per tier
+    def active(self):
+        with self._lock:
+            totals = Counter()
+            for (tier, _), count in self._active.items():
+                totals[tier] += count
+            return dict(totals)
@@ -1,159 +1,293 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
-from werkzeug.utils import secure_filename
-from flask_bcrypt import Bcrypt
-import stripe
-import config
+from flask import (Blueprint, Flask, request, jsonify, render_template, redirect, url_for, flash, session, send_file,
+                   Response, stream_with_context, current_app)
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
-from pdf2image import convert_from_path
-import PyPDF2
-from docx import Document
-from pptx import Presentation
-import fitz  # PyMuPDF
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
+import logging
 import os
-import re
+import threading
 from dotenv import load_dotenv
-import google.generativeai as genai
-from pymongo import MongoClient
-import json
-import time
 
+# Before the project modules, some of them read their settings at import
 load_dotenv()
 
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from accounts import HasherBusy, duplicate_field
+from admission import TIERS
+from blob_store import BlobNotFound
+from jobs import QueueFull
+from pipelines import (BUSY_ERROR, QUIZ_QUESTIONS, UPLOAD_EXPIRED_ERROR, admit, error_response, free_job_result,
+                       job_accepted, job_status, last_event_id, parse_generation_request, premium_job_storing,
+                       profile_plan, queue_full_response, requested_flashcard_number, select_upload_text,
+                       session_plan, start_generating)
+from generation import generate_deck, stream_deck
+from extractor import extract_document
+from gemini import response_cache
+from card_store import FLASHCARD, QUIZ, export_point
+from services import Services
+from sessions import page_count, page_paragraphs
+from telemetry import REGISTRY, configure_logging, gauge, instrumentation_from_env, span
+from text_prep import prepare_pages
+from http_utils import (EXPOSED_HEADERS, compress_stream, compressed, decode_cursor, encode_cursor, etag_matches,
+                        json_response, make_etag, not_modified, request_params)
+from export import EXPORT_FORMATS, isoformat, parse_timestamp
+from reviews import MAX_DUE_CARDS, InvalidReview, parse_reviews
+import json
 
-app = Flask(__name__)
-
-# Advanced CORS configuration
-cors = CORS(app, resources={r"/*": {"origins": "*"}})
-
-app.secret_key = os.getenv('SECRET_KEY')
-bcrypt = Bcrypt(app)
-
-# Set your Gemini API key
-api_key = os.getenv('API_KEY')
-genai.configure(api_key=api_key)
-
-app.config['UPLOAD_FOLDER'] = 'uploads'
+logger = logging.getLogger(__name__)
 
-# Set up MongoDB
-client = MongoClient(os.getenv('MONGO_URI'))
-db = client.flashy
-flashcards_collection = db.flashcards
-users = db.users
+# Routes are registered on the app by create_app()
+bp = Blueprint('flashy', __name__)
 
+# Mongo, the card store, job queue and the other backends of the current app
+services = LocalProxy(lambda: current_app.extensions['flashy'])
 
-# Static folder for storing generated images from pdf
-if not os.path.exists('static'):
-    os.makedirs('static')
 
+ALLOWED_EXTENSIONS = {'pdf', 'pptx', 'docx'}
 
-def chunk_text_by_lines(paragraphs, lines_per_page=25):
-    chunks = []
-    current_chunk = []
-    current_lines = 0
-    for p in paragraphs:
-        lines_in_p = p.count('\n') + 1
-        if current_lines + lines_in_p > lines_per_page:
-            chunks.append(current_chunk)
-            current_chunk = []
-            current_lines = 0
-        current_chunk.append(p)
-        current_lines += lines_in_p
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
+# Largest page /flashcards serves in one response
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '200'))
 
+# DOCX and PPTX pages sent with a preview, and the most /upload_pages serves at once
+PREVIEW_PAGES = int(os.getenv('PREVIEW_PAGES', '10'))
+MAX_PREVIEW_PAGES = 100
 
+# Files one /process_bulk request may upload
+BULK_MAX_FILES = int(os.getenv('BULK_MAX_FILES', '50'))
 
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
+# Cards a bulk job collects before writing them in one batch
+BULK_WRITE_BATCH = int(os.getenv('BULK_WRITE_BATCH', '500'))
 
-ALLOWED_EXTENSIONS = {'pdf', 'pptx', 'docx'}
+# Files of all bulk jobs parsed and generated at once. Parsing is further
+# bounded by EXTRACT_WORKERS and Gemini calls by LLM_CONCURRENCY.
+bulk_pool = ThreadPoolExecutor(max_workers=int(os.getenv('BULK_FILE_CONCURRENCY', '6')), thread_name_prefix='bulk')
 
 def allowed_file(filename):
     return '.' in filename and \
             filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+@bp.route('/')
 def index():
     return "Welcome to the Flashy API"
 
 # Route for generated cards for free version
-@app.route('/generated_cards_free')
+@bp.route('/generated_cards_free')
 def generated_cards_free():
     return render_template('generated_cards_free.html')
 
 # Route for generated cards for premium version
-@app.route('/generated_cards')
+@bp.route('/generated_cards')
 def generated_cards():
     return render_template('generated_cards.html')
 
 # Route for viewing flashcard page
-@app.route('/view_flashcards')
+@bp.route('/view_flashcards')
 def view_flashcards():
     return render_template('view_flashcards.html')
 
 # Upload for free version
-@app.route('/upload_free_page')
+@bp.route('/upload_free_page')
 def upload_free_page():
     return render_template('upload_free.html')
 
 # Upload for premium users
-@app.route('/upload_page')
+@bp.route('/upload_page')
 def upload_page():
     if 'user_id' not in session:
         flash("Please log in to access your dashboard.")
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     return render_template('upload.html', username=session['username'], plan=session['plan'])
 
 # Route for fetching courses in request.jsonbase
-@app.route('/courses', methods=['POST'])
+@bp.route('/courses', methods=['GET', 'POST'])
+@compressed
 def get_courses():
-    username = request.json.get('username')
+    username = request_params().get('username')
+
+    courses = services.card_store.courses(username)
+    etag = make_etag('courses', username, courses)
+    if etag_matches(etag):
+        return not_modified(etag)
 
-    courses = flashcards_collection.distinct('course', {'username': username})
-    return jsonify({'courses': courses})
+    response = json_response({'courses': courses})
+    response.set_etag(etag, weak=True)
+    return response
 
 
-# Route for retrieving flashcards from request.jsonbase
-@app.route('/flashcards', methods=['POST'])
+# Card type filter of /flashcards
+CARD_TYPES = {'flashcards': FLASHCARD, 'quizzes': QUIZ}
+
+
+# Route for retrieving flashcards from request.jsonbase.
+# Without `limit` the whole deck is returned. With `limit` a single page of
+# one `type` (flashcards or quizzes) is returned with a `next_cursor`.
+@bp.route('/flashcards', methods=['GET', 'POST'])
+@compressed
 def get_flashcards():
-    username = request.json.get('username')
-    course = request.json.get('selectedCourse')
-    
-    # Find the document based on username and course
-    flashcards_data = flashcards_collection.find_one({'username': username, 'course': course})
-    
-    if flashcards_data:
-        return jsonify({
-            'flashcards': flashcards_data.get('flashcards', []),
-            'quizzes': flashcards_data.get('quizzes', [])
-        })
-    return jsonify({'flashcards': [], 'quizzes': []})
+    params = request_params()
+    username = params.get('username')
+    course = params.get('selectedCourse')
+    card_type = params.get('type', 'flashcards')
+    limit = params.get('limit')
+    cursor = params.get('cursor')
+
+    if card_type not in CARD_TYPES:
+        return jsonify({'error': 'type must be flashcards or quizzes'}), 400
+    try:
+        limit = min(int(limit), MAX_PAGE_SIZE) if limit is not None else None
+        position = decode_cursor(cursor)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    # The deck version changes on every write, so an unchanged deck is
+    # answered without loading any cards
+    version = services.card_store.deck_version(username, course)
+    etag = make_etag('flashcards', username, course, version, card_type if limit else None, limit, cursor)
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    if limit is None:
+        # Find the cards based on username and course
+        deck = services.card_store.get_deck(username, course)
+        payload = {'flashcards': deck['flashcards'], 'quizzes': deck['quizzes'], 'version': version}
+    else:
+        try:
+            items, next_position = services.card_store.page(username, course, CARD_TYPES[card_type], limit, position)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid limit or cursor'}), 400
+        payload = {card_type: items, 'next_cursor': encode_cursor(next_position), 'version': version}
+
+    response = json_response(payload)
+    response.set_etag(etag, weak=True)
+    return response
+
+# Stream a user's whole library for offline study: every course with its
+# flashcards and quizzes as NDJSON, CSV or an Anki import file (`format`).
+# `since` (ISO 8601) limits the export to decks written after it, clients
+# pass the `X-Exported-At` of their previous export.
+@bp.route('/export')
+def export_library():
+    username = request.args.get('username')
+    export_format = EXPORT_FORMATS.get(request.args.get('format', 'ndjson'))
+    if not username:
+        return jsonify({'error': 'username is required'}), 400
+    if export_format is None:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        since = parse_timestamp(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'Invalid since, expected an ISO 8601 timestamp'}), 400
+
+    # Decks written while the export runs are exported again next time
+    exported_at = export_point(services.db)
+    decks = services.card_store.export(username, since)
+    response = Response(mimetype=export_format.mimetype)
+    chunks = export_format.write(decks, username, since, exported_at)
+    response.response = stream_with_context(compress_stream(response, chunks))
+    response.headers['X-Exported-At'] = isoformat(exported_at)
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers.set(
+        'Content-Disposition', 'attachment', filename=f'flashy-{username}.{export_format.extension}'
+    )
+    return response
+
+
+# Review schedule of a card as the review routes return it
+def schedule_payload(state):
+    return {
+        'due': isoformat(state.get('due')),
+        'interval': state.get('interval'),
+        'ease': state.get('ease'),
+        'reps': state.get('reps'),
+        'lapses': state.get('lapses')
+    }
+
+
+# Route for the next cards to review, most overdue first. `course` limits
+# them to one course, `limit` sets how many are returned.
+@bp.route('/reviews/due', methods=['GET', 'POST'])
+def due_reviews():
+    params = request_params()
+    username = params.get('username')
+    course = params.get('course')
+    try:
+        limit = int(params.get('limit', 20))
+    except (TypeError, ValueError):
+        limit = 0
+    if not username:
+        return jsonify({'error': 'username is required'}), 400
+    if not 1 <= limit <= MAX_DUE_CARDS:
+        return jsonify({'error': f'limit must be between 1 and {MAX_DUE_CARDS}'}), 400
+
+    now = datetime.datetime.utcnow()
+    with span('review_due'):
+        due = services.review_store.due(username, limit, course, now)
+        cards = services.card_store.cards_by_id(username, due) if due else {}
+    return json_response({
+        'cards': [
+            dict(schedule_payload(doc), card_id=doc['_id'], course=doc.get('course'), kind=doc.get('kind'),
+                 card=cards[doc['_id']])
+            for doc in due if doc['_id'] in cards
+        ],
+        'now': isoformat(now)
+    })
+
+
+# Route recording a batch of reviews, e.g. a study session synced at once:
+# {"username": ..., "reviews": [{"card_id", "quality" (0-5), "reviewed_at"?}]}
+@bp.route('/reviews', methods=['POST'])
+def record_reviews():
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    if not username:
+        return jsonify({'error': 'username is required'}), 400
+    try:
+        reviews = parse_reviews(data.get('reviews'))
+    except InvalidReview as e:
+        return jsonify({'error': str(e)}), 400
+
+    with span('mongo_write'):
+        updated = services.review_store.record(username, reviews)
+    return jsonify({
+        'recorded': sum(1 for reviewed_id, _, _ in reviews if reviewed_id in updated),
+        'schedules': {reviewed_id: schedule_payload(state) for reviewed_id, state in updated.items()},
+        'unknown': sorted({reviewed_id for reviewed_id, _, _ in reviews} - set(updated))
+    })
+
 
 # Route for fetching user details
-@app.route('/userAccount', methods=['POST'])
+@bp.route('/userAccount', methods=['POST'])
 def get_userAccount():
     username = request.json.get('username')
     
-    # Find the user in the database
-    user = users.find_one({'username': username})
+    # Find the user in the profile cache, then the database
+    profile = services.profiles.get(username)
     
-    if user:
-        email = user.get('email')
-        plan = user.get('plan')
-        return jsonify({'email': email, 'plan': plan}), 200
+    if profile:
+        return jsonify({'email': profile['email'], 'plan': profile['plan']}), 200
     else:
         return jsonify({'error': 'User not found'}), 404
 
 
+def hasher_busy():
+    return error_response(BUSY_ERROR, 503, retry_after=5)
+
+
 # Register user
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register():
     username = request.json.get('username')
     email = request.json.get('email')
     password = request.json.get('password')
 
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    try:
+        hashed_password = services.password_hasher.hash(password)
+    except HasherBusy:
+        return hasher_busy()
 
     user_data = {
         "username": username,
@@ -162,25 +296,40 @@ def register():
         "plan": "premium"
     }
 
-    if users.find_one({"email": email}):
-        return jsonify({'error': 'Email already registered!'}), 400
-
-    if users.find_one({"username": username}):
+    # The unique indexes on email and username reject duplicates
+    try:
+        services.users.insert_one(user_data)
+    except DuplicateKeyError as e:
+        field = duplicate_field(e) or (
+            'email' if services.users.find_one({'email': email}, {'_id': 1}) else 'username'
+        )
+        if field == 'email':
+            return jsonify({'error': 'Email already registered!'}), 400
         return jsonify({'error': 'Username already registered!'}), 400
-
-    users.insert_one(user_data)
     
     return jsonify({'message': 'Registration successful!'}), 201
 
 
 # Login User
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     email = request.json.get('email')
     password = request.json.get('password')
 
+    users = services.users
     user = users.find_one({"email": email})
-    if user and bcrypt.check_password_hash(user['password'], password):
+    try:
+        valid = bool(user) and services.password_hasher.check(user['password'], password)
+    except HasherBusy:
+        return hasher_busy()
+
+    if valid:
+        # Upgrade hashes made with an older work factor
+        if services.password_hasher.needs_rehash(user['password']):
+            services.password_hasher.rehash_later(password, lambda hashed: users.update_one(
+                {'_id': user['_id'], 'password': user['password']},
+                {'$set': {'password': hashed}}
+            ))
         session['user_id'] = str(user['_id'])
         session['username'] = user['username']
         session['plan'] = user['plan']
@@ -190,340 +339,556 @@ def login():
 
 
 # Logout User
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     return jsonify({'message': 'You have been logged out.'}), 200
 
 
+# Save an upload under its content hash and parse it once.
+# Re-uploading a document that was already parsed skips parsing entirely.
+def start_upload_session(file, file_ext):
+    with span('upload_save'):
+        upload_id = services.upload_sessions.save(file, file_ext)
+    return upload_id, parse_upload(upload_id, file_ext)
+
+
+# Parsed session of a saved upload, parsing it if it is new
+def parse_upload(upload_id, file_ext):
+    upload_sessions = services.upload_sessions
+    parsed = upload_sessions.get(upload_id)
+    if parsed is None:
+        # One pass over the document, page images are rendered lazily by /page_image
+        with span('parse'), upload_sessions.document_file(upload_id, file_ext) as path:
+            document = extract_document(path, file_ext)
+        parsed = upload_sessions.put(upload_id, file_ext, document.pages, document.preview)
+    return parsed
+
+
+# Pages `start` to `start + count - 1` of an upload as the preview shows
+# them: image URLs for PDFs, paragraphs for DOCX and PPTX. `next_url` serves
+# the pages after them, if there are any.
+def preview_pages(upload_id, parsed, start, count):
+    file_ext = parsed['file_ext']
+    total = page_count(parsed)
+    end = min(total, start + count - 1)
+    payload = {'file_ext': file_ext, 'upload_id': upload_id, 'page_count': total, 'start': start}
+    if file_ext == 'pdf':
+        payload['images'] = [
+            url_for('.page_image', upload_id=upload_id, page_num=page_num, _external=True)
+            for page_num in range(start, end + 1)
+        ]
+    else:
+        payload['pages'] = [page_paragraphs(parsed, page_num) for page_num in range(start, end + 1)]
+    payload['next_url'] = url_for(
+        '.upload_pages', upload_id=upload_id, start=end + 1, count=count, _external=True
+    ) if end < total else None
+    return payload
+
+
+# Build the preview response for an upload session. Image URLs are cheap, so
+# PDFs list every page. DOCX and PPTX previews only carry the first
+# PREVIEW_PAGES pages, the rest come from /upload_pages.
+def preview_payload(upload_id, parsed):
+    count = page_count(parsed) if parsed['file_ext'] == 'pdf' else PREVIEW_PAGES
+    return preview_pages(upload_id, parsed, 1, max(count, 1))
+
+
+# Route for a range of preview pages, `?start=` (1-based) and `?count=`
+@bp.route('/upload_pages/<upload_id>')
+def upload_pages(upload_id):
+    parsed = services.upload_sessions.get(upload_id)
+    if parsed is None:
+        return jsonify({'error': UPLOAD_EXPIRED_ERROR}), 404
+    try:
+        start = int(request.args.get('start', 1))
+        count = int(request.args.get('count', PREVIEW_PAGES))
+    except ValueError:
+        return jsonify({'error': 'Invalid page range'}), 400
+    if not 1 <= start <= page_count(parsed) or not 1 <= count <= MAX_PREVIEW_PAGES:
+        return jsonify({'error': 'Invalid page range'}), 400
+    return jsonify(preview_pages(upload_id, parsed, start, count))
+
+
+# Route for a rendered PDF page, rendered on first request and cached afterwards
+@bp.route('/page_image/<upload_id>/<int:page_num>')
+def page_image(upload_id, page_num):
+    parsed = services.upload_sessions.get(upload_id)
+    if parsed is None or parsed['file_ext'] != 'pdf':
+        return jsonify({'error': UPLOAD_EXPIRED_ERROR}), 404
+    if not 1 <= page_num <= page_count(parsed):
+        return jsonify({'error': 'Page out of range'}), 404
+
+    try:
+        image = services.page_cache.get_or_render(
+            upload_id, page_num, lambda: services.upload_sessions.document_file(upload_id, 'pdf')
+        )
+    except BlobNotFound:
+        return jsonify({'error': UPLOAD_EXPIRED_ERROR}), 404
+    # Streamed in chunks. Rendered pages never change for a given upload ID.
+    response = send_file(image, mimetype=services.page_cache.mimetype, max_age=86400)
+    response.content_length = image.size
+    return response
+
+
 # Upload for free version
-@app.route('/preview_free_upload', methods=['POST'])
+@bp.route('/preview_free_upload', methods=['POST'])
 def preview_free_upload_file():
     if 'file' not in request.files:
         return jsonify({'error': 'No file part in the request'}), 400
 
     file = request.files['file']
-    print('file uploaded')
+    logger.debug("File uploaded: %s", file.filename)
 
     if file:
         file_ext = file.filename.split('.')[-1].lower()
-        if file_ext == 'pdf':
-            file.save('uploaded_doc.pdf')
-            images = convert_from_path('uploaded_doc.pdf', 500, poppler_path=r'C:\Program Files\poppler-24.07.0\Library\bin')
-            image_paths = []
-            for i, image in enumerate(images):
-                image_path = f'static/page_{i + 1}.png'
-                image.save(image_path, 'PNG')
-                image_paths.append(url_for('static', filename=f'page_{i + 1}.png', _external=True))
-            return jsonify({'file_ext': 'pdf', 'images': image_paths})
-        elif file_ext == 'docx':
-            file.save('uploaded_doc.docx')
-            doc = Document('uploaded_doc.docx')
-            paragraphs = [p.text for p in doc.paragraphs]
-            pages = chunk_text_by_lines(paragraphs)
-            return jsonify({'file_ext': 'docx', 'pages': pages})
-        elif file_ext == 'pptx':
-            file.save('uploaded_presentation.pptx')
-            ppt = Presentation('uploaded_presentation.pptx')
-            slides_content = []
-            for slide in ppt.slides:
-                slide_text = []
-                for shape in slide.shapes:
-                    if hasattr(shape, 'text'):
-                        slide_text.append(shape.text)
-                slides_content.append('\n'.join(slide_text))
-            pages = chunk_text_by_lines(slides_content)
-            return jsonify({'file_ext': 'pptx', 'pages': pages})
+        if allowed_file(file.filename):
+            upload_id, parsed = start_upload_session(file, file_ext)
+            return jsonify(preview_payload(upload_id, parsed))
 
     return jsonify({'error': 'Unsupported file type'}), 400
 
 
 
 # Upload for premium users
-@app.route('/preview_upload', methods=['POST'])
+@bp.route('/preview_upload', methods=['POST'])
 def preview_upload_file():
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
 
     file = request.files['file']
-    print('file uploaded')
     username = request.form.get('username')
     course = request.form.get('course', 'general').title()
-    print(course)
-    print(username)
+    logger.debug("File uploaded: %s", file.filename, extra={'username': username, 'course': course})
 
     if file:
         file_ext = file.filename.split('.')[-1].lower()
-        if file_ext == 'pdf':
-            file.save('uploaded_doc.pdf')
-            images = convert_from_path('uploaded_doc.pdf', 500, poppler_path=r'C:\Program Files\poppler-24.07.0\Library\bin')
-            image_paths = []
-            for i, image in enumerate(images):
-                image_path = f'static/page_{i + 1}.png'
-                image.save(image_path, 'PNG')
-                image_paths.append(url_for('static', filename=f'page_{i + 1}.png', _external=True))
-            return jsonify({'file_ext': file_ext, 'images': image_paths, 'course': course, 'username': username})
-        elif file_ext == 'docx':
-            file.save('uploaded_doc.docx')
-            doc = Document('uploaded_doc.docx')
-            paragraphs = [p.text for p in doc.paragraphs]
-            pages = chunk_text_by_lines(paragraphs)
-            return jsonify({'file_ext': file_ext, 'pages': pages, 'course': course, 'username': username})
-        elif file_ext == 'pptx':
-            file.save('uploaded_presentation.pptx')
-            ppt = Presentation('uploaded_presentation.pptx')
-            slides_content = []
-            for slide in ppt.slides:
-                slide_text = []
-                for shape in slide.shapes:
-                    if hasattr(shape, 'text'):
-                        slide_text.append(shape.text)
-                slides_content.append('\n'.join(slide_text))
-            pages = chunk_text_by_lines(slides_content)
-            return jsonify({'file_ext': file_ext, 'pages': pages, 'course': course, 'username': username})
+        if allowed_file(file.filename):
+            upload_id, parsed = start_upload_session(file, file_ext)
+            payload = preview_payload(upload_id, parsed)
+            payload.update({'course': course, 'username': username})
+            return jsonify(payload)
         else:
             return jsonify({'error': 'Unsupported file type'}), 400
 
     return jsonify({'error': 'No file uploaded'}), 400
 
 
-# Generate cards for free users
-@app.route('/process_free', methods=['POST'])
-def process_free_pages():
-    selected_pages = request.json.get('pages')
-    file_ext = request.json.get('file_ext')
-    flashcard_number = request.json.get('flashcard_number')
+# Store generated cards, leaving out near-duplicates of the existing deck
+def store_cards(username, course, flashcards=(), quiz_cards=()):
+    def write(flashcards, quiz_cards):
+        with span('mongo_write'):
+            services.card_store.add(username, course, flashcards, quiz_cards)
+            services.review_store.add(username, course, flashcards, quiz_cards)
+
+    deduplicator = services.deduplicator
+    if deduplicator is None:
+        write(flashcards, quiz_cards)
+        return flashcards, quiz_cards
+    return deduplicator.store(username, course, flashcards, quiz_cards, write)
+
+
+# Free tier pipeline, runs on a job worker
+def run_free_job(job, extracted_text, generation):
+    flashcards, _ = generate_deck(extracted_text, generation.flashcard_number, **start_generating(job, generation, 0.9))
+    return free_job_result(job, flashcards)
+
+
+# Premium pipeline, runs on a job worker
+def run_premium_job(job, extracted_text, generation):
+    # Flashcards and quiz are generated concurrently
+    flashcards, quiz_cards = generate_deck(
+        extracted_text, generation.flashcard_number, generation.quiz_number,
+        **start_generating(job, generation, 0.8)
+    )
+    # Store or update the flashcards and quiz cards in MongoDB
+    premium_job_storing(job, flashcards, quiz_cards)
+    store_cards(generation.username, generation.course, flashcards, quiz_cards)
+
+    return {'flashcards': flashcards, 'quiz_cards': quiz_cards}
+
+
+# Per-file state of a bulk job. Every progress event carries the entry that
+# changed as `file`, the job keeps the whole list for polling. Entries are
+# replaced rather than changed, so a copy of the list is a consistent snapshot.
+class BulkProgress:
+    def __init__(self, job, files):
+        self.job = job
+        self.files = files
+        self._lock = threading.Lock()
+
+    def update(self, index, stage='processing', **state):
+        with self._lock:
+            entry = self.files[index] = dict(self.files[index], **state)
+            finished = sum(item['status'] in BULK_FINISHED for item in self.files)
+            self.job.update(stage, 0.9 * finished / len(self.files), files=self.files, file=dict(entry, index=index))
+
+
+BULK_FINISHED = {'generated', 'failed', 'skipped'}
+
+# Error of a file that failed, details such as paths stay in the log
+BULK_FILE_ERROR = 'Could not process this file'
+
+
+# One file of a bulk job, runs on the bulk pool: parse, prepare, generate
+def run_bulk_file(progress, index, flashcard_number, quiz_number, use_cache=True):
+    entry = progress.files[index]
+    progress.update(index, status='parsing')
+    upload_sessions = services.upload_sessions
+    parsed = parse_upload(entry['upload_id'], entry['file_ext'])
+
+    total = page_count(parsed)
+    with span('text_prep'):
+        prepared = prepare_pages(upload_sessions.selected_pages(parsed, range(1, total + 1)))
+    progress.update(index, status='generating', page_count=total, **prepared.report())
+    return generate_deck(prepared.text, flashcard_number, quiz_number, use_cache=use_cache, tier=progress.job.tier)
+
+
+# Bulk pipeline, runs on a job worker. Files are parsed and generated
+# concurrently on the bulk pool, and their cards are written in batches of
+# BULK_WRITE_BATCH. Files that fail are reported, the job only fails if all do.
+def run_bulk_job(job, files, flashcard_number, quiz, username, course, use_cache=True):
+    quiz_number = QUIZ_QUESTIONS if quiz == 'yes' else 0
+    progress = BulkProgress(job, files)
+    futures = {
+        bulk_pool.submit(in_app_context(run_bulk_file), progress, index, flashcard_number, quiz_number,
+                         use_cache=use_cache): index
+        for index, entry in enumerate(files) if entry['status'] == 'queued'
+    }
 
-    try:
-        extracted_text = ''
-        flashcards = ''
-        
-        if file_ext == 'pdf':
-            reader = PyPDF2.PdfReader('uploaded_doc.pdf')
-            for page_num in selected_pages:
-                page = reader.pages[int(page_num) - 1]
-                extracted_text += page.extract_text()
-            # Delete images after processing
-            for i in range(len(reader.pages)):
-                image_path = f'static/page_{i + 1}.png'
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            if os.path.exists('uploaded_doc.pdf'):
-                os.remove('uploaded_doc.pdf')
-            print(extracted_text)
-
-        elif file_ext == 'docx':
-            doc = Document('uploaded_doc.docx')
-            paragraphs = [p.text for p in doc.paragraphs]
-            pages = chunk_text_by_lines(paragraphs)
-            for page_num in selected_pages:
-                extracted_text += '\n'.join(pages[int(page_num) - 1])
-            if os.path.exists('uploaded_doc.docx'):
-                os.remove('uploaded_doc.docx')
-            print(extracted_text)
-
-        elif file_ext == 'pptx':
-            ppt = Presentation('uploaded_presentation.pptx')
-            slides_content = []
-            for slide in ppt.slides:
-                slide_text = []
-                for shape in slide.shapes:
-                    if hasattr(shape, 'text'):
-                        slide_text.append(shape.text)
-                slides_content.append('\n'.join(slide_text))
-            pages = chunk_text_by_lines(slides_content)
-            for page_num in selected_pages:
-                extracted_text += '\n'.join(pages[int(page_num) - 1])
-            if os.path.exists('uploaded_presentation.pptx'):
-                os.remove('uploaded_presentation.pptx')
-
-        # Generate flashcards
-        flashcards = generate_flashcards(extracted_text, flashcard_number)
-        print(flashcards)
-        return jsonify({'flashcards': flashcards})
-
-    except Exception as e:
-        print(f"Error processing file: {e}")
-        return jsonify({'error': 'An error occurred while processing the file.'}), 500
+    stored_flashcards, stored_quiz_cards = [], []
+    pending_flashcards, pending_quiz_cards = [], []
 
+    def flush():
+        flashcards, quiz_cards = store_cards(username, course, pending_flashcards, pending_quiz_cards)
+        stored_flashcards.extend(flashcards)
+        stored_quiz_cards.extend(quiz_cards)
+        pending_flashcards.clear()
+        pending_quiz_cards.clear()
 
+    failures = 0
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            flashcards, quiz_cards = future.result()
+        except Exception:
+            logger.exception("Bulk job %s: %s failed", job.id, files[index]['filename'])
+            failures += 1
+            progress.update(index, status='failed', error=BULK_FILE_ERROR)
+            continue
+        pending_flashcards.extend(flashcards)
+        pending_quiz_cards.extend(quiz_cards)
+        progress.update(index, status='generated', flashcard_count=len(flashcards), quiz_count=len(quiz_cards))
+        if len(pending_flashcards) + len(pending_quiz_cards) >= BULK_WRITE_BATCH:
+            flush()
+
+    if futures and failures == len(futures):
+        raise RuntimeError("No file could be processed.")
+    job.update('storing', 0.95)
+    if pending_flashcards or pending_quiz_cards:
+        flush()
+
+    return {
+        'files': files,
+        'flashcards': stored_flashcards,
+        'quiz_cards': stored_quiz_cards
+    }
 
-# Generating cards for premium users
-@app.route('/process', methods=['POST'])
-def process_pages():
-    selected_pages = request.json.get('pages')
-    flashcard_number = request.json.get('flashcard_number')
-    quiz = request.json.get('quiz')
-    file_ext = request.json.get('file_ext')
-    course = request.json.get('course', 'General')
-    username = request.json.get('username')
-    print(f"Selected Pages: {selected_pages}")
-    print(f"Flashcard Number: {flashcard_number}")
-    print(f"Quiz: {quiz}")
-    print(f"File Extension: {file_ext}")
-    print(f"Course: {course}")
-    print(f"Username: {username}")
 
+# Run a job function inside the app context, job workers have none of their own
+def in_app_context(fn):
+    app = current_app._get_current_object()
 
-    try:
-        extracted_text = ''
-        flashcards = []
+    def run(job, *args, **kwargs):
+        with app.app_context():
+            return fn(job, *args, **kwargs)
+    return run
 
-        # Process the file according to the extension
-        if file_ext == 'pdf':
-            reader = PyPDF2.PdfReader('uploaded_doc.pdf')
-            for page_num in selected_pages:
-                page = reader.pages[int(page_num) - 1]
-                extracted_text += page.extract_text()
-            # Delete images after processing
-            for i in range(len(reader.pages)):
-                image_path = f'static/page_{i + 1}.png'
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            if os.path.exists('uploaded_doc.pdf'):
-                os.remove('uploaded_doc.pdf')
-
-        elif file_ext == 'docx':
-            doc = Document('uploaded_doc.docx')
-            paragraphs = [p.text for p in doc.paragraphs]
-            pages = chunk_text_by_lines(paragraphs)
-            for page_num in selected_pages:
-                extracted_text += '\n'.join(pages[int(page_num) - 1])
-            if os.path.exists('uploaded_doc.docx'):
-                os.remove('uploaded_doc.docx')
-
-        elif file_ext == 'pptx':
-            ppt = Presentation('uploaded_presentation.pptx')
-            slides_content = []
-            for slide in ppt.slides:
-                slide_text = []
-                for shape in slide.shapes:
-                    if hasattr(shape, 'text'):
-                        slide_text.append(shape.text)
-                slides_content.append('\n'.join(slide_text))
-            pages = chunk_text_by_lines(slides_content)
-            for page_num in selected_pages:
-                extracted_text += '\n'.join(pages[int(page_num) - 1])
-            if os.path.exists('uploaded_presentation.pptx'):
-                os.remove('uploaded_presentation.pptx')
-
-        # Generate flashcards
-        flashcards = generate_flashcards(extracted_text, flashcard_number)
-        print(flashcards)
-
-        # Store or update the flashcards in MongoDB
-        flashcards_collection.update_one(
-            {'username': username, 'course': course},
-            {'$addToSet': {'flashcards': {'$each': flashcards}}},
-            upsert=True
-        )
 
-        quiz_cards = []
-        if quiz == 'yes':
-            quiz_number = 5
-            quiz_cards = generate_quiz(extracted_text, quiz_number)
-            print(quiz_cards)
-
-            # Store or update the quiz cards in MongoDB
-            flashcards_collection.update_one(
-                {'username': username, 'course': course},
-                {'$addToSet': {'quizzes': {'$each': quiz_cards}}},
-                upsert=True
-            )
-
-        return jsonify({'flashcards': flashcards, 'quiz_cards':quiz_cards})
-
-    except Exception as e:
-        # Handle any errors that occur during processing
-        return str(e)
-
-
-# Clean flashcard response
-def clean_text(text):
-    # Remove asterisks
-    text = text.replace('*', '')
-    # Remove HTML line breaks
-    text = text.replace('<br>', '\n')
-    # Remove any other unwanted symbols (e.g., extra spaces)
-    text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with a single space
-    return text.strip()
-
-# Flashcard generation with gemini
-def generate_flashcards(text, num_flashcards, retries=3):
-    prompt = f"Create {num_flashcards} flashcards from the following text:\n\n{text}\n\n Return answers in json format as an array of objects with 'front' and 'back' keys. Everything should be inline, no backslash n"
-
-    for attempt in range(retries):
-        try:
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            response = model.generate_content(prompt)
-            print(response)
-            
-            if response and response.candidates:
-                flashcards_text = response.candidates[0].content.parts[0].text
-                
-                # Find the start of the JSON array
-                json_start = flashcards_text.find("[")
-                if json_start != -1:
-                    json_text = flashcards_text[json_start:]
-                    try:
-                        flashcards = json.loads(json_text)
-                        # Clean up the flashcards
-                        for card in flashcards:
-                            card['front'] = clean_text(card['front'])
-                            card['back'] = clean_text(card['back'])
-                        return flashcards
-                    except json.JSONDecodeError as e:
-                        print(f"JSON decode error on attempt {attempt + 1}: {e}")
-                else:
-                    print(f"No JSON array found in the response on attempt {attempt + 1}.")
-            else:
-                print(f"Error generating flashcards on attempt {attempt + 1}.")
-        
-        except Exception as e:
-            print(f"Unexpected error on attempt {attempt + 1}: {e}")
-        
-        time.sleep(1)  # Optional: wait 1 second before retrying
+# Plan a generation request of `username` is scheduled under: the session's
+# plan when it is the logged-in user, else the plan stored on the user
+def request_plan(username):
+    known, plan = session_plan(session, username)
+    return plan if known else profile_plan(services.profiles.get(username))
+
 
-    return "Error generating flashcards after multiple attempts."
+# Admit a generation request, returns (Ticket, error_response). Anonymous
+# users are told apart by address.
+def admit_request(username, plan):
+    return admit(services.admission, username or request.remote_addr, plan)
 
 
-# Quiz Generation with gemini
-def generate_quiz(text, num_quiz, retries=3):
-    prompt = f"Create {num_quiz} multiple-choice questions with answers from the following text:\n\n{text}\n\nReturn answers in JSON format as an array of objects with 'question', 'options' (an array of four possible answers), and 'answer' keys. Everything should be inline, no backslash n and no backslash either."
+# Queue a pipeline admitted with `ticket` and answer with where to follow it,
+# plus anything in `report`. The ticket is released when the job finishes.
+def submit_job(kind, fn, *args, ticket, report=None, **kwargs):
+    run = in_app_context(fn)
 
-    for attempt in range(retries):
+    def admitted(job, *args, **kwargs):
         try:
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            response = model.generate_content(prompt)
-            # print(response)
-            
-            if response and response.candidates:
-                # Extract the text from the response
-                quiz_text = response.candidates[0].content.parts[0].text
-                
-                # Find the start of the JSON array
-                json_start = quiz_text.find("[")
-                if json_start != -1:
-                    json_text = quiz_text[json_start:]
-                    try:
-                        quiz = json.loads(json_text)
-                        return quiz
-                    except json.JSONDecodeError as e:
-                        print(f"JSON decode error on attempt {attempt + 1}: {e}")
-                else:
-                    print(f"No JSON array found in the response on attempt {attempt + 1}.")
-            else:
-                print(f"Error generating flashcards on attempt {attempt + 1}.")
-        
-        except Exception as e:
-            print(f"Unexpected error on attempt {attempt + 1}: {e}")
-        
-        time.sleep(1)  # Optional: wait 1 second before retrying
+            return run(job, *args, **kwargs)
+        finally:
+            ticket.release()
+
+    try:
+        job = services.job_queue.submit(kind, admitted, *args, tier=ticket.tier, **kwargs)
+    except QueueFull:
+        ticket.release()
+        return queue_full_response()
+    return job_accepted(job, url_for, report)
+
+
+# Parse a generation request and prepare the text of its pages, returns
+# (GenerationRequest, PreparedText, error_response)
+def generation_request():
+    generation, error = parse_generation_request(request.json)
+    if error:
+        return None, None, error
+    # Attaches the Mongo tier of the Gemini response cache on first use
+    services.response_cache
+    prepared, error = select_upload_text(services.upload_sessions, generation.upload_id, generation.pages)
+    if error:
+        return None, None, error
+    logger.debug("Selected %d characters from upload %s", len(prepared.text), generation.upload_id,
+                 extra=generation.log_fields())
+    return generation, prepared, None
+
+
+# Generate cards for free users
+@bp.route('/process_free', methods=['POST'])
+def process_free_pages():
+    generation, prepared, error = generation_request()
+    if error:
+        return error
+    ticket, error = admit_request(session.get('username'), 'free')
+    if error:
+        return error
+    return submit_job('process_free', run_free_job, prepared.text, generation, ticket=ticket,
+                      report=prepared.report())
 
-    return "Error generating flashcards after multiple attempts."
 
+# Generating cards for premium users
+@bp.route('/process', methods=['POST'])
+def process_pages():
+    generation, prepared, error = generation_request()
+    if error:
+        return error
+    ticket, error = admit_request(generation.username, request_plan(generation.username))
+    if error:
+        return error
+    return submit_job('process', run_premium_job, prepared.text, generation, ticket=ticket,
+                      report=prepared.report())
+
+
+# Generate cards for a whole course at once. Every file is saved here and
+# processed by one background job, which reports progress per file.
+@bp.route('/process_bulk', methods=['POST'])
+def process_bulk():
+    uploads = [file for file in request.files.getlist('files') if file and file.filename]
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(uploads) > BULK_MAX_FILES:
+        return jsonify({'error': f'At most {BULK_MAX_FILES} files can be uploaded at once'}), 400
+    flashcard_number, error = requested_flashcard_number(request.form.get('flashcard_number'))
+    if error:
+        return error
+
+    username = request.form.get('username')
+    course = request.form.get('course', 'general').title()
+    quiz = request.form.get('quiz')
+    use_cache = request.form.get('no_cache', 'false').lower() not in ('1', 'true', 'yes')
+
+    files = []
+    for file in uploads:
+        entry = {'filename': file.filename}
+        if allowed_file(file.filename):
+            entry['file_ext'] = file.filename.rsplit('.', 1)[1].lower()
+            with span('upload_save'):
+                entry['upload_id'] = services.upload_sessions.save(file, entry['file_ext'])
+            entry['status'] = 'queued'
+        else:
+            entry.update(status='skipped', error='Unsupported file type')
+        files.append(entry)
+    if not any(entry['status'] == 'queued' for entry in files):
+        return jsonify({'error': 'Unsupported file type', 'files': files}), 400
+    ticket, error = admit_request(username, request_plan(username))
+    if error:
+        return error
+    # Attaches the Mongo tier of the Gemini response cache on first use
+    services.response_cache
+
+    logger.debug("Bulk upload of %d files", len(files), extra={'username': username, 'course': course})
+    return submit_job(
+        'process_bulk', run_bulk_job, files, flashcard_number, quiz, username, course,
+        ticket=ticket, report={'course': course, 'files': list(files)}, use_cache=use_cache
+    )
+
+
+# Stream generated cards to the client as NDJSON lines, or as server-sent
+# events when the client asks for text/event-stream. `on_finish` receives
+# every card that was sent, also when generation failed midway.
+def card_stream_response(cards, prepared, on_finish=None):
+    use_sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+
+    def events():
+        flashcards = []
+        try:
+            for card in cards:
+                flashcards.append(card)
+                yield 'card', {'card': card}
+            yield 'done', {'count': len(flashcards)}
+        except Exception as e:
+            logger.exception("Error streaming flashcards: %s", e)
+            yield 'error', {'error': 'An error occurred while generating flashcards.', 'count': len(flashcards)}
+        finally:
+            if on_finish and flashcards:
+                on_finish(flashcards)
+
+    def body():
+        for event, data in events():
+            if use_sse:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            else:
+                yield json.dumps(dict(data, type=event)) + '\n'
+
+    mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+    response = Response(stream_with_context(body()), mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['X-Input-Tokens'] = str(prepared.tokens)
+    response.headers['X-Input-Tokens-Saved'] = str(prepared.tokens_saved)
+    return response
+
+
+# Stream generated cards for free users
+@bp.route('/process_free_stream', methods=['POST'])
+def process_free_stream():
+    generation, prepared, error = generation_request()
+    if error:
+        return error
+    ticket, error = admit_request(session.get('username'), 'free')
+    if error:
+        return error
+
+    cards = stream_deck(prepared.text, generation.flashcard_number, use_cache=generation.use_cache,
+                        tier=ticket.tier)
+    response = card_stream_response(cards, prepared)
+    response.call_on_close(ticket.release)
+    return response
+
+
+# Stream generated cards for premium users, storing them once the stream ends
+@bp.route('/process_stream', methods=['POST'])
+def process_stream():
+    generation, prepared, error = generation_request()
+    if error:
+        return error
+    ticket, error = admit_request(generation.username, request_plan(generation.username))
+    if error:
+        return error
+
+    def store_flashcards(flashcards):
+        store_cards(generation.username, generation.course, flashcards)
+
+    cards = stream_deck(prepared.text, generation.flashcard_number, use_cache=generation.use_cache,
+                        tier=ticket.tier)
+    response = card_stream_response(cards, prepared, on_finish=store_flashcards)
+    response.call_on_close(ticket.release)
+    return response
+
+
+# Route for the Gemini response cache counters
+@bp.route('/cache_stats')
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+
+# Route for Prometheus: stage timings, request latency and counters
+@bp.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Route for polling a generation job
+@bp.route('/jobs/<job_id>')
+def get_job(job_id):
+    return job_status(services.job_queue.get(job_id))
+
+
+# Route for following a generation job with server-sent events
+@bp.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = services.job_queue.get(job_id)
+    if job is None:
+        return job_status(job)
+
+    events = job.sse_stream(last_event_id(request.headers))
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Route for load balancer and container health checks. It answers without
+# touching Mongo or Gemini, `?deep=1` also checks that Mongo is reachable.
+@bp.route('/health')
+def health():
+    if request.args.get('deep') != '1':
+        return jsonify({'status': 'ok'})
+    try:
+        services.mongo_client.admin.command('ping')
+    except PyMongoError as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ok', 'mongo': 'ok'})
+
+
+# Build the app. Mongo, the parsers and Gemini are only loaded when a request
+# first needs them, `config` overrides settings from the environment.
+def create_app(config=None):
+    # Level-gated logging instead of prints, see LOG_LEVEL and LOG_FORMAT
+    configure_logging()
+
+    app = Flask(__name__)
+
+    # Advanced CORS configuration
+    CORS(app, resources={r"/*": {
+        "origins": "*", "expose_headers": EXPOSED_HEADERS
+    }})
+
+    app.secret_key = os.getenv('SECRET_KEY')
+    app.config['MONGO_URI'] = os.getenv('MONGO_URI')
+    app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
+    app.config['PAGE_CACHE_FOLDER'] = os.getenv('PAGE_CACHE_FOLDER', 'page_cache')
+    app.config['TRUSTED_PROXIES'] = int(os.getenv('TRUSTED_PROXIES', '0'))
+    app.config.update(config or {})
+
+    # Behind load balancers the client address comes from X-Forwarded-For,
+    # anonymous generation requests are admitted by it
+    proxies = app.config['TRUSTED_PROXIES']
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+    app.extensions['flashy'] = app_services = Services(app.config)
+    app.register_blueprint(bp)
+
+    # Request timing for /metrics and sampled profiling, see PROFILE_SAMPLE_RATE
+    instrumentation_from_env().init_app(app)
+
+    # State that is tracked elsewhere, read when /metrics is scraped
+    gauge('flashy_jobs_queued', 'Generation jobs waiting for a worker', lambda: app_services.job_queue.queued())
+    for tier in TIERS:
+        gauge(f'flashy_jobs_queued_{tier}', f'{tier.title()} tier generation jobs waiting to start',
+              lambda tier=tier: app_services.queued_jobs(tier))
+    gauge('flashy_llm_cache_entries', 'Entries in the in-process Gemini response cache',
+          lambda: response_cache.stats()['entries'])
+    gauge('flashy_dedup_dropped_cards', 'Near-duplicate cards dropped since startup',
+          lambda: getattr(app_services.peek('deduplicator'), 'dropped', 0))
+
+    # Optionally connect and build everything before the first request arrives
+    if os.getenv('WARM_UP', '0') == '1':
+        app_services.warm_up_in_background()
+    return app
 
 
 if __name__ == '__main__':
     # app.run(debug=True)
-    app.run(host='0.0.0.0', port=5000)
+    create_app().run(host='0.0.0.0', port=5000)
@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from quart import Blueprint, Quart, Response, current_app, g, jsonify, request, session, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.local import LocalProxy
+
+from accounts import HasherBusy, duplicate_field
+from app import create_app
+from generation import agenerate_deck
+from http_utils import EXPOSED_HEADERS
+from jobs import QueueFull
+from pipelines import (BUSY_ERROR, admit, error_response, free_job_result, job_accepted, job_status, last_event_id,
+                       parse_generation_request, premium_job_storing, profile_plan, queue_full_response,
+                       select_upload_text, session_plan, start_generating)
+from telemetry import REQUEST_SECONDS, gauge, span
+
+logger = logging.getLogger(__name__)
+
+# ASGI serving mode. Generation jobs, the auth routes and job polling run
+# as coroutines with Motor and the async Gemini client, so a generation that
+# waits on the network holds no thread. Every other route of app.py is
+# served by the Flask app on a thread pool, see Dispatcher.
+#
+#   uvicorn 'asgi:create_asgi_app' --factory --host 0.0.0.0 --port 5000
+bp = Blueprint('flashy', __name__)
+
+# The Services of the Flask app, shared so both sides see the same uploads and caches
+services = LocalProxy(lambda: current_app.extensions['flashy'])
+
+# Threads serving the routes that stay on the Flask app
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', '16'))
+
+
+# Motor `users` collection. The first call creates the indexes through the
+# sync client, on a thread.
+async def users_collection():
+    app_services = services._get_current_object()
+    if app_services.peek('db') is None:
+        await asyncio.to_thread(lambda: app_services.db)
+    return app_services.async_db.users
+
+
+def hasher_busy():
+    return error_response(BUSY_ERROR, 503, retry_after=5)
+
+
+# Route for fetching user details
+@bp.route('/userAccount', methods=['POST'])
+async def get_userAccount():
+    username = (await request.get_json()).get('username')
+
+    users = await users_collection()
+    profile = await services.profiles.get_async(username, users)
+
+    if profile:
+        return jsonify({'email': profile['email'], 'plan': profile['plan']}), 200
+    else:
+        return jsonify({'error': 'User not found'}), 404
+
+
+# Register user, bcrypt runs on the hasher pool
+@bp.route('/register', methods=['POST'])
+async def register():
+    data = await request.get_json()
+    username = data.get('username')
+    email = data.get('email')
+    password = data.get('password')
+
+    try:
+        hashed_password = await services.password_hasher.hash_async(password)
+    except HasherBusy:
+        return hasher_busy()
+
+    user_data = {
+        "username": username,
+        "email": email,
+        "password": hashed_password,
+        "plan": "premium"
+    }
+
+    users = await users_collection()
+    try:
+        await users.insert_one(user_data)
+    except DuplicateKeyError as e:
+        field = duplicate_field(e) or (
+            'email' if await users.find_one({'email': email}, {'_id': 1}) else 'username'
+        )
+        if field == 'email':
+            return jsonify({'error': 'Email already registered!'}), 400
+        return jsonify({'error': 'Username already registered!'}), 400
+
+    return jsonify({'message': 'Registration successful!'}), 201
+
+
+# Login User
+@bp.route('/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+    email = data.get('email')
+    password = data.get('password')
+
+    users = await users_collection()
+    user = await users.find_one({"email": email})
+    hasher = services.password_hasher
+    try:
+        valid = bool(user) and await hasher.check_async(user['password'], password)
+    except HasherBusy:
+        return hasher_busy()
+
+    if valid:
+        # Upgrade hashes made with an older work factor. The new hash is
+        # written from the hasher thread with the sync client.
+        if hasher.needs_rehash(user['password']):
+            sync_users = services.users
+            hasher.rehash_later(password, lambda hashed: sync_users.update_one(
+                {'_id': user['_id'], 'password': user['password']},
+                {'$set': {'password': hashed}}
+            ))
+        session['user_id'] = str(user['_id'])
+        session['username'] = user['username']
+        session['plan'] = user['plan']
+        return jsonify({'username': user['username']}), 200
+    else:
+        return jsonify({'error': 'Invalid credentials!'}), 401
+
+
+# Store generated cards, leaving out near-duplicates of the existing deck.
+# Deduplication is CPU-bound and holds the deck until the cards are written,
+# so it runs on a thread. The write goes through Motor on the event loop.
+async def store_cards(app_services, username, course, flashcards=(), quiz_cards=()):
+    loop = asyncio.get_running_loop()
+
+    async def write(flashcards, quiz_cards):
+        with span('mongo_write'):
+            await app_services.async_card_store.add(username, course, flashcards, quiz_cards)
+            await app_services.async_review_store.add(username, course, flashcards, quiz_cards)
+
+    def write_from_thread(flashcards, quiz_cards):
+        asyncio.run_coroutine_threadsafe(write(flashcards, quiz_cards), loop).result()
+
+    def store():
+        deduplicator = app_services.deduplicator
+        if deduplicator is None:
+            write_from_thread(flashcards, quiz_cards)
+            return flashcards, quiz_cards
+        return deduplicator.store(username, course, flashcards, quiz_cards, write_from_thread)
+
+    return await asyncio.to_thread(store)
+
+
+# Free tier pipeline, runs as a task on the event loop
+async def run_free_job(job, extracted_text, generation):
+    flashcards, _ = await agenerate_deck(
+        extracted_text, generation.flashcard_number, **start_generating(job, generation, 0.9)
+    )
+    return free_job_result(job, flashcards)
+
+
+# Premium pipeline, runs as a task on the event loop. Tasks have no app
+# context, so the Services are passed along.
+async def run_premium_job(job, extracted_text, generation, app_services):
+    flashcards, quiz_cards = await agenerate_deck(
+        extracted_text, generation.flashcard_number, generation.quiz_number,
+        **start_generating(job, generation, 0.8)
+    )
+    premium_job_storing(job, flashcards, quiz_cards)
+    await store_cards(app_services, generation.username, generation.course, flashcards, quiz_cards)
+
+    return {'flashcards': flashcards, 'quiz_cards': quiz_cards}
+
+
+# Plan a generation request of `username` is scheduled under, see app.request_plan
+async def request_plan(username):
+    known, plan = session_plan(session, username)
+    if known:
+        return plan
+    return profile_plan(await services.profiles.get_async(username, await users_collection()))
+
+
+# Admit a generation request, returns (Ticket, error_response)
+def admit_request(username, plan):
+    return admit(services.admission, username or request.remote_addr, plan)
+
+
+# Start a pipeline admitted with `ticket` and answer with where to follow it,
+# plus anything in `report`. The ticket is released when the job finishes.
+def submit_job(kind, fn, *args, ticket, report=None, **kwargs):
+    async def admitted(job, *args, **kwargs):
+        try:
+            return await fn(job, *args, **kwargs)
+        finally:
+            ticket.release()
+
+    try:
+        job = services.async_job_queue.submit(kind, admitted, *args, tier=ticket.tier, **kwargs)
+    except QueueFull:
+        ticket.release()
+        return queue_full_response()
+    return job_accepted(job, url_for, report)
+
+
+# Parse a generation request and prepare the text of its pages on a thread,
+# returns (GenerationRequest, PreparedText, error_response)
+async def generation_request():
+    generation, error = parse_generation_request(await request.get_json())
+    if error:
+        return None, None, error
+    app_services = services._get_current_object()
+    if app_services.peek('response_cache') is None:
+        # Creates `db` through the sync client the first time
+        await asyncio.to_thread(lambda: app_services.response_cache)
+    prepared, error = await asyncio.to_thread(
+        select_upload_text, app_services.upload_sessions, generation.upload_id, generation.pages
+    )
+    if error:
+        return None, None, error
+    return generation, prepared, None
+
+
+# Generate cards for free users
+@bp.route('/process_free', methods=['POST'])
+async def process_free_pages():
+    generation, prepared, error = await generation_request()
+    if error:
+        return error
+    ticket, error = admit_request(session.get('username'), 'free')
+    if error:
+        return error
+    return submit_job('process_free', run_free_job, prepared.text, generation, ticket=ticket,
+                      report=prepared.report())
+
+
+# Generating cards for premium users
+@bp.route('/process', methods=['POST'])
+async def process_pages():
+    generation, prepared, error = await generation_request()
+    if error:
+        return error
+    ticket, error = admit_request(generation.username, await request_plan(generation.username))
+    if error:
+        return error
+    return submit_job('process', run_premium_job, prepared.text, generation, services._get_current_object(),
+                      ticket=ticket, report=prepared.report())
+
+
+# Jobs started here or, like /process_bulk, by the Flask app
+def find_job(job_id):
+    return services.async_job_queue.get(job_id) or services.job_queue.get(job_id)
+
+
+# Route for polling a generation job
+@bp.route('/jobs/<job_id>')
+async def get_job(job_id):
+    return job_status(find_job(job_id))
+
+
+# Route for following a generation job with server-sent events
+@bp.route('/jobs/<job_id>/events')
+async def job_events(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return job_status(job)
+
+    response = Response(job.sse_stream_async(last_event_id(request.headers)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # The stream lasts as long as the job
+    response.timeout = None
+    return response
+
+
+# Route for load balancer and container health checks, `?deep=1` also pings Mongo
+@bp.route('/health')
+async def health():
+    if request.args.get('deep') != '1':
+        return jsonify({'status': 'ok'})
+    try:
+        await services.async_db.client.admin.command('ping')
+    except PyMongoError as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ok', 'mongo': 'ok'})
+
+
+@bp.before_app_request
+async def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@bp.after_app_request
+async def finish_request(response):
+    # Same CORS policy as the Flask app, preflights are answered by it
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Expose-Headers'] = ', '.join(EXPOSED_HEADERS)
+    start = g.pop('request_start', None)
+    if start is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code
+        )
+    return response
+
+
+# Sends requests for the routes above to the Quart app and every other
+# request (uploads, page images, decks, streaming) to the Flask app, which
+# runs on a thread pool
+class Dispatcher:
+    def __init__(self, async_app, wsgi_app, threads=WSGI_THREADS, proxies=0):
+        self.async_app = async_app
+        self.wsgi_app = wsgi_app
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=threads)
+        self.proxies = proxies
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.is_async_route(scope):
+            # The Flask app reads X-Forwarded-For itself, see TRUSTED_PROXIES
+            return await self.wsgi(scope, receive, send)
+        if scope['type'] == 'http' and self.proxies:
+            scope = forwarded_scope(scope, self.proxies)
+        # Lifespan events go to Quart
+        return await self.async_app(scope, receive, send)
+
+    def is_async_route(self, scope):
+        # CORS preflights are answered by flask-cors
+        if scope['method'] == 'OPTIONS':
+            return False
+        try:
+            self.async_app.url_map.bind('').match(scope['path'], scope['method'])
+        except HTTPException:
+            return False
+        return True
+
+
+# `scope` with the client address set by the `proxies` trusted proxies in
+# X-Forwarded-For, the same entry werkzeug's ProxyFix picks
+def forwarded_scope(scope, proxies):
+    forwarded = [value.decode('latin1') for name, value in scope['headers'] if name.lower() == b'x-forwarded-for']
+    addresses = [address.strip() for address in ','.join(forwarded).split(',') if address.strip()]
+    if len(addresses) < proxies:
+        return scope
+    port = (scope.get('client') or (None, 0))[1]
+    return dict(scope, client=(addresses[-proxies], port))
+
+
+# Build the ASGI app around create_app(). Both apps share one Services, so
+# uploads and caches are the same whichever side serves a request.
+def create_asgi_app(config=None):
+    wsgi_app = create_app(config)
+
+    app = Quart(__name__)
+    app.secret_key = wsgi_app.secret_key
+    app.config.update(config or {})
+    app.extensions['flashy'] = app_services = wsgi_app.extensions['flashy']
+    app.register_blueprint(bp)
+
+    gauge('flashy_async_jobs_queued', 'Async generation jobs waiting for a slot',
+          lambda: app_services.async_job_queue.queued())
+    gauge('flashy_async_jobs_running', 'Async generation jobs in flight',
+          lambda: app_services.async_job_queue.running())
+    return Dispatcher(app, wsgi_app, proxies=wsgi_app.config['TRUSTED_PROXIES'])
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(create_asgi_app(), host='0.0.0.0', port=5000)
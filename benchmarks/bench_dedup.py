@@ -0,0 +1,80 @@
+# Latency and memory of semantic near-duplicate detection against large
+# decks: the float16 block-wise matrix product used by dedup.py against a
+# per-pair Python loop, with synthetic embeddings instead of the model.
+#
+#   python -m benchmarks.bench_dedup --cards 10000 50000 100000
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+
+from dedup import select_unique
+
+
+def normalized(rows):
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+# A deck of random unit vectors, and a batch where every other card is a
+# slightly perturbed copy of a stored one
+def make_vectors(count, batch, dim, rng):
+    deck = normalized(rng.standard_normal((count, dim)).astype(np.float32))
+    fresh = normalized(rng.standard_normal((batch - batch // 2, dim)).astype(np.float32))
+    copies = deck[rng.choice(count, batch // 2, replace=False)]
+    copies = normalized(copies + 0.01 * rng.standard_normal(copies.shape).astype(np.float32))
+    return deck, np.concatenate([fresh, copies])
+
+
+def naive_select(deck, vectors, threshold):
+    keep = []
+    for i, vector in enumerate(vectors):
+        if any(float(np.dot(row, vector)) >= threshold for row in deck):
+            continue
+        if any(float(np.dot(vectors[j], vector)) >= threshold for j in keep):
+            continue
+        keep.append(i)
+    return keep
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        keep = fn()
+        timings.append(time.perf_counter() - start)
+    return {'kept': len(keep), 'median_ms': round(statistics.median(timings) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Semantic deduplication benchmark')
+    parser.add_argument('--cards', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--batch', type=int, default=20, help='generated cards checked per call')
+    parser.add_argument('--dim', type=int, default=384, help='embedding size, 384 for all-MiniLM-L6-v2')
+    parser.add_argument('--threshold', type=float, default=0.92)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--naive-limit', type=int, default=10000, help='largest deck to time the per-pair loop on')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = {'batch': args.batch, 'dim': args.dim, 'decks': {}}
+    for count in args.cards:
+        deck, vectors = make_vectors(count, args.batch, args.dim, rng)
+        stored = deck.astype(np.float16)
+        result = {
+            'float32_mb': round(deck.nbytes / 2 ** 20, 1),
+            'float16_mb': round(stored.nbytes / 2 ** 20, 1),
+            'vectorized_float16': measure(lambda: select_unique([stored], vectors, args.threshold), args.repeat)
+        }
+        if count <= args.naive_limit:
+            result['per_pair_loop'] = measure(lambda: naive_select(deck, vectors, args.threshold), 1)
+            result['speedup'] = round(
+                result['per_pair_loop']['median_ms'] / result['vectorized_float16']['median_ms'], 1
+            )
+        results['decks'][count] = result
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,457 @@
+# Offline end-to-end benchmark of the Flask app. Gemini is replaced by the
+# fake backend of llm_client and MongoDB by mongomock, so no API key or
+# database is needed. Requests go over real HTTP to a threaded server, or
+# to uvicorn with --mode asgi. --mode both runs the two deployments one
+# after the other in fresh processes and reports them side by side.
+#
+#   pip install mongomock
+#   python -m benchmarks.bench_e2e --concurrency 8 --output before.json
+#   python -m benchmarks.bench_e2e --fake-latency-ms 200 --fake-failure-rate 0.05
+#   python -m benchmarks.bench_e2e --mode both --process-jobs 300 --concurrency 300
+#
+# Results are JSON: per endpoint latency percentiles, throughput, errors and
+# the peak RSS of the process while that endpoint was under load.
+import argparse
+import contextlib
+import inspect
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SENTENCES = [
+    "Mitochondria generate most of the chemical energy needed by the cell.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "Enzymes lower the activation energy of biochemical reactions.",
+    "The Krebs cycle oxidizes acetyl-CoA to carbon dioxide.",
+    "Ribosomes translate messenger RNA into chains of amino acids.",
+    "Osmosis moves water across a semipermeable membrane.",
+    "DNA replication is semi-conservative and starts at origins of replication.",
+    "ATP synthase uses a proton gradient to phosphorylate ADP."
+]
+
+
+# ---- synthetic corpus ----
+
+def page_text(rng, page, lines):
+    return f"Lecture {page + 1}\n" + '\n'.join(
+        f"{rng.choice(SENTENCES)} Note {rng.randint(0, 10 ** 6)}." for _ in range(lines)
+    )
+
+
+def make_pdf(path, pages, rng):
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_textbox(fitz.Rect(72, 72, 540, 770), page_text(rng, i, 20), fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def make_docx(path, pages, rng):
+    import docx
+    document = docx.Document()
+    for i in range(pages):
+        for line in page_text(rng, i, 20).split('\n'):
+            document.add_paragraph(line)
+    document.save(path)
+
+
+def make_pptx(path, pages, rng):
+    import pptx
+    presentation = pptx.Presentation()
+    layout = presentation.slide_layouts[1]
+    for i in range(pages):
+        slide = presentation.slides.add_slide(layout)
+        slide.shapes.title.text = f"Slide {i + 1}"
+        slide.placeholders[1].text = page_text(rng, i, 6)
+    presentation.save(path)
+
+
+MAKERS = {'pdf': make_pdf, 'docx': make_docx, 'pptx': make_pptx}
+
+
+# Every document has different text, so uploads are not served from the
+# content-hashed upload cache unless the corpus is smaller than the run
+def make_corpus(folder, sizes, count, seed):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        file_ext = list(MAKERS)[i % len(MAKERS)]
+        pages = sizes[(i // len(MAKERS)) % len(sizes)]
+        path = os.path.join(folder, f"doc_{i}_{pages}p.{file_ext}")
+        MAKERS[file_ext](path, pages, rng)
+        corpus.append((path, pages))
+    return corpus
+
+
+# ---- measurement ----
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Lifetime peak where /proc is not available (KB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+# Samples RSS in the background to find the peak of one phase
+class RssSampler:
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(timings, errors, wall, peak_rss):
+    timings = sorted(timings)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(timings) + errors,
+        'errors': errors,
+        'p50_ms': ms(percentile(timings, 50)),
+        'p95_ms': ms(percentile(timings, 95)),
+        'p99_ms': ms(percentile(timings, 99)),
+        'max_ms': ms(timings[-1] if timings else None),
+        'throughput_rps': round(len(timings) / wall, 2) if wall else None,
+        'peak_rss_mb': round(peak_rss, 1)
+    }
+
+
+# Run `call(i)` for i in range(count) on `concurrency` threads. Each call
+# returns its latency in seconds or raises on a failed request.
+def run_phase(call, count, concurrency):
+    timings, errors, lock = [], [0], threading.Lock()
+
+    def one(i):
+        try:
+            elapsed = call(i)
+        except Exception as e:
+            print(f"request failed: {e}", file=sys.stderr)
+            with lock:
+                errors[0] += 1
+            return
+        with lock:
+            timings.append(elapsed)
+
+    with RssSampler() as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(count)))
+        wall = time.perf_counter() - start
+    return summarize(timings, errors[0], wall, sampler.peak)
+
+
+# ---- app under test ----
+
+# Stand-in for Motor over the mongomock client of the sync side, so both
+# sides of the ASGI app see the same data. mongomock works in memory, its
+# calls are simply made from the coroutines.
+class AsyncMock:
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if inspect.ismethod(attr):
+            async def call(*args, **kwargs):
+                return attr(*args, **kwargs)
+            return call
+        return AsyncMock(attr)
+
+    def __getitem__(self, name):
+        return AsyncMock(self._target[name])
+
+
+# Configure the app for offline use and import it. Must run before anything
+# imports app, pymongo.MongoClient is swapped for one shared mongomock client.
+def load_app(args, workdir):
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit('bench_e2e needs mongomock: pip install mongomock')
+    import pymongo
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *_, **__: client
+
+    os.environ.update({
+        'LLM_BACKEND': 'fake',
+        'FAKE_LLM_LATENCY_MS': str(args.fake_latency_ms),
+        'FAKE_LLM_FAILURE_RATE': str(args.fake_failure_rate),
+        'MONGO_URI': 'mongodb://localhost',
+        'API_KEY': 'offline',
+        'SECRET_KEY': 'bench',
+        'SEMANTIC_DEDUP': '0',
+        'BCRYPT_ROUNDS': str(args.bcrypt_rounds),
+        'PAGE_CACHE_FOLDER': os.path.join(workdir, 'page_cache')
+    })
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    # uploads/ is relative to the working directory
+    os.chdir(workdir)
+    if args.mode == 'asgi':
+        from motor import motor_asyncio
+        motor_asyncio.AsyncIOMotorClient = lambda *_, **__: AsyncMock(client)
+        import asgi
+        return asgi.create_asgi_app()
+    import app
+    return app.create_app()
+
+
+# Serve the app on a free local port, returns (stop, base_url)
+def serve(web_app, mode):
+    if mode == 'asgi':
+        return serve_asgi(web_app)
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, web_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown, f"http://127.0.0.1:{server.server_port}"
+
+
+def serve_asgi(asgi_app):
+    import socket
+    import uvicorn
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        asgi_app, host='127.0.0.1', port=port, log_level='warning', backlog=4096
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            sys.exit('uvicorn failed to start')
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return stop, f"http://127.0.0.1:{port}"
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(args, base_url, corpus):
+    import requests
+
+    local = threading.local()
+
+    def http():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def timed(method, path, **kwargs):
+        start = time.perf_counter()
+        response = http().request(method, base_url + path, timeout=args.timeout, **kwargs)
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        return elapsed, response
+
+    usernames = [f"bench{i}" for i in range(args.users)]
+    course = 'Biology'
+    results = {}
+
+    # Accounts for /login, registration is measured on the way
+    def register(i):
+        return timed('POST', '/register', json={
+            'username': usernames[i], 'email': f"{usernames[i]}@example.com", 'password': 'correct horse'
+        })[0]
+    results['/register'] = run_phase(register, args.users, args.concurrency)
+
+    def login(i):
+        name = usernames[i % args.users]
+        return timed('POST', '/login', json={'email': f"{name}@example.com", 'password': 'correct horse'})[0]
+    results['/login'] = run_phase(login, args.requests, args.concurrency)
+
+    uploads = []
+    uploads_lock = threading.Lock()
+
+    def preview(i):
+        path, _ = corpus[i % len(corpus)]
+        with open(path, 'rb') as document:
+            elapsed, response = timed('POST', '/preview_upload', files={'file': (os.path.basename(path), document)},
+                                      data={'username': usernames[i % args.users], 'course': course})
+        with uploads_lock:
+            # DOCX and PPTX are split into pages by the extractor, use its count
+            uploads.append((response.json()['upload_id'], response.json()['page_count']))
+        return elapsed
+    results['/preview_upload'] = run_phase(preview, len(corpus), args.concurrency)
+
+    # /process answers 202 straight away, the latency that matters is until
+    # the job has stored its cards, so jobs are polled to completion
+    def process(i):
+        upload_id, pages = uploads[i % len(uploads)]
+        start = time.perf_counter()
+        _, response = timed('POST', '/process', json={
+            'upload_id': upload_id,
+            'pages': list(range(1, min(pages, args.process_pages) + 1)),
+            'flashcard_number': args.flashcards,
+            'quiz': 'yes',
+            'course': course,
+            'username': usernames[i % args.users],
+            'no_cache': True
+        })
+        job_path = f"/jobs/{response.json()['job_id']}"
+        while True:
+            job = timed('GET', job_path)[1].json()
+            if job['status'] == 'failed':
+                raise RuntimeError(job.get('error'))
+            if job['status'] == 'succeeded':
+                return time.perf_counter() - start
+            time.sleep(args.poll_interval)
+    results['/process'] = run_phase(process, args.process_jobs, args.concurrency)
+
+    def flashcards(i):
+        params = {'username': usernames[i % args.users], 'selectedCourse': course}
+        if i % 2:
+            params['limit'] = 50
+        return timed('GET', '/flashcards', params=params)[0]
+    results['/flashcards'] = run_phase(flashcards, args.requests, args.concurrency)
+
+    def courses(i):
+        return timed('GET', '/courses', params={'username': usernames[i % args.users]})[0]
+    results['/courses'] = run_phase(courses, args.requests, args.concurrency)
+
+    return results
+
+
+def run_mode(args):
+    # The app and PyMuPDF print while they work, keep stdout for the results
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(sys.stderr):
+        corpus_dir = os.path.join(workdir, 'corpus')
+        os.makedirs(corpus_dir)
+        corpus = make_corpus(corpus_dir, args.sizes, args.documents, args.seed)
+
+        web_app = load_app(args, workdir)
+        stop, base_url = serve(web_app, args.mode)
+        try:
+            return benchmark(args, base_url, corpus)
+        finally:
+            stop()
+            os.chdir(ROOT)
+
+
+# Run the sync and the ASGI deployment in fresh processes, since the app
+# modules read their settings once, and put the results side by side
+def compare_modes(args):
+    argv = []
+    for key, value in vars(args).items():
+        if key in ('mode', 'output'):
+            continue
+        values = value if isinstance(value, list) else [value]
+        argv += ['--' + key.replace('_', '-')] + [str(item) for item in values]
+
+    modes = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for mode in ('wsgi', 'asgi'):
+            output = os.path.join(folder, f"{mode}.json")
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_e2e', *argv, '--mode', mode, '--output', output],
+                cwd=ROOT, check=True, stdout=subprocess.DEVNULL
+            )
+            with open(output) as result:
+                modes[mode] = json.load(result)
+
+    ratios = {}
+    for endpoint, wsgi in modes['wsgi']['endpoints'].items():
+        asgi = modes['asgi']['endpoints'].get(endpoint, {})
+        if wsgi.get('throughput_rps') and asgi.get('throughput_rps'):
+            ratios[endpoint] = {
+                'throughput': round(asgi['throughput_rps'] / wsgi['throughput_rps'], 2),
+                'p95_latency': round(asgi['p95_ms'] / wsgi['p95_ms'], 2) if wsgi.get('p95_ms') else None
+            }
+    return {
+        'revision': modes['wsgi']['revision'],
+        'timestamp': modes['wsgi']['timestamp'],
+        'config': modes['wsgi']['config'],
+        'modes': {mode: result['endpoints'] for mode, result in modes.items()},
+        'asgi_vs_wsgi': ratios
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--requests', type=int, default=200, help='requests per read endpoint and /login')
+    parser.add_argument('--documents', type=int, default=18, help='documents in the synthetic corpus')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 25, 100], help='page counts of the documents')
+    parser.add_argument('--process-jobs', type=int, default=18)
+    parser.add_argument('--process-pages', type=int, default=10, help='pages selected per /process')
+    parser.add_argument('--flashcards', type=int, default=10, help='flashcards requested per /process')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--fake-latency-ms', type=int, default=300)
+    parser.add_argument('--fake-failure-rate', type=float, default=0.0)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='wsgi',
+                        help='threaded Flask server, uvicorn with asgi.py, or both for a comparison')
+    parser.add_argument('--output', help='write the JSON results here as well as to stdout')
+    args = parser.parse_args()
+
+    if args.mode == 'both':
+        results = compare_modes(args)
+    else:
+        results = {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'config': {key: value for key, value in vars(args).items() if key != 'output'},
+            'endpoints': run_mode(args)
+        }
+    body = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(body + '\n')
+    print(body)
+
+
+if __name__ == '__main__':
+    main()
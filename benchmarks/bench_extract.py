@@ -0,0 +1,84 @@
+# Micro-benchmark of PDF text extraction: the old PyPDF2 path against the
+# single-pass PyMuPDF extractor, in-process and on the worker pool.
+#
+#   python -m benchmarks.bench_extract                 # synthetic 200 page PDF
+#   python -m benchmarks.bench_extract lecture.pdf --repeat 5
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+import PyPDF2
+
+import extractor
+
+PARAGRAPH = (
+    "Mitochondria are membrane-bound organelles that generate most of the chemical energy "
+    "needed to power the cell's biochemical reactions. Chemical energy produced by the "
+    "mitochondria is stored in a small molecule called adenosine triphosphate (ATP).\n"
+)
+
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(72, 72, 540, 770), f"Lecture 4 - Cell Biology - Slide {i + 1}\n" + PARAGRAPH * 8, fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+# The extraction path /process used before the unified extractor
+def pypdf2_pages(path):
+    reader = PyPDF2.PdfReader(path)
+    return [page.extract_text() for page in reader.pages]
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        'pages': len(pages),
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'min_ms': round(min(timings) * 1000, 2),
+        'pages_per_s': round(len(pages) / statistics.median(timings), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PDF text extraction benchmark')
+    parser.add_argument('pdf', nargs='?', help='PDF to extract, a synthetic one is generated if omitted')
+    parser.add_argument('--pages', type=int, default=200, help='pages of the synthetic PDF')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if not path:
+            path = os.path.join(tmp, 'synthetic.pdf')
+            make_pdf(path, args.pages)
+
+        # Start the worker processes before timing anything
+        extractor.extract_pdf(path)
+
+        results = {
+            'file': args.pdf or f'synthetic ({args.pages} pages)',
+            'workers': extractor.EXTRACT_WORKERS,
+            'pypdf2': measure(lambda: pypdf2_pages(path), args.repeat),
+            'pymupdf_single_pass': measure(lambda: extractor.extract_pdf(path, parallel=False), args.repeat),
+            'pymupdf_parallel': measure(lambda: extractor.extract_pdf(path), args.repeat)
+        }
+    baseline = results['pypdf2']['median_ms']
+    for name in ('pymupdf_single_pass', 'pymupdf_parallel'):
+        results[name]['speedup_vs_pypdf2'] = round(baseline / results[name]['median_ms'], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Payload size and serialization latency of /flashcards before and after
+# pagination, the fast JSON serializer and compression.
+#
+#   python -m benchmarks.bench_flashcards --cards 100 1000 5000
+import argparse
+import gzip
+import json
+import statistics
+import time
+
+import http_utils
+
+
+def make_deck(count):
+    flashcards = [{
+        'front': f"What is the role of enzyme {i} in cellular respiration?",
+        'back': f"Enzyme {i} catalyses step {i % 10} of glycolysis, converting substrate into pyruvate "
+                f"while producing ATP and NADH that feed the electron transport chain."
+    } for i in range(count)]
+    quizzes = [{
+        'question': f"Which molecule is produced in step {i}?",
+        'options': ['ATP', 'NADH', 'Pyruvate', 'Glucose'],
+        'answer': 'ATP'
+    } for i in range(count // 5)]
+    return {'flashcards': flashcards, 'quizzes': quizzes}
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - start)
+    return {'bytes': len(body), 'median_ms': round(statistics.median(timings) * 1000, 3)}
+
+
+def scenarios(deck, page_size):
+    page = {'flashcards': deck['flashcards'][:page_size], 'next_cursor': 'NTA', 'version': 1}
+    # Flask's default provider sorts keys, like jsonify did before
+    yield 'before_full_deck_jsonify', lambda: json.dumps(deck, sort_keys=True).encode('utf-8')
+    yield 'after_full_deck_fast_json', lambda: http_utils.dumps(deck)
+    yield 'after_full_deck_gzip', lambda: gzip.compress(http_utils.dumps(deck), compresslevel=6)
+    if http_utils.brotli is not None:
+        yield 'after_full_deck_brotli', lambda: http_utils.brotli.compress(http_utils.dumps(deck), quality=5)
+    yield f'after_first_page_{page_size}_gzip', lambda: gzip.compress(http_utils.dumps(page), compresslevel=6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/flashcards payload benchmark')
+    parser.add_argument('--cards', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    results = {'serializer': 'orjson' if http_utils.orjson else 'json', 'decks': {}}
+    for count in args.cards:
+        deck = make_deck(count)
+        results['decks'][count] = {
+            name: measure(fn, args.repeat) for name, fn in scenarios(deck, args.page_size)
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Cold start guard: imports app, builds it with create_app() and answers one
+# /health request in a fresh interpreter under `python -X importtime`.
+# Fails when a heavy module is imported at startup or the startup time goes
+# over budget, so it can run in CI.
+#
+#   python -m benchmarks.bench_importtime
+#   python -m benchmarks.bench_importtime --max-ms 800 --repeat 5 --top 15
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only load when a request needs them
+LAZY_MODULES = (
+    'fitz', 'pymupdf', 'docx', 'pptx', 'PyPDF2', 'google.generativeai', 'google.api_core',
+    'numpy', 'torch', 'sentence_transformers', 'stripe'
+)
+
+STARTUP = """
+import time
+start = time.perf_counter()
+import app
+client = app.create_app().test_client()
+assert client.get('/health').status_code == 200
+print(time.perf_counter() - start)
+"""
+
+
+def run_once():
+    env = dict(
+        os.environ,
+        # Nothing listens here, startup must not try to connect
+        MONGO_URI='mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=2000',
+        WARM_UP='0',
+        LOG_LEVEL='WARNING'
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        sys.exit(f"Startup failed:\n{result.stderr[-2000:]}")
+
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return float(result.stdout.strip().splitlines()[-1]), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start import time benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports to list')
+    parser.add_argument('--max-ms', type=float, default=1000, help='fail above this median startup time')
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.repeat)]
+    startup_ms = statistics.median(seconds for seconds, _ in runs) * 1000
+    modules = runs[-1][1]
+    imported = {name for name, _, _, _ in modules}
+    top_level = sorted((m for m in modules if m[3] <= 1), key=lambda m: m[2], reverse=True)
+
+    results = {
+        'startup_ms': round(startup_ms, 1),
+        'import_ms': round(sum(self_us for _, self_us, _, _ in modules) / 1000, 1),
+        'modules_imported': len(modules),
+        'slowest_imports_ms': {name: round(cumulative / 1000, 1) for name, _, cumulative, _ in top_level[:args.top]},
+        'eager_heavy_modules': sorted(name for name in LAZY_MODULES if name in imported),
+        'max_ms': args.max_ms
+    }
+    print(json.dumps(results, indent=2))
+
+    if results['eager_heavy_modules']:
+        sys.exit(f"Imported at startup, should be lazy: {', '.join(results['eager_heavy_modules'])}")
+    if startup_ms > args.max_ms:
+        sys.exit(f"Startup took {startup_ms:.0f} ms, over the {args.max_ms:.0f} ms budget")
+
+
+if __name__ == '__main__':
+    main()
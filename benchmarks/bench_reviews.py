@@ -0,0 +1,175 @@
+# Due-queue latency of the review store from small to large libraries. Every
+# user's reviews share one collection, the due query should cost the same
+# for 100 or 100k cards, unlike loading the deck and sorting it locally.
+# Due cards are joined from the card store, like /reviews/due does, for
+# both FLASHCARD_STORAGE layouts (--stores).
+# Needs a MongoDB server, the benchmark database is dropped afterwards.
+# Index use is reported from explain(), --mongomock only checks the code
+# paths (mongomock scans every document).
+#
+#   python -m benchmarks.bench_reviews --mongo-uri mongodb://localhost:27017
+#   python -m benchmarks.bench_reviews --cards 100 1000 10000 100000 --limit 20
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from card_store import EmbeddedCardStore, PerCardStore, ensure_indexes
+from reviews import ReviewStore, due_query, parse_reviews, review_documents
+
+DATABASE = 'flashy_bench_reviews'
+CARD_STORES = {'embedded': EmbeddedCardStore, 'per_card': PerCardStore}
+INSERT_BATCH = 5000
+
+
+def make_cards(count):
+    return [{
+        'front': f"What is the role of enzyme {i} in cellular respiration?",
+        'back': f"Enzyme {i} catalyses step {i % 10} of glycolysis."
+    } for i in range(count)]
+
+
+# A library of `count` cards in a few courses, half of them overdue by up to
+# a month and half due within the next month
+def load_library(store, card_store, username, count, rng):
+    now = datetime.datetime.utcnow()
+    cards = make_cards(count)
+    courses = max(1, min(20, count // 50))
+    for start in range(0, count, INSERT_BATCH):
+        documents, decks = [], {}
+        for offset, card in enumerate(cards[start:start + INSERT_BATCH]):
+            course = f'Course {(start + offset) % courses}'
+            document = review_documents(username, course, [card], now=now)[0]
+            document['due'] = now + datetime.timedelta(minutes=rng.randint(-43200, 43200))
+            documents.append(document)
+            decks.setdefault(course, []).append(card)
+        store.collection.insert_many(documents, ordered=False)
+        for course, deck in decks.items():
+            card_store.add(username, course, deck)
+
+
+# Due schedules with their cards, as /reviews/due serves them
+def due_cards(store, card_store, username, limit):
+    due = store.due(username, limit)
+    cards = card_store.cards_by_id(username, due)
+    return [dict(doc, card=cards[doc['_id']]) for doc in due if doc['_id'] in cards]
+
+
+# What clients did before: load every deck and schedule, and sort locally
+def load_all_and_sort(store, card_store, username, limit):
+    decks = [card_store.get_deck(username, course) for course in card_store.courses(username)]
+    schedules = sorted(store.collection.find({'username': username}, {'due': 1}), key=lambda doc: doc['due'])
+    return decks, schedules[:limit]
+
+
+def percentiles(timings):
+    ordered = sorted(timings)
+    return {
+        'p50_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3)
+    }
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+
+# Keys and documents the due query examines, from the winning plan
+def explain_due(store, username, limit):
+    try:
+        plan = store.collection.find(due_query(username)).sort('due', 1).limit(limit).explain()
+    except (NotImplementedError, AttributeError, PyMongoError):
+        return None
+    stats = plan.get('executionStats', {})
+    stages = []
+    stage = plan.get('queryPlanner', {}).get('winningPlan', {})
+    while stage:
+        stages.append(stage.get('stage'))
+        stage = stage.get('inputStage')
+    return {
+        'stages': stages,
+        'keys_examined': stats.get('totalKeysExamined'),
+        'docs_examined': stats.get('totalDocsExamined')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Review due-queue benchmark')
+    parser.add_argument('--cards', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--limit', type=int, default=20, help='due cards per request')
+    parser.add_argument('--batch', type=int, default=50, help='reviews recorded per request')
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--mongomock', action='store_true', help='run against mongomock, no index use')
+    parser.add_argument('--stores', nargs='+', choices=list(CARD_STORES), default=list(CARD_STORES),
+                        help='card storage layouts the due cards are joined from')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(args.mongo_uri, serverSelectionTimeoutMS=3000)
+        try:
+            client.admin.command('ping')
+        except PyMongoError as e:
+            sys.exit(f"Cannot reach MongoDB at {args.mongo_uri}: {e}")
+
+    client.drop_database(DATABASE)
+    db = client[DATABASE]
+    ensure_indexes(db)
+    store = ReviewStore(db)
+    rng = random.Random(args.seed)
+
+    results = {'limit': args.limit, 'batch': args.batch, 'backend': 'mongomock' if args.mongomock else 'mongodb',
+               'stores': {}}
+    try:
+        for store_name in args.stores:
+            card_store = CARD_STORES[store_name](db)
+            libraries = results['stores'][store_name] = {'libraries': {}}
+            for count in args.cards:
+                username = f'bench_{store_name}_{count}'
+                libraries['libraries'][count] = bench_library(store, card_store, username, count, rng, args)
+            by_count = libraries['libraries']
+            if len(by_count) > 1:
+                smallest, largest = by_count[min(by_count)], by_count[max(by_count)]
+                libraries['due_p50_growth'] = round(
+                    largest['due_query']['p50_ms'] / max(smallest['due_query']['p50_ms'], 1e-6), 2
+                )
+    finally:
+        client.drop_database(DATABASE)
+    print(json.dumps(results, indent=2))
+
+
+def bench_library(store, card_store, username, count, rng, args):
+    load_library(store, card_store, username, count, rng)
+    due = due_cards(store, card_store, username, args.limit)
+    reviews = parse_reviews([
+        {'card_id': doc['_id'], 'quality': rng.choice([2, 3, 4, 5])} for doc in store.due(username, args.batch)
+    ])
+    return {
+        'due_query': timed(lambda: due_cards(store, card_store, username, args.limit), args.repeat),
+        'due_returned': len(due),
+        'load_all_and_sort': timed(
+            lambda: load_all_and_sort(store, card_store, username, args.limit), max(1, args.repeat // 10)
+        ),
+        'record_batch': timed(lambda: store.record(username, reviews), max(1, args.repeat // 10)),
+        'explain': explain_due(store, username, args.limit)
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+import datetime
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Blobs are copied in chunks of this size, a large upload or download is
+# never held in memory as a whole
+CHUNK_SIZE = 1024 * 1024
+
+# GridFS chunk size, about the largest that fits the BSON size limit with headroom
+GRIDFS_CHUNK_SIZE = 255 * 1024
+
+# Suffix of unfinished local writes, and the age at which one is considered
+# abandoned, e.g. by a worker that was killed. Far longer than any write takes.
+TEMP_SUFFIX = '.part'
+TEMP_FILE_TTL = 6 * 3600
+
+
+class BlobNotFound(KeyError):
+    pass
+
+
+# A stored blob opened for reading. Iterating yields CHUNK_SIZE chunks.
+class Blob:
+    def __init__(self, file, size):
+        self.file = file
+        self.size = size
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Keys are relative paths made of [A-Za-z0-9._-] names separated by '/'
+KEY_PATTERN = re.compile(r'^[\w.-]+(/[\w.-]+)*$')
+
+
+def check_key(key):
+    if not KEY_PATTERN.match(key) or any(part in ('.', '..') for part in key.split('/')) or \
+            key.endswith(TEMP_SUFFIX):
+        raise ValueError(f"Invalid blob key: {key!r}")
+    return key
+
+
+# Write side of a blob whose key is only known once it is written, e.g. a
+# content hash. Nothing is visible under the key until commit(), leaving the
+# `with` block without committing discards the data.
+class LocalWriter:
+    def __init__(self, store):
+        self.store = store
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.root, suffix=TEMP_SUFFIX)
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def commit(self, key):
+        path = self.store.path(key)
+        self.file.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp_path, path)
+        self.tmp_path = None
+
+    def abort(self):
+        self.file.close()
+        if self.tmp_path and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.tmp_path:
+            self.abort()
+
+
+# Blobs as files under a directory, visible to this machine only. The
+# modification time is the last access, refreshed by touch().
+class LocalBlobStore:
+    def __init__(self, root):
+        # Absolute, so paths stay valid whatever the working directory
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, *check_key(key).split('/'))
+
+    def writer(self):
+        return LocalWriter(self)
+
+    # Store everything read from a file object under `key`
+    def put(self, key, source):
+        with self.writer() as out:
+            copy_chunks(source, out)
+            out.commit(key)
+
+    def put_bytes(self, key, data):
+        with self.writer() as out:
+            out.write(data)
+            out.commit(key)
+
+    def open(self, key):
+        try:
+            file = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        return Blob(file, os.fstat(file.fileno()).st_size)
+
+    def read(self, key):
+        with self.open(key) as blob:
+            return blob.read()
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    # Refresh the last access of a blob, False if it does not exist
+    def touch(self, key):
+        try:
+            os.utime(self.path(key))
+            return True
+        except OSError:
+            return False
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    # Delete every blob whose key starts with `prefix`, e.g. 'abc/'
+    def delete_prefix(self, prefix):
+        folder, _, start = prefix.rpartition('/')
+        if not start:
+            shutil.rmtree(self.path(folder), ignore_errors=True)
+            return
+        directory = self.path(folder) if folder else self.root
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(start):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    self.delete(f'{folder}/{name}' if folder else name)
+
+    # Path of a blob on this machine for code that needs a real file, e.g.
+    # the parsers. Valid inside the `with` block.
+    @contextmanager
+    def local_path(self, key):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise BlobNotFound(key)
+        yield path
+
+    # (last access as a Unix time, size in bytes, key) of every blob.
+    # Unfinished writes are not blobs yet and are left out.
+    def entries(self):
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(TEMP_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    # Delete blobs not accessed within `ttl` seconds, returns their keys.
+    # Unfinished writes are only deleted once abandoned, see TEMP_FILE_TTL.
+    def sweep(self, ttl):
+        now = time.time()
+        expired = []
+        for touched_at, _, key in list(self.entries()):
+            if now - touched_at < ttl:
+                continue
+            try:
+                os.remove(os.path.join(self.root, *key.split('/')))
+            except OSError:
+                continue
+            expired.append(key)
+        self._sweep_temp_files(now)
+        return expired
+
+    # Writers create their temporary files in the root only
+    def _sweep_temp_files(self, now):
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(TEMP_SUFFIX):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if now - os.stat(path).st_mtime >= TEMP_FILE_TTL:
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+def copy_chunks(source, out):
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        out.write(chunk)
+
+
+# Write side of GridFSBlobStore. Data is spooled to the local copy first,
+# so the key (a content hash) is known before anything is sent, and a blob
+# that is already stored is not sent again.
+class GridFSWriter:
+    def __init__(self, store):
+        self.store = store
+        self.local = store.cache.writer()
+
+    def write(self, data):
+        self.local.write(data)
+
+    def commit(self, key):
+        self.local.commit(key)
+        if self.store.touch(key):
+            return
+        try:
+            with self.store.cache.open(key) as source:
+                self.store.upload(key, source)
+        except BaseException:
+            # A local copy of a blob that was never stored would outlive it
+            self.store.cache.delete(key)
+            raise
+
+    def abort(self):
+        self.local.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.local.__exit__(*exc)
+
+
+# Blobs in a GridFS bucket of the Mongo database, shared by every worker and
+# node. `metadata.touched_at` is the last access. Blobs used as files, see
+# local_path, keep a copy in `cache_dir` that expires like the blob itself.
+# Writing a key again stores a new revision and deletes the older ones.
+class GridFSBlobStore:
+    def __init__(self, db, bucket, cache_dir, chunk_size=GRIDFS_CHUNK_SIZE):
+        from gridfs import GridFSBucket
+        from pymongo import ASCENDING
+        self.bucket = GridFSBucket(db, bucket_name=bucket, chunk_size_bytes=chunk_size)
+        self.files = db[f'{bucket}.files']
+        self.cache = LocalBlobStore(cache_dir)
+        # Lookups by key and the expiry sweep
+        self.files.create_index([('filename', ASCENDING), ('uploadDate', ASCENDING)])
+        self.files.create_index([('metadata.touched_at', ASCENDING)])
+
+    def writer(self):
+        return GridFSWriter(self)
+
+    # Stream a file object into a new revision of `key`, then drop older revisions
+    def upload(self, key, source):
+        from gridfs.errors import NoFile
+        file_id = self.bucket.upload_from_stream(
+            check_key(key), source, metadata={'touched_at': datetime.datetime.utcnow()}
+        )
+        for doc in self.files.find({'filename': key, '_id': {'$lt': file_id}}, {'_id': 1}):
+            try:
+                self.bucket.delete(doc['_id'])
+            except NoFile:
+                pass
+
+    def put(self, key, source):
+        self.upload(key, source)
+
+    def put_bytes(self, key, data):
+        self.upload(key, io.BytesIO(data))
+
+    def open(self, key):
+        from gridfs.errors import NoFile
+        try:
+            grid_out = self.bucket.open_download_stream_by_name(check_key(key))
+        except NoFile:
+            raise BlobNotFound(key)
+        return Blob(grid_out, grid_out.length)
+
+    def read(self, key):
+        with self.open(key) as blob:
+            return blob.read()
+
+    def exists(self, key):
+        return self.files.count_documents({'filename': key}, limit=1) > 0
+
+    def touch(self, key):
+        result = self.files.update_many(
+            {'filename': key}, {'$set': {'metadata.touched_at': datetime.datetime.utcnow()}}
+        )
+        return result.matched_count > 0
+
+    def _delete_where(self, query):
+        from gridfs.errors import NoFile
+        keys = []
+        for doc in self.files.find(query, {'filename': 1}):
+            try:
+                self.bucket.delete(doc['_id'])
+            except NoFile:
+                continue
+            keys.append(doc['filename'])
+        return keys
+
+    def delete(self, key):
+        self._delete_where({'filename': key})
+        self.cache.delete(key)
+
+    def delete_prefix(self, prefix):
+        self._delete_where({'filename': {'$regex': f'^{re.escape(prefix)}'}})
+        self.cache.delete_prefix(prefix)
+
+    # A local copy of the blob, downloaded in chunks on first use. Keys are
+    # content hashes, so a copy never goes stale while the blob exists.
+    @contextmanager
+    def local_path(self, key):
+        if not self.cache.touch(key):
+            with self.open(key) as blob, self.cache.writer() as out:
+                copy_chunks(blob, out)
+                out.commit(key)
+        with self.cache.local_path(key) as path:
+            yield path
+
+    def entries(self):
+        for doc in self.files.find({}, {'filename': 1, 'length': 1, 'metadata.touched_at': 1}):
+            touched_at = (doc.get('metadata') or {}).get('touched_at') or doc['_id'].generation_time
+            if touched_at.tzinfo is None:
+                touched_at = touched_at.replace(tzinfo=datetime.timezone.utc)
+            yield touched_at.timestamp(), doc.get('length', 0), doc['filename']
+
+    # Delete blobs not accessed within `ttl` seconds on any node, and local
+    # copies not used within `ttl` on this one
+    def sweep(self, ttl):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+        expired = self._delete_where({'metadata.touched_at': {'$lt': cutoff}})
+        for key in expired:
+            self.cache.delete(key)
+        self.cache.sweep(ttl)
+        return expired
+
+
+# Storage selected by BLOB_STORE: `local` keeps blobs in `folder` on this
+# machine, `gridfs` in the `bucket` GridFS bucket, with local copies in
+# `folder`. `db` is called for the Mongo database when it is needed.
+def blob_store_from_env(bucket, folder, db):
+    mode = os.getenv('BLOB_STORE', 'local')
+    if mode == 'local':
+        return LocalBlobStore(folder)
+    if mode == 'gridfs':
+        return GridFSBlobStore(db(), bucket, folder)
+    raise ValueError(f"Unknown BLOB_STORE: {mode}")
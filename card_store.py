@@ -0,0 +1,402 @@
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+FLASHCARD = 'flashcard'
+QUIZ = 'quiz'
+
+# Array holding each kind of card in an embedded deck
+EMBEDDED_FIELDS = {FLASHCARD: 'flashcards', QUIZ: 'quizzes'}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Duplicate key error code, raised when a card is already stored
+DUPLICATE_KEY = 11000
+
+# Cursor batch sizes of exports. Embedded decks carry all their cards, so
+# fewer of them are fetched at a time.
+EXPORT_DECK_BATCH = 16
+EXPORT_CARD_BATCH = 500
+
+# What an export says about each deck
+DECK_FIELDS = {'_id': 0, 'course': 1, 'version': 1, 'updated_at': 1}
+
+# How far an export's `since` point reaches back, so writes that were in
+# flight when it started are exported again next time. Larger when only
+# this host's clock is known.
+EXPORT_OVERLAP = datetime.timedelta(seconds=5)
+CLOCK_SKEW_MARGIN = datetime.timedelta(seconds=60)
+
+
+# Create the indexes the routes rely on. Safe to run on every startup,
+# create_index is a no-op for indexes that already exist.
+def ensure_indexes(db):
+    indexes = [
+        (db.flashcards, [('username', ASCENDING), ('course', ASCENDING)], {}),
+        (db.users, [('email', ASCENDING)], {'unique': True}),
+        (db.users, [('username', ASCENDING)], {'unique': True}),
+        (db.cards, [('username', ASCENDING), ('course', ASCENDING), ('kind', ASCENDING),
+                    ('created_at', ASCENDING), ('position', ASCENDING), ('_id', ASCENDING)], {}),
+        # Due queue of reviews.py, for all courses or one
+        (db.reviews, [('username', ASCENDING), ('due', ASCENDING)], {}),
+        (db.reviews, [('username', ASCENDING), ('course', ASCENDING), ('due', ASCENDING)], {})
+    ]
+    for collection, keys, options in indexes:
+        try:
+            collection.create_index(keys, **options)
+        except PyMongoError as e:
+            # Existing duplicate users make unique indexes fail, report and keep serving
+            logger.warning("Could not create index %s on %s: %s", keys, collection.name, e)
+
+
+def card_hash(card):
+    return hashlib.sha256(json.dumps(card, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Every store keeps one document per (username, course) in `flashcards`
+# with a `version` that is bumped on every write, used for ETags
+def deck_version(collection, username, course):
+    deck = collection.find_one({'username': username, 'course': course}, {'_id': 0, 'version': 1})
+    return (deck or {}).get('version', 0)
+
+
+# Decks of `username`, only those written after `since` if it is given.
+# Every write sets `updated_at`, decks from before it was tracked have none
+# and only show up in full exports.
+def deck_filter(username, since=None):
+    query = {'username': username}
+    if since is not None:
+        query['updated_at'] = {'$gt': since}
+    return query
+
+
+# Point an export starts from, on the Mongo server clock that sets
+# `updated_at`, as a naive UTC datetime. Decks written after it are in the
+# next incremental export.
+def export_point(db):
+    try:
+        local_time = db.command('hello')['localTime']
+    except (PyMongoError, KeyError) as e:
+        logger.warning("Could not read the Mongo server time, using this host's clock: %s", e)
+        return datetime.datetime.utcnow() - CLOCK_SKEW_MARGIN - EXPORT_OVERLAP
+    return local_time.replace(tzinfo=None) - EXPORT_OVERLAP
+
+
+# Update adding cards to an embedded deck, None if there is nothing to add
+def embedded_update(flashcards, quizzes):
+    cards = {}
+    if flashcards:
+        cards['flashcards'] = {'$each': list(flashcards)}
+    if quizzes:
+        cards['quizzes'] = {'$each': list(quizzes)}
+    if not cards:
+        return None
+    return {'$addToSet': cards}
+
+
+# Update bumping the version of a deck after cards were added. Writes that
+# add nothing new leave the version, and with it the ETag, unchanged.
+DECK_VERSION_UPDATE = {'$inc': {'version': 1}, '$currentDate': {'updated_at': True}}
+
+
+# Number of new cards written by an insert_many that hit existing cards.
+# Duplicates are expected, any other write error is raised again.
+def inserted_despite_duplicates(error):
+    if any(e.get('code') != DUPLICATE_KEY for e in error.details.get('writeErrors', [])):
+        raise error
+    return error.details.get('nInserted', 0)
+
+
+# Documents of `embedded_cards`, the cards of embedded decks by card ID (see
+# card_id), so single cards are found without loading their deck
+def lookup_documents(username, course, flashcards=(), quizzes=()):
+    return [
+        {'_id': card_id(username, course, kind, card_hash(card)), 'username': username, 'card': card}
+        for kind, cards in ((FLASHCARD, flashcards), (QUIZ, quizzes))
+        for card in cards
+    ]
+
+
+# Original storage: one document per (username, course) holding every card
+# in `flashcards` and `quizzes` arrays
+class EmbeddedCardStore:
+    def __init__(self, db):
+        self.collection = db.flashcards
+        self.lookup = db.embedded_cards
+
+    def add(self, username, course, flashcards=(), quizzes=()):
+        update = embedded_update(flashcards, quizzes)
+        if not update:
+            return
+        deck = {'username': username, 'course': course}
+        result = self.collection.update_one(deck, update, upsert=True)
+        if result.modified_count or result.upserted_id is not None:
+            self.collection.update_one(deck, DECK_VERSION_UPDATE)
+        self._add_lookup(username, course, flashcards, quizzes)
+
+    def _add_lookup(self, username, course, flashcards=(), quizzes=()):
+        documents = lookup_documents(username, course, flashcards, quizzes)
+        if not documents:
+            return
+        try:
+            self.lookup.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            inserted_despite_duplicates(e)
+
+    def deck_version(self, username, course):
+        return deck_version(self.collection, username, course)
+
+    # One page of a deck, the cursor is the array offset of the next page.
+    # $slice keeps the rest of the array on the server.
+    def page(self, username, course, kind, limit, cursor=None):
+        field = EMBEDDED_FIELDS[kind]
+        offset = int(cursor or 0)
+        deck = self.collection.find_one(
+            {'username': username, 'course': course},
+            {'_id': 0, field: {'$slice': [offset, limit + 1]}}
+        ) or {}
+        items = deck.get(field, [])
+        next_cursor = offset + limit if len(items) > limit else None
+        return items[:limit], next_cursor
+
+    def get_deck(self, username, course):
+        deck = self.collection.find_one(
+            {'username': username, 'course': course},
+            {'_id': 0, 'flashcards': 1, 'quizzes': 1}
+        ) or {}
+        return {'flashcards': deck.get('flashcards', []), 'quizzes': deck.get('quizzes', [])}
+
+    def courses(self, username):
+        return self.collection.distinct('course', {'username': username})
+
+    # Cards of `refs` by card ID, refs being dicts with the `_id` (see
+    # card_id) and `course` of a card, e.g. review documents. One lookup on
+    # the _id index of `embedded_cards`. Cards that are gone are left out.
+    def cards_by_id(self, username, refs):
+        card_ids = {ref['_id'] for ref in refs}
+        found = {
+            doc['_id']: doc['card']
+            for doc in self.lookup.find({'_id': {'$in': list(card_ids)}, 'username': username}, {'card': 1})
+        }
+        # Decks stored before the lookup existed are added to it once
+        missing = {ref.get('course') for ref in refs if ref['_id'] not in found}
+        for course in missing:
+            deck = self.get_deck(username, course)
+            self._add_lookup(username, course, deck['flashcards'], deck['quizzes'])
+            for document in lookup_documents(username, course, deck['flashcards'], deck['quizzes']):
+                if document['_id'] in card_ids:
+                    found[document['_id']] = document['card']
+        return found
+
+    # Every deck of a user as (deck, cards) pairs, cards being (kind, card).
+    # Decks come from a server-side cursor, one batch at a time.
+    def export(self, username, since=None):
+        decks = self.collection.find(
+            deck_filter(username, since), dict(DECK_FIELDS, flashcards=1, quizzes=1)
+        ).sort('course', ASCENDING).batch_size(EXPORT_DECK_BATCH)
+        for deck in decks:
+            cards = itertools.chain(
+                ((FLASHCARD, card) for card in deck.pop('flashcards', [])),
+                ((QUIZ, card) for card in deck.pop('quizzes', []))
+            )
+            yield deck, cards
+
+
+def card_id(username, course, kind, content_hash):
+    key = json.dumps([username, course, kind, content_hash])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# Per-card documents for new cards. Cards keep the order they were generated
+# in through (created_at, position).
+def card_documents(username, course, flashcards=(), quizzes=()):
+    now = datetime.datetime.utcnow()
+    documents = []
+    for kind, cards in ((FLASHCARD, flashcards), (QUIZ, quizzes)):
+        for position, card in enumerate(cards):
+            content_hash = card_hash(card)
+            documents.append({
+                '_id': card_id(username, course, kind, content_hash),
+                'username': username,
+                'course': course,
+                'kind': kind,
+                'hash': content_hash,
+                'card': card,
+                'created_at': now,
+                'position': position
+            })
+    return documents
+
+
+# One document per card. The _id is derived from the owner and the card's
+# content hash, so writes are plain inserts where duplicates are rejected
+# by the _id index instead of compared against the whole deck.
+class PerCardStore:
+    def __init__(self, db):
+        self.collection = db.cards
+        self.decks = db.flashcards
+
+    def add(self, username, course, flashcards=(), quizzes=()):
+        documents = card_documents(username, course, flashcards, quizzes)
+        if not documents:
+            return
+        try:
+            inserted = len(self.collection.insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            inserted = inserted_despite_duplicates(e)
+
+        if inserted:
+            self.decks.update_one({'username': username, 'course': course}, DECK_VERSION_UPDATE, upsert=True)
+
+    def deck_version(self, username, course):
+        return deck_version(self.decks, username, course)
+
+    # One page of a deck using a keyset cursor on (created_at, position, _id),
+    # so later pages cost the same as the first one
+    def page(self, username, course, kind, limit, cursor=None):
+        query = {'username': username, 'course': course, 'kind': kind}
+        if cursor:
+            created_ms, position, card_id = cursor
+            created_at = EPOCH + datetime.timedelta(milliseconds=created_ms)
+            query['$or'] = [
+                {'created_at': {'$gt': created_at}},
+                {'created_at': created_at, 'position': {'$gt': position}},
+                {'created_at': created_at, 'position': position, '_id': {'$gt': card_id}}
+            ]
+        docs = list(self.collection.find(query, {'card': 1, 'created_at': 1, 'position': 1}).sort(
+            [('created_at', ASCENDING), ('position', ASCENDING), ('_id', ASCENDING)]
+        ).limit(limit + 1))
+
+        next_cursor = None
+        if len(docs) > limit:
+            last = docs[limit - 1]
+            created_ms = (last['created_at'] - EPOCH) // datetime.timedelta(milliseconds=1)
+            next_cursor = [created_ms, last['position'], last['_id']]
+        return [doc['card'] for doc in docs[:limit]], next_cursor
+
+    def find_cards(self, username, course, kind, skip=0, limit=0):
+        cursor = self.collection.find(
+            {'username': username, 'course': course, 'kind': kind},
+            {'_id': 0, 'card': 1}
+        ).sort([('created_at', ASCENDING), ('position', ASCENDING), ('_id', ASCENDING)]).skip(skip).limit(limit)
+        return [doc['card'] for doc in cursor]
+
+    def get_deck(self, username, course):
+        return {
+            'flashcards': self.find_cards(username, course, FLASHCARD),
+            'quizzes': self.find_cards(username, course, QUIZ)
+        }
+
+    def courses(self, username):
+        return self.decks.distinct('course', {'username': username})
+
+    # Same as EmbeddedCardStore.cards_by_id, one lookup on the _id index
+    def cards_by_id(self, username, refs):
+        card_ids = list({ref['_id'] for ref in refs})
+        return {
+            doc['_id']: doc['card']
+            for doc in self.collection.find({'_id': {'$in': card_ids}, 'username': username}, {'card': 1})
+        }
+
+    # Same as EmbeddedCardStore.export, the cards of each deck are read with
+    # their own cursor in the order of the deck index
+    def export(self, username, since=None):
+        decks = self.decks.find(deck_filter(username, since), DECK_FIELDS).sort('course', ASCENDING)
+        for deck in decks.batch_size(EXPORT_DECK_BATCH):
+            cards = self.collection.find(
+                {'username': username, 'course': deck.get('course')},
+                {'_id': 0, 'kind': 1, 'card': 1}
+            ).sort([('kind', ASCENDING), ('created_at', ASCENDING), ('position', ASCENDING), ('_id', ASCENDING)])
+            yield deck, ((doc['kind'], doc['card']) for doc in cards.batch_size(EXPORT_CARD_BATCH))
+
+
+# Write side of the embedded store for the ASGI app, on a Motor database.
+# Reads are served by the sync store.
+class AsyncEmbeddedCardStore:
+    def __init__(self, db):
+        self.collection = db.flashcards
+        self.lookup = db.embedded_cards
+
+    async def add(self, username, course, flashcards=(), quizzes=()):
+        update = embedded_update(flashcards, quizzes)
+        if not update:
+            return
+        deck = {'username': username, 'course': course}
+        result = await self.collection.update_one(deck, update, upsert=True)
+        if result.modified_count or result.upserted_id is not None:
+            await self.collection.update_one(deck, DECK_VERSION_UPDATE)
+        documents = lookup_documents(username, course, flashcards, quizzes)
+        try:
+            await self.lookup.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            inserted_despite_duplicates(e)
+
+
+# Write side of the per-card store for the ASGI app, on a Motor database
+class AsyncPerCardStore:
+    def __init__(self, db):
+        self.collection = db.cards
+        self.decks = db.flashcards
+
+    async def add(self, username, course, flashcards=(), quizzes=()):
+        documents = card_documents(username, course, flashcards, quizzes)
+        if not documents:
+            return
+        try:
+            inserted = len((await self.collection.insert_many(documents, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            inserted = inserted_despite_duplicates(e)
+
+        if inserted:
+            await self.decks.update_one({'username': username, 'course': course}, DECK_VERSION_UPDATE, upsert=True)
+
+
+# Build the store selected by FLASHCARD_STORAGE (embedded or per_card)
+def store_from_env(db):
+    mode = os.getenv('FLASHCARD_STORAGE', 'embedded')
+    if mode == 'per_card':
+        return PerCardStore(db)
+    if mode == 'embedded':
+        return EmbeddedCardStore(db)
+    raise ValueError(f"Unknown FLASHCARD_STORAGE: {mode}")
+
+
+# Async write side of the store selected by FLASHCARD_STORAGE
+def async_store_from_env(db):
+    mode = os.getenv('FLASHCARD_STORAGE', 'embedded')
+    if mode == 'per_card':
+        return AsyncPerCardStore(db)
+    if mode == 'embedded':
+        return AsyncEmbeddedCardStore(db)
+    raise ValueError(f"Unknown FLASHCARD_STORAGE: {mode}")
+
+
+# Copy every embedded deck into per-card documents. Re-running it is safe.
+#   python card_store.py migrate
+def migrate_to_per_card(db):
+    per_card = PerCardStore(db)
+    decks = 0
+    for deck in db.flashcards.find({}, {'_id': 0, 'username': 1, 'course': 1, 'flashcards': 1, 'quizzes': 1}):
+        per_card.add(deck.get('username'), deck.get('course'), deck.get('flashcards', []), deck.get('quizzes', []))
+        decks += 1
+    return decks
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['migrate']:
+        sys.exit('usage: python card_store.py migrate')
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    load_dotenv()
+    database = MongoClient(os.getenv('MONGO_URI')).flashy
+    ensure_indexes(database)
+    print(f"Migrated {migrate_to_per_card(database)} decks")
@@ -0,0 +1,202 @@
+import datetime
+import importlib.util
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from card_store import FLASHCARD, QUIZ
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Rows of the stored deck compared per matrix product, bounds temporary memory
+BLOCK_ROWS = 8192
+
+
+# Highest cosine similarity of each new vector to any stored vector.
+# Stored float16 rows are upcast one block at a time.
+def max_similarity(blocks, vectors):
+    best = np.full(len(vectors), -1.0, dtype=np.float32)
+    for block in blocks:
+        for start in range(0, len(block), BLOCK_ROWS):
+            sims = block[start:start + BLOCK_ROWS].astype(np.float32) @ vectors.T
+            np.maximum(best, sims.max(axis=0), out=best)
+    return best
+
+
+# Indexes of the new vectors to keep: not close to the stored deck, and not
+# close to a new vector that was kept before them
+def select_unique(blocks, vectors, threshold):
+    best = max_similarity(blocks, vectors)
+    batch_sims = vectors @ vectors.T
+    keep = []
+    for i in range(len(vectors)):
+        if best[i] >= threshold:
+            continue
+        if keep and batch_sims[i, keep].max() >= threshold:
+            continue
+        keep.append(i)
+    return keep
+
+
+def card_text(kind, card):
+    if kind == FLASHCARD:
+        return f"{card.get('front', '')} {card.get('back', '')}"
+    return str(card.get('question', ''))
+
+
+# Drops generated cards that are near-duplicates of each other or of the
+# cards already in the deck. Embeddings are L2-normalized and stored per
+# deck as float16 blocks, so cosine similarity is one matrix product.
+class SemanticDeduplicator:
+    def __init__(self, db, card_store, model_name='all-MiniLM-L6-v2', threshold=0.92, batch_size=64,
+                 max_cached_decks=32):
+        self.collection = db.card_embeddings
+        self.card_store = card_store
+        self.model_name = model_name
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.max_cached_decks = max_cached_decks
+        self.dropped = 0
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._decks = OrderedDict()
+        self._decks_lock = threading.Lock()
+        self._deck_locks = [threading.Lock() for _ in range(64)]
+        self._store_locks = [threading.Lock() for _ in range(64)]
+        try:
+            self.collection.create_index([('username', ASCENDING), ('course', ASCENDING), ('kind', ASCENDING)])
+        except PyMongoError as e:
+            logger.warning("Could not create index on card_embeddings: %s", e)
+
+    # sentence-transformers pulls in torch, so it is only loaded on first use
+    def _get_model(self):
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    def embed(self, texts):
+        vectors = self._get_model().encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        )
+        return vectors.astype(np.float32)
+
+    # Store new cards of a deck without its near-duplicates: filter, call
+    # write(flashcards, quiz_cards) with the cards kept and remember them.
+    # Concurrent stores of the same deck run one after the other, so cards of
+    # one job are compared with those another job just wrote. Returns the
+    # cards kept.
+    def store(self, username, course, flashcards, quiz_cards, write):
+        with self._store_locks[hash((username, course)) % len(self._store_locks)]:
+            with span('dedup'):
+                flashcards, flashcard_vectors = self.filter(username, course, FLASHCARD, flashcards)
+                quiz_cards, quiz_vectors = self.filter(username, course, QUIZ, quiz_cards)
+            write(flashcards, quiz_cards)
+            # Only cards that were stored count as duplicates later
+            self.remember(username, course, FLASHCARD, flashcard_vectors)
+            self.remember(username, course, QUIZ, quiz_vectors)
+        return flashcards, quiz_cards
+
+    # Keep only the cards that are not near-duplicates. Returns (cards,
+    # vectors): the embeddings of the kept cards, to be passed to remember()
+    # once the cards are stored.
+    def filter(self, username, course, kind, cards):
+        if not cards:
+            return cards, None
+
+        key = (username, course, kind)
+        with self._deck_locks[hash(key) % len(self._deck_locks)]:
+            blocks = self._load(key)
+            vectors = self.embed([card_text(kind, card) for card in cards])
+
+            keep = select_unique(blocks, vectors, self.threshold)
+
+            self.dropped += len(cards) - len(keep)
+            return [cards[i] for i in keep], vectors[keep].astype(np.float16)
+
+    # Remember the embeddings of stored cards so later cards are compared
+    # with them. Cards whose write failed are never remembered, or they
+    # would be dropped as duplicates of cards that do not exist.
+    def remember(self, username, course, kind, vectors):
+        if vectors is None or not len(vectors):
+            return
+        key = (username, course, kind)
+        with self._deck_locks[hash(key) % len(self._deck_locks)]:
+            self._persist(key, vectors)
+            with self._decks_lock:
+                blocks = self._decks.get(key)
+            if blocks is not None:
+                blocks.append(vectors)
+                if len(blocks) > 16:
+                    blocks[:] = [np.concatenate(blocks)]
+                self._remember(key, blocks)
+
+    # Embedding blocks of a deck: in-process LRU, then Mongo, then a one-off
+    # backfill for decks stored before deduplication was enabled
+    def _load(self, key):
+        with self._decks_lock:
+            blocks = self._decks.get(key)
+            if blocks is not None:
+                self._decks.move_to_end(key)
+                return blocks
+
+        username, course, kind = key
+        blocks = []
+        for doc in self.collection.find({'username': username, 'course': course, 'kind': kind}).sort('_id', ASCENDING):
+            blocks.append(np.frombuffer(doc['vectors'], dtype=np.float16).reshape(doc['count'], doc['dim']))
+
+        if not blocks:
+            field = 'flashcards' if kind == FLASHCARD else 'quizzes'
+            existing = self.card_store.get_deck(username, course)[field]
+            if existing:
+                vectors = self.embed([card_text(kind, card) for card in existing]).astype(np.float16)
+                self._persist(key, vectors)
+                blocks.append(vectors)
+
+        # One contiguous matrix is much faster to scan than many small blocks
+        if len(blocks) > 1:
+            blocks = [np.concatenate(blocks)]
+        self._remember(key, blocks)
+        return blocks
+
+    def _persist(self, key, vectors):
+        username, course, kind = key
+        self.collection.insert_one({
+            'username': username,
+            'course': course,
+            'kind': kind,
+            'count': vectors.shape[0],
+            'dim': vectors.shape[1],
+            'vectors': vectors.tobytes(),
+            'created_at': datetime.datetime.utcnow()
+        })
+
+    def _remember(self, key, blocks):
+        with self._decks_lock:
+            self._decks[key] = blocks
+            self._decks.move_to_end(key)
+            while len(self._decks) > self.max_cached_decks:
+                self._decks.popitem(last=False)
+
+
+# Build the deduplicator from the environment, None when it is disabled or
+# sentence-transformers is not installed
+def deduplicator_from_env(db, card_store):
+    if os.getenv('SEMANTIC_DEDUP', '1') != '1':
+        return None
+    # Only check that it is installed, importing it would load torch at startup
+    if importlib.util.find_spec('sentence_transformers') is None:
+        logger.warning("sentence-transformers is not installed, semantic deduplication is disabled")
+        return None
+    return SemanticDeduplicator(
+        db, card_store,
+        model_name=os.getenv('DEDUP_MODEL', 'all-MiniLM-L6-v2'),
+        threshold=float(os.getenv('DEDUP_THRESHOLD', '0.92'))
+    )
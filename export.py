@@ -0,0 +1,136 @@
+import csv
+import datetime
+import io
+import json
+from collections import namedtuple
+
+from card_store import QUIZ
+
+# Library exports for offline study. Every writer takes the (deck, cards)
+# pairs of CardStore.export and yields the body in chunks of about
+# CHUNK_SIZE, so memory stays flat however large the library is.
+CHUNK_SIZE = 64 * 1024
+
+EXPORT_VERSION = 1
+
+ExportFormat = namedtuple('ExportFormat', ['mimetype', 'extension', 'write'])
+
+
+# ISO 8601 timestamp, e.g. the `since` of an incremental export, as a naive
+# UTC datetime the way pymongo returns them. Raises ValueError when it cannot
+# be parsed.
+def parse_timestamp(value):
+    if not value:
+        return None
+    moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def isoformat(moment):
+    return moment.isoformat(timespec='milliseconds') + 'Z' if moment else None
+
+
+# Join small pieces of text into chunks of about CHUNK_SIZE bytes
+def chunked(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+# Text of csv rows, reusing one buffer
+def csv_lines(rows, **fmtparams):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, **fmtparams)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# One JSON object per line: an `export` header, then every deck followed by
+# its `flashcard` and `quiz` lines, and a `done` line with the totals.
+# `exported_at` is the `since` of the next incremental export.
+def write_ndjson(decks, username, since, exported_at):
+    def lines():
+        yield json.dumps({
+            'type': 'export', 'version': EXPORT_VERSION, 'username': username,
+            'since': isoformat(since), 'exported_at': isoformat(exported_at)
+        }) + '\n'
+        deck_count = card_count = 0
+        for deck, cards in decks:
+            course = deck.get('course')
+            deck_count += 1
+            yield json.dumps({
+                'type': 'deck', 'course': course, 'version': deck.get('version', 0),
+                'updated_at': isoformat(deck.get('updated_at'))
+            }) + '\n'
+            for kind, card in cards:
+                card_count += 1
+                yield json.dumps({'type': kind, 'course': course, 'card': card}) + '\n'
+        yield json.dumps({
+            'type': 'done', 'decks': deck_count, 'cards': card_count, 'exported_at': isoformat(exported_at)
+        }) + '\n'
+    return chunked(lines())
+
+
+def quiz_options(card):
+    return [str(option) for option in card.get('options') or []]
+
+
+# One row per card, flashcards fill front and back, quiz cards question,
+# options (separated by " | ") and answer
+CSV_HEADER = ['course', 'type', 'front', 'back', 'question', 'options', 'answer']
+
+
+def write_csv(decks, username, since, exported_at):
+    def rows():
+        yield CSV_HEADER
+        for deck, cards in decks:
+            course = deck.get('course')
+            for kind, card in cards:
+                if kind == QUIZ:
+                    yield [course, kind, '', '', card.get('question', ''), ' | '.join(quiz_options(card)),
+                           card.get('answer', '')]
+                else:
+                    yield [course, kind, card.get('front', ''), card.get('back', ''), '', '', '']
+    return chunked(csv_lines(rows()))
+
+
+# Anki text import: tab separated Basic notes, one Anki deck per course.
+# Quiz cards show the question and lettered options on the front.
+ANKI_HEADER = '#separator:tab\n#html:false\n#notetype:Basic\n#deck column:3\n'
+
+
+def write_anki(decks, username, since, exported_at):
+    def rows():
+        for deck, cards in decks:
+            anki_deck = f"Flashy::{deck.get('course')}"
+            for kind, card in cards:
+                if kind == QUIZ:
+                    options = '\n'.join(
+                        f'{chr(ord("A") + i)}) {option}' for i, option in enumerate(quiz_options(card))
+                    )
+                    yield [f"{card.get('question', '')}\n\n{options}", card.get('answer', ''), anki_deck]
+                else:
+                    yield [card.get('front', ''), card.get('back', ''), anki_deck]
+
+    def lines():
+        yield ANKI_HEADER
+        yield from csv_lines(rows(), delimiter='\t', lineterminator='\n')
+    return chunked(lines())
+
+
+EXPORT_FORMATS = {
+    'ndjson': ExportFormat('application/x-ndjson', 'ndjson', write_ndjson),
+    'csv': ExportFormat('text/csv', 'csv', write_csv),
+    'anki': ExportFormat('text/plain', 'txt', write_anki)
+}
@@ -1,39 +1,24 @@
-from docx import Document
-from pptx import Presentation
-import fitz  # PyMuPDF
 import os
+from extractor import extract_document
 from gemini import generate_flashcards
 
+# Thin wrappers over the shared extractor, returning the whole document text
+
 def extract_text_from_docx(docx_path):
     try:
-        doc = Document(docx_path)
-        text = []
-        for para in doc.paragraphs:
-            text.append(para.text)
-        return '\n'.join(text)
+        return '\n'.join(extract_document(docx_path, 'docx').pages)
     except Exception as e:
         return f"Error extracting text from DOCX: {str(e)}"
 
 def extract_text_from_pptx(pptx_path):
     try:
-        prs = Presentation(pptx_path)
-        text = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text.append(shape.text)
-        return '\n'.join(text)
+        return '\n'.join(extract_document(pptx_path, 'pptx').pages)
     except Exception as e:
         return f"Error extracting text from PPTX: {str(e)}"
 
 def extract_text_from_pdf(pdf_path):
     try:
-        doc = fitz.open(pdf_path)
-        text = []
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text.append(page.get_text())
-        return '\n'.join(text)
+        return '\n'.join(extract_document(pdf_path, 'pdf').pages)
     except Exception as e:
         return f"Error extracting text from PDF: {str(e)}"
 
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# PyMuPDF, python-docx and python-pptx are imported where they are used.
+# They are slow to import and the web process itself never parses anything.
+
+# PDFs are parsed in page ranges of this size, in parallel for large documents
+PDF_RANGE_PAGES = int(os.getenv('EXTRACT_RANGE_PAGES', '32'))
+
+# Worker processes for parsing and rendering, 0 runs everything in-process.
+# PyMuPDF is not thread safe, so PDF work is kept off the request threads.
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if EXTRACT_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the server's threads and sockets
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def run_in_pool(fn, *args):
+    pool = get_pool()
+    if pool is None:
+        return fn(*args)
+    return pool.submit(fn, *args).result()
+
+
+# Text of every page of a document, plus the page chunks shown in the
+# preview for DOCX and PPTX. PDF pages are rendered by page_cache.
+class ExtractedDocument:
+    def __init__(self, path, file_ext, pages, preview=None):
+        self.path = path
+        self.file_ext = file_ext
+        self.pages = pages
+        self.preview = preview
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+
+def chunk_text_by_lines(paragraphs, lines_per_page=25):
+    chunks = []
+    current_chunk = []
+    current_lines = 0
+    for p in paragraphs:
+        lines_in_p = p.count('\n') + 1
+        if current_lines + lines_in_p > lines_per_page:
+            chunks.append(current_chunk)
+            current_chunk = []
+            current_lines = 0
+        current_chunk.append(p)
+        current_lines += lines_in_p
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+# Returns (page_count, texts of pages start..end) of a PDF
+def _pdf_range(path, start, end):
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        end = min(end, doc.page_count)
+        return doc.page_count, [doc.load_page(i).get_text() for i in range(start, end)]
+
+
+def extract_pdf(path, parallel=True):
+    pool = get_pool() if parallel else None
+    if pool is None:
+        _, pages = _pdf_range(path, 0, float('inf'))
+        return pages
+
+    # The first range also tells us how many pages are left to fan out
+    page_count, pages = pool.submit(_pdf_range, path, 0, PDF_RANGE_PAGES).result()
+    futures = [
+        pool.submit(_pdf_range, path, start, start + PDF_RANGE_PAGES)
+        for start in range(PDF_RANGE_PAGES, page_count, PDF_RANGE_PAGES)
+    ]
+    for future in futures:
+        pages.extend(future.result()[1])
+    return pages
+
+
+def _docx_pages(path):
+    from docx import Document
+    doc = Document(path)
+    paragraphs = [p.text for p in doc.paragraphs]
+    return chunk_text_by_lines(paragraphs)
+
+
+def _pptx_pages(path):
+    from pptx import Presentation
+    ppt = Presentation(path)
+    slides_content = []
+    for slide in ppt.slides:
+        slide_text = []
+        for shape in slide.shapes:
+            if hasattr(shape, 'text'):
+                slide_text.append(shape.text)
+        slides_content.append('\n'.join(slide_text))
+    return chunk_text_by_lines(slides_content)
+
+
+TEXT_EXTRACTORS = {'docx': _docx_pages, 'pptx': _pptx_pages}
+
+
+# Parse a document in a single pass
+def extract_document(path, file_ext, parallel=True):
+    if file_ext == 'pdf':
+        return ExtractedDocument(path, file_ext, extract_pdf(path, parallel))
+
+    if file_ext not in TEXT_EXTRACTORS:
+        raise ValueError(f"Unsupported file type: {file_ext}")
+    extract = TEXT_EXTRACTORS[file_ext]
+    chunks = run_in_pool(extract, path) if parallel else extract(path)
+    return ExtractedDocument(path, file_ext, ['\n'.join(chunk) for chunk in chunks], chunks)
+
+
+# Render one PDF page to image bytes
+def render_pdf_page(path, page_num, dpi=110, fmt='jpeg', quality=75):
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        pix = doc.load_page(page_num - 1).get_pixmap(dpi=dpi)
+        if fmt == 'jpeg':
+            return pix.tobytes('jpeg', jpg_quality=quality)
+        return pix.tobytes(fmt)
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import re
+from llm_client import LLMError, client_from_env
+from response_cache import ResponseCache
+from stream_parser import IncrementalArrayParser, parse_json_array
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-1.5-pro')
+
+# One shared, rate limited client for every generator
+llm = client_from_env(MODEL_NAME)
+
+# Responses for identical (kind, text, count, model) requests are reused
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('LLM_CACHE_SIZE', '1024')),
+    ttl=int(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+)
+
+
+# Clean flashcard response
+def clean_text(text):
+    # Remove asterisks
+    text = text.replace('*', '')
+    # Remove HTML line breaks
+    text = text.replace('<br>', '\n')
+    # Remove any other unwanted symbols (e.g., extra spaces)
+    text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with a single space
+    return text.strip()
+
+# Clean a parsed card, None if it is not a usable flashcard
+def clean_card(card):
+    front, back = card.get('front'), card.get('back')
+    if not isinstance(front, str) or not isinstance(back, str):
+        return None
+    card['front'] = clean_text(front)
+    card['back'] = clean_text(back)
+    return card
+
+# Look up a previous response unless the caller asked to bypass the cache
+def cached_response(cache_key, use_cache):
+    if not use_cache:
+        response_cache.record_bypass()
+        return None
+    return response_cache.get(cache_key)
+
+def flashcard_prompt(text, num_flashcards):
+    return f"Create {num_flashcards} flashcards from the following text:\n\n{text}\n\n Return answers in json format as an array of objects with 'front' and 'back' keys. Everything should be inline, no backslash n"
+
+def quiz_prompt(text, num_quiz):
+    return f"Create {num_quiz} multiple-choice questions with answers from the following text:\n\n{text}\n\nReturn answers in JSON format as an array of objects with 'question', 'options' (an array of four possible answers), and 'answer' keys. Everything should be inline, no backslash n and no backslash either."
+
+# Parse the first JSON array of an answer, ignoring any prose around it.
+# Returns (items, complete).
+def parse_flashcards(response_text):
+    cards, complete = parse_json_array(response_text)
+    return [card for card in map(clean_card, cards) if card], complete
+
+def parse_quiz(response_text):
+    return parse_json_array(response_text)
+
+# Prompt builder and parser of each kind of generation
+KINDS = {
+    'flashcards': (flashcard_prompt, parse_flashcards),
+    'quiz': (quiz_prompt, parse_quiz)
+}
+
+# Check one answer of the model. Returns (items, complete), items is None
+# when the model should be asked again.
+def read_response(kind, response_text, attempt):
+    if not response_text:
+        logger.warning("Error generating %s on attempt %d.", kind, attempt + 1)
+        return None, False
+    with span('json_parse'):
+        items, complete = KINDS[kind][1](response_text)
+    if not items:
+        logger.warning("No %s found in the response on attempt %d.", kind, attempt + 1)
+        return None, False
+    if not complete:
+        # Keep what was parsed from a truncated answer instead of starting over
+        logger.warning("Truncated JSON on attempt %d, keeping %d %s.", attempt + 1, len(items), kind)
+    return items, complete
+
+# Shared by the sync and async generators. Transport errors are retried with
+# backoff inside the client, the generators only ask again when the model
+# answered with something unusable.
+def generate(kind, text, count, retries=3, use_cache=True):
+    cache_key = response_cache.key(kind, text, count, llm.model_name)
+    cached = cached_response(cache_key, use_cache)
+    if cached is not None:
+        return cached
+
+    with span('prompt_build'):
+        prompt = KINDS[kind][0](text, count)
+
+    for attempt in range(retries):
+        try:
+            items, complete = read_response(kind, llm.generate(prompt), attempt)
+            if items:
+                if complete:
+                    response_cache.set(cache_key, items, kind)
+                return items
+        except LLMError as e:
+            logger.error("Gemini error on attempt %d: %s", attempt + 1, e)
+            break
+        except Exception as e:
+            logger.exception("Unexpected error on attempt %d: %s", attempt + 1, e)
+
+    return f"Error generating {kind} after multiple attempts."
+
+# Same as generate() for the ASGI app. The response cache may go to Mongo,
+# so its lookups and writes run on a thread.
+async def agenerate(kind, text, count, retries=3, use_cache=True):
+    cache_key = response_cache.key(kind, text, count, llm.model_name)
+    cached = await asyncio.to_thread(cached_response, cache_key, use_cache)
+    if cached is not None:
+        return cached
+
+    with span('prompt_build'):
+        prompt = KINDS[kind][0](text, count)
+
+    for attempt in range(retries):
+        try:
+            items, complete = read_response(kind, await llm.agenerate(prompt), attempt)
+            if items:
+                if complete:
+                    await asyncio.to_thread(response_cache.set, cache_key, items, kind)
+                return items
+        except LLMError as e:
+            logger.error("Gemini error on attempt %d: %s", attempt + 1, e)
+            break
+        except Exception as e:
+            logger.exception("Unexpected error on attempt %d: %s", attempt + 1, e)
+
+    return f"Error generating {kind} after multiple attempts."
+
+# Flashcard generation with gemini
+def generate_flashcards(text, num_flashcards, retries=3, use_cache=True):
+    return generate('flashcards', text, num_flashcards, retries, use_cache)
+
+async def agenerate_flashcards(text, num_flashcards, retries=3, use_cache=True):
+    return await agenerate('flashcards', text, num_flashcards, retries, use_cache)
+
+
+# Streaming flashcard generation with gemini. Cards are yielded one by one
+# as soon as the model has finished writing them.
+def stream_flashcards(text, num_flashcards, use_cache=True):
+    cache_key = response_cache.key('flashcards', text, num_flashcards, llm.model_name)
+    cached = cached_response(cache_key, use_cache)
+    if cached is not None:
+        yield from cached
+        return
+
+    parser = IncrementalArrayParser()
+    flashcards = []
+    try:
+        for chunk in llm.generate_stream(flashcard_prompt(text, num_flashcards)):
+            for card in parser.feed(chunk):
+                card = clean_card(card)
+                if card:
+                    flashcards.append(card)
+                    yield card
+            if parser.done:
+                break
+    except LLMError as e:
+        # Cards already sent stay valid, only report the failure if there are none
+        logger.error("Gemini stream error after %d flashcards: %s", len(flashcards), e)
+        if not flashcards:
+            raise
+
+    if parser.done and flashcards:
+        response_cache.set(cache_key, flashcards, 'flashcards')
+
+
+# Quiz Generation with gemini
+def generate_quiz(text, num_quiz, retries=3, use_cache=True):
+    return generate('quiz', text, num_quiz, retries, use_cache)
+
+async def agenerate_quiz(text, num_quiz, retries=3, use_cache=True):
+    return await agenerate('quiz', text, num_quiz, retries, use_cache)
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import queue
+import re
+import threading
+from concurrent.futures import as_completed
+
+from admission import DEFAULT_TIER, AsyncFairSlots, FairExecutor
+from gemini import agenerate_flashcards, agenerate_quiz, generate_flashcards, generate_quiz, stream_flashcards
+from llm_client import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the document text of a single prompt
+SEGMENT_TOKEN_BUDGET = int(os.getenv('SEGMENT_TOKEN_BUDGET', '6000'))
+
+# Shared pool so concurrent jobs together never exceed the LLM concurrency
+# cap. Waiting calls start in weighted fair order by tier.
+llm_pool = FairExecutor(int(os.getenv('LLM_CONCURRENCY', '8')), thread_name_prefix='llm')
+
+# Gemini calls in flight across all jobs of the ASGI app. A waiting call
+# costs no thread there, so the cap is set by quota rather than memory.
+async_llm_slots = AsyncFairSlots(int(os.getenv('ASYNC_LLM_CONCURRENCY', '256')))
+
+DEDUP_KEY_PATTERN = re.compile(r'[\W_]+')
+
+
+# Split text into segments of at most `token_budget` tokens, breaking on
+# line boundaries where possible
+def split_segments(text, token_budget=SEGMENT_TOKEN_BUDGET):
+    max_chars = token_budget * CHARS_PER_TOKEN
+    segments = []
+    current = []
+    current_len = 0
+
+    for line in text.splitlines(keepends=True):
+        # A single line longer than the budget is split hard
+        while len(line) > max_chars:
+            if current:
+                segments.append(''.join(current))
+                current, current_len = [], 0
+            segments.append(line[:max_chars])
+            line = line[max_chars:]
+        if current_len + len(line) > max_chars and current:
+            segments.append(''.join(current))
+            current, current_len = [], 0
+        current.append(line)
+        current_len += len(line)
+
+    if current:
+        segments.append(''.join(current))
+    return [segment for segment in segments if segment.strip()]
+
+
+# Join neighbouring segments into `groups` runs of about equal size
+def merge_segments(segments, groups):
+    total = sum(len(segment) for segment in segments)
+    merged, current, size = [], [], 0
+    for index, segment in enumerate(segments):
+        current.append(segment)
+        size += len(segment)
+        groups_left = groups - len(merged) - 1
+        # Close the run at its share of the text, keeping a segment for each run still to come
+        if groups_left and (size >= total * (len(merged) + 1) / groups or len(segments) - index - 1 == groups_left):
+            merged.append(''.join(current))
+            current = []
+    merged.append(''.join(current))
+    return merged
+
+
+# Spread `count` items over the segments so every segment is prompted: each
+# gets one item and the rest go in proportion to size by largest remainders.
+# With fewer items than segments, neighbouring segments are merged first.
+def allocate(segments, count):
+    if not segments or count <= 0:
+        return []
+    if count < len(segments):
+        segments = merge_segments(segments, count)
+
+    sizes = [len(segment) for segment in segments]
+    total = sum(sizes)
+    extra = count - len(segments)
+    shares = [extra * size / total for size in sizes]
+    counts = [1 + int(share) for share in shares]
+    by_remainder = sorted(range(len(segments)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:count - sum(counts)]:
+        counts[i] += 1
+
+    return list(zip(segments, counts))
+
+
+# Plan the prompts for a request: a list of (segment_text, item_count)
+def plan_segments(text, count, token_budget=SEGMENT_TOKEN_BUDGET):
+    return allocate(split_segments(text, token_budget), int(count))
+
+
+def _dedup_key(item, field):
+    value = item.get(field, '') if isinstance(item, dict) else ''
+    return DEDUP_KEY_PATTERN.sub(' ', str(value)).strip().lower()
+
+
+# Merge per-segment results in segment order, dropping repeated cards
+def merge_results(results, field):
+    merged = []
+    seen = set()
+    for items in results:
+        for item in items:
+            key = _dedup_key(item, field)
+            if key and key in seen:
+                continue
+            seen.add(key)
+            merged.append(item)
+    return merged
+
+
+# Generate flashcards and quiz questions for a text of any size.
+# Every segment prompt (and the quiz prompts) run concurrently on the shared
+# LLM pool, so latency is bounded by the slowest segment. Segments that fail
+# are dropped, the call only fails if nothing at all could be generated.
+def generate_deck(text, num_flashcards, num_quiz=0, token_budget=SEGMENT_TOKEN_BUDGET, on_progress=None, use_cache=True,
+                  tier=DEFAULT_TIER):
+    segments = split_segments(text, token_budget)
+    card_plan = allocate(segments, int(num_flashcards or 0))
+    quiz_plan = allocate(segments, int(num_quiz or 0))
+
+    futures = {}
+    for index, (segment, n) in enumerate(card_plan):
+        future = llm_pool.submit(generate_flashcards, segment, n, tier=tier, use_cache=use_cache)
+        futures[future] = ('flashcards', index)
+    for index, (segment, n) in enumerate(quiz_plan):
+        futures[llm_pool.submit(generate_quiz, segment, n, tier=tier, use_cache=use_cache)] = ('quiz', index)
+
+    card_results = [[] for _ in card_plan]
+    quiz_results = [[] for _ in quiz_plan]
+    failures = []
+    for done, future in enumerate(as_completed(futures), start=1):
+        kind, index = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            result = str(e)
+        record_result(result, kind, index, card_results, quiz_results, failures)
+        if on_progress:
+            on_progress(done, len(futures))
+
+    return merge_deck(card_plan, quiz_plan, card_results, quiz_results, failures)
+
+
+# Same as generate_deck for the ASGI app. Segments run as tasks on the event
+# loop, bounded by ASYNC_LLM_CONCURRENCY instead of the thread pool.
+async def agenerate_deck(text, num_flashcards, num_quiz=0, token_budget=SEGMENT_TOKEN_BUDGET, on_progress=None,
+                         use_cache=True, tier=DEFAULT_TIER):
+    segments = split_segments(text, token_budget)
+    card_plan = allocate(segments, int(num_flashcards or 0))
+    quiz_plan = allocate(segments, int(num_quiz or 0))
+
+    calls = [('flashcards', index, agenerate_flashcards, segment, n) for index, (segment, n) in enumerate(card_plan)]
+    calls += [('quiz', index, agenerate_quiz, segment, n) for index, (segment, n) in enumerate(quiz_plan)]
+
+    card_results = [[] for _ in card_plan]
+    quiz_results = [[] for _ in quiz_plan]
+    failures = []
+    done = 0
+
+    async def run(kind, index, generate, segment, n):
+        nonlocal done
+        async with async_llm_slots.slot(tier):
+            try:
+                result = await generate(segment, n, use_cache=use_cache)
+            except Exception as e:
+                result = str(e)
+        record_result(result, kind, index, card_results, quiz_results, failures)
+        done += 1
+        if on_progress:
+            on_progress(done, len(calls))
+
+    await asyncio.gather(*(run(*call) for call in calls))
+    return merge_deck(card_plan, quiz_plan, card_results, quiz_results, failures)
+
+
+# Keep the result of one segment, the generators report failure with an error string
+def record_result(result, kind, index, card_results, quiz_results, failures):
+    if isinstance(result, str):
+        failures.append(result)
+    elif kind == 'flashcards':
+        card_results[index] = result
+    else:
+        quiz_results[index] = result
+
+
+# Merge the segment results of a deck, failing only if nothing could be generated
+def merge_deck(card_plan, quiz_plan, card_results, quiz_results, failures):
+    flashcards = merge_results(card_results, 'front')
+    quiz_cards = merge_results(quiz_results, 'question')
+
+    if failures:
+        logger.warning("%d of %d generation segments failed", len(failures), len(card_plan) + len(quiz_plan))
+    if (card_plan and not flashcards) or (quiz_plan and not quiz_cards):
+        raise RuntimeError(failures[0] if failures else "Error generating flashcards after multiple attempts.")
+    return flashcards, quiz_cards
+
+
+# Streaming version of generate_deck for flashcards. Segments stream
+# concurrently and cards are yielded in arrival order, de-duplicated, as
+# soon as any segment finishes one. Closing the generator stops the
+# remaining segment streams.
+def stream_deck(text, num_flashcards, token_budget=SEGMENT_TOKEN_BUDGET, use_cache=True, tier=DEFAULT_TIER):
+    card_plan = plan_segments(text, num_flashcards or 0, token_budget)
+    results = queue.Queue()
+    cancelled = threading.Event()
+
+    def run(segment, n):
+        try:
+            for card in stream_flashcards(segment, n, use_cache=use_cache):
+                if cancelled.is_set():
+                    break
+                results.put(('card', card))
+        except Exception as e:
+            results.put(('error', str(e)))
+        finally:
+            results.put(('done', None))
+
+    for segment, n in card_plan:
+        llm_pool.submit(run, segment, n, tier=tier)
+
+    pending = len(card_plan)
+    seen = set()
+    failures = []
+    sent = 0
+    try:
+        while pending:
+            kind, value = results.get()
+            if kind == 'done':
+                pending -= 1
+            elif kind == 'error':
+                failures.append(value)
+            else:
+                key = _dedup_key(value, 'front')
+                if key in seen:
+                    continue
+                seen.add(key)
+                sent += 1
+                yield value
+    finally:
+        cancelled.set()
+
+    if failures:
+        logger.warning("%d of %d streaming segments failed", len(failures), len(card_plan))
+        if not sent:
+            raise RuntimeError(failures[0])
@@ -0,0 +1,122 @@
+import base64
+import functools
+import gzip
+import hashlib
+import json
+import zlib
+
+from flask import Response, make_response, request
+
+# Optional faster serializer and compressor, the stdlib is used without them
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Response headers cross-origin clients may read, in both serving modes
+EXPOSED_HEADERS = ['X-Input-Tokens', 'X-Input-Tokens-Saved', 'X-Exported-At']
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+# Like jsonify, but with the fast serializer for the read-heavy endpoints
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+# Compress a response for clients that accept brotli or gzip
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# View decorator that compresses the response body
+def compressed(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return compress_response(make_response(view(*args, **kwargs)))
+    return wrapper
+
+
+# Gzip a streamed body chunk by chunk when the client accepts it, the
+# whole body is never held in memory. Returns the (possibly wrapped) chunks.
+def compress_stream(response, chunks):
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return chunks
+    response.headers['Content-Encoding'] = 'gzip'
+
+    def gzipped():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    return gzipped()
+
+
+def make_etag(*parts):
+    return hashlib.sha1(dumps(parts)).hexdigest()
+
+
+# True if the client already holds the representation with this ETag
+def etag_matches(etag):
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+# Opaque pagination cursors, clients only pass them back
+def encode_cursor(value):
+    if value is None:
+        return None
+    return base64.urlsafe_b64encode(dumps(value)).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+# Request parameters from the JSON body of a POST or the query string of a GET
+def request_params():
+    if request.method == 'GET':
+        return request.args
+    return request.get_json(silent=True) or {}
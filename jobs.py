@@ -0,0 +1,326 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+from admission import DEFAULT_TIER, AsyncFairSlots, FairQueue, observe_wait, tier_of
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED_STATES = {SUCCEEDED, FAILED}
+
+# Error a failed job reports to clients, the exception is only logged
+JOB_ERROR = 'Generation failed, please try again.'
+
+
+class QueueFull(Exception):
+    pass
+
+
+# A background generation job. Stage changes are recorded as numbered
+# events so clients can poll the latest state or follow them over SSE.
+class Job:
+    def __init__(self, kind, tier=DEFAULT_TIER):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        # Scheduling tier of the job and of its Gemini calls, see admission.py
+        self.tier = tier_of(tier)
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.events = []
+        # Latest per-file state of a bulk job, see app.BulkProgress. Events
+        # only carry the entry that changed.
+        self.files = None
+        # Called on every event, used by waiters on an event loop
+        self._listeners = []
+        self._condition = threading.Condition()
+        with self._condition:
+            self._record()
+
+    # Report that the job moved to a new pipeline stage
+    def update(self, stage, progress=None, **details):
+        with self._condition:
+            self.stage = stage
+            if progress is not None:
+                self.progress = progress
+            if 'files' in details:
+                self.files = details.pop('files')
+            self._record(**details)
+
+    def _start(self):
+        with self._condition:
+            self.status = RUNNING
+            self.stage = RUNNING
+            self._record()
+
+    def _finish(self, result=None, error=None):
+        with self._condition:
+            self.status = FAILED if error else SUCCEEDED
+            self.stage = self.status
+            self.result = result
+            self.error = error
+            if not error:
+                self.progress = 1.0
+            self._record()
+
+    # Must be called with the condition held
+    def _record(self, **details):
+        self.updated_at = time.time()
+        event = {'seq': len(self.events), 'status': self.status, 'stage': self.stage, 'progress': self.progress}
+        event.update(details)
+        self.events.append(event)
+        self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        with self._condition:
+            data = {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': self.progress,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at
+            }
+            if self.files is not None:
+                data['files'] = list(self.files)
+            if self.status == SUCCEEDED:
+                data['result'] = self.result
+            if self.status == FAILED:
+                data['error'] = self.error
+            return data
+
+    # Wait for events after `after_seq`, returns [] on timeout
+    def wait_for_events(self, after_seq, timeout):
+        with self._condition:
+            if len(self.events) <= after_seq + 1 and not self.finished:
+                self._condition.wait(timeout)
+            return self.events[after_seq + 1:]
+
+    # Same as wait_for_events for coroutines, the wait does not hold a thread
+    async def wait_for_events_async(self, after_seq, timeout):
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        # Events may be recorded on another thread
+        def listener():
+            loop.call_soon_threadsafe(changed.set)
+
+        with self._condition:
+            if len(self.events) > after_seq + 1 or self.finished:
+                return self.events[after_seq + 1:]
+            self._listeners.append(listener)
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                self._listeners.remove(listener)
+        with self._condition:
+            return self.events[after_seq + 1:]
+
+    def _sse_events(self, events):
+        for event in events:
+            yield f"id: {event['seq']}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+
+    def _sse_done(self):
+        return f"event: done\ndata: {json.dumps(self.to_dict())}\n\n"
+
+    # Server-sent event stream of the job's progress, ending when it finishes
+    def sse_stream(self, last_event_id=-1, heartbeat=15):
+        seq = last_event_id
+        while True:
+            events = self.wait_for_events(seq, heartbeat)
+            if events:
+                seq = events[-1]['seq']
+            yield from self._sse_events(events)
+            if self.finished and seq >= len(self.events) - 1:
+                yield self._sse_done()
+                return
+            if not events:
+                yield ': keep-alive\n\n'
+
+    async def sse_stream_async(self, last_event_id=-1, heartbeat=15):
+        seq = last_event_id
+        while True:
+            events = await self.wait_for_events_async(seq, heartbeat)
+            if events:
+                seq = events[-1]['seq']
+            for chunk in self._sse_events(events):
+                yield chunk
+            if self.finished and seq >= len(self.events) - 1:
+                yield self._sse_done()
+                return
+            if not events:
+                yield ': keep-alive\n\n'
+
+
+# Bounded in-process job queue. A fixed pool of worker threads takes jobs in
+# weighted fair order by tier (see admission.FairQueue), so no outside
+# broker is needed to run or test it.
+class JobQueue:
+    def __init__(self, max_workers=4, max_queued=100, ttl=3600):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._queue = FairQueue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._job_ready = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._workers = []
+
+    # Queue fn(job, *args, **kwargs) to run on a worker, returns the Job
+    def submit(self, kind, fn, *args, tier=DEFAULT_TIER, **kwargs):
+        self._start_workers()
+        self._expire_finished()
+
+        job = Job(kind, tier)
+        with self._lock:
+            if len(self._queue) >= self.max_queued:
+                raise QueueFull(f"Job queue is full ({len(self._queue)} jobs waiting)")
+            self._jobs[job.id] = job
+            self._queue.push(job.tier, (job, fn, args, kwargs))
+            self._unfinished += 1
+            self._job_ready.notify()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Jobs waiting for a worker, of one tier or all of them
+    def queued(self, tier=None):
+        with self._lock:
+            return self._queue.queued(tier)
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name=f'job-worker-{len(self._workers)}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                entry = self._queue.pop()
+                while entry is None:
+                    self._job_ready.wait()
+                    entry = self._queue.pop()
+            tier, waited, (job, fn, args, kwargs) = entry
+            observe_wait('jobs', tier, waited)
+            job._start()
+            try:
+                result = fn(job, *args, **kwargs)
+            except Exception as e:
+                logger.exception("Job %s (%s) failed: %s", job.id, job.kind, e)
+                job._finish(error=JOB_ERROR)
+            else:
+                job._finish(result=result)
+            finally:
+                with self._lock:
+                    self._unfinished -= 1
+                    if not self._unfinished:
+                        self._all_done.notify_all()
+
+    # Forget jobs that finished more than `ttl` seconds ago
+    def _expire_finished(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.updated_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    # Block until every queued job has finished, mostly useful in tests
+    def join(self):
+        with self._lock:
+            while self._unfinished:
+                self._all_done.wait()
+
+
+# Job queue of the ASGI app. Jobs are coroutines running as tasks on the
+# event loop, a job waiting on Gemini or Mongo holds no thread, so hundreds
+# can be in flight at once. Slots go out in weighted fair order by tier.
+# Must be used from the event loop thread.
+class AsyncJobQueue:
+    def __init__(self, max_running=500, max_queued=100, ttl=3600):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._slots = AsyncFairSlots(max_running, queue_name='jobs')
+        self._jobs = {}
+        self._tasks = set()
+        self._waiting = Counter()
+
+    # Start `await fn(job, *args, **kwargs)` as a task, returns the Job
+    def submit(self, kind, fn, *args, tier=DEFAULT_TIER, **kwargs):
+        self._expire_finished()
+        waiting = self.queued()
+        if waiting >= self.max_queued:
+            raise QueueFull(f"Job queue is full ({waiting} jobs waiting)")
+
+        job = Job(kind, tier)
+        self._jobs[job.id] = job
+        self._waiting[job.tier] += 1
+        task = asyncio.get_running_loop().create_task(self._run(job, fn, args, kwargs))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job, fn, args, kwargs):
+        async with self._slots.slot(job.tier):
+            self._waiting[job.tier] -= 1
+            job._start()
+            try:
+                result = await fn(job, *args, **kwargs)
+            except Exception as e:
+                logger.exception("Job %s (%s) failed: %s", job.id, job.kind, e)
+                job._finish(error=JOB_ERROR)
+            else:
+                job._finish(result=result)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    # Jobs waiting for a slot, of one tier or all of them
+    def queued(self, tier=None):
+        if tier is None:
+            return sum(self._waiting.values())
+        return self._waiting[tier_of(tier)]
+
+    # Jobs started and not finished yet
+    def running(self):
+        return len(self._tasks) - self.queued()
+
+    def _expire_finished(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.updated_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    # Wait until every submitted job has finished, mostly useful in tests
+    async def join(self):
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
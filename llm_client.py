@@ -0,0 +1,379 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from telemetry import counter, observe_stage, span
+
+logger = logging.getLogger(__name__)
+
+LLM_CALLS = counter('flashy_llm_calls_total', 'Gemini calls by outcome', ['outcome'])
+LLM_RETRIES = counter('flashy_llm_retries_total', 'Gemini calls retried after a retryable error')
+
+# Rough local estimate, Gemini averages about four characters per token
+CHARS_PER_TOKEN = 4
+
+# The Google client libraries take about a second to import, so they are
+# loaded on the first Gemini call rather than at startup.
+
+# Errors worth retrying after a pause: quota, overload and transient faults
+@functools.lru_cache(maxsize=None)
+def retryable_errors():
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.GatewayTimeout,
+        ConnectionError,
+        TimeoutError
+    )
+
+
+# Errors that retrying cannot fix: bad requests, auth failures, blocked prompts.
+# Checked after retryable_errors(), which are GoogleAPIErrors as well.
+@functools.lru_cache(maxsize=None)
+def fatal_errors():
+    import google.generativeai as genai
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.GoogleAPIError,
+        genai.types.BlockedPromptException,
+        genai.types.StopCandidateException
+    )
+
+RETRY_DELAY_PATTERNS = (
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)'),
+    re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE),
+    re.compile(r'retry-after:?\s*([\d.]+)', re.IGNORECASE)
+)
+
+
+class LLMError(Exception):
+    pass
+
+
+# Raised for errors that retrying cannot fix (bad request, auth, blocked prompt)
+class LLMFatalError(LLMError):
+    pass
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+# Token bucket that hands out reservations, a caller that overdraws the
+# bucket simply sleeps until its share has refilled
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take `amount` tokens, returns how long the caller has to wait for them
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+
+# Process-wide limiter on requests and tokens per minute. A rate of 0
+# disables that bucket. A retry-after from the API pauses every caller.
+class RateLimiter:
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Reserve a request and `tokens`, returns how long to wait before calling
+    def _reserve(self, tokens):
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        with self._lock:
+            return max(wait, self._paused_until - time.monotonic())
+
+    def acquire(self, tokens=0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    # Same as acquire() for coroutines, the wait does not hold a thread
+    async def acquire_async(self, tokens=0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# Backend that calls Gemini through one shared GenerativeModel, created on
+# the first call
+class GeminiBackend:
+    def __init__(self, model_name, api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    def generate(self, prompt):
+        response = self.model.generate_content(prompt)
+        if response and response.candidates:
+            return response.candidates[0].content.parts[0].text
+        return None
+
+    async def agenerate(self, prompt):
+        response = await self.model.generate_content_async(prompt)
+        if response and response.candidates:
+            return response.candidates[0].content.parts[0].text
+        return None
+
+    def generate_stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            if chunk.candidates and chunk.candidates[0].content.parts:
+                yield chunk.candidates[0].content.parts[0].text
+
+    # (retryable, fatal) exception classes of the calls above
+    def error_classes(self):
+        return retryable_errors(), fatal_errors()
+
+
+# Offline stand-in for Gemini with configurable latency and failure rate.
+# It answers flashcard and quiz prompts with well formed JSON built from the
+# prompt text so the whole pipeline can be load tested without an API key.
+class FakeBackend:
+    COUNT_PATTERN = re.compile(r'Create (\d+)')
+
+    def __init__(self, latency=0.5, jitter=0.1, failure_rate=0.0, model_name='fake'):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.model_name = model_name
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        return ''.join(self.generate_stream(prompt))
+
+    async def agenerate(self, prompt):
+        latency = self._start_call()
+        await asyncio.sleep(latency)
+        return self._respond(prompt)
+
+    # Count the call and pick its latency, raising the configured share of quota errors
+    def _start_call(self):
+        with self._lock:
+            self.calls += 1
+        if random.random() < self.failure_rate:
+            from google.api_core import exceptions as google_exceptions
+            raise google_exceptions.ResourceExhausted('Fake quota exceeded, please retry in 1s')
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    # Stream the answer in small pieces, the first one after a fifth of the latency
+    def generate_stream(self, prompt, chunk_size=64):
+        latency = self._start_call()
+        time.sleep(latency * 0.2)
+
+        text = self._respond(prompt)
+        pieces = range(0, len(text), chunk_size)
+        for start in pieces:
+            time.sleep(latency * 0.8 / len(pieces))
+            yield text[start:start + chunk_size]
+
+    # Only the quota errors of _start_call, the Gemini SDK is never imported
+    def error_classes(self):
+        return retryable_errors(), ()
+
+    def _respond(self, prompt):
+        match = self.COUNT_PATTERN.search(prompt)
+        count = int(match.group(1)) if match else 5
+        words = re.findall(r'\w{4,}', prompt)[8:] or ['topic']
+        if 'multiple-choice' in prompt:
+            items = [{
+                'question': f"Which term relates to {words[i % len(words)]}?",
+                'options': [words[(i + k) % len(words)] for k in range(4)],
+                'answer': words[i % len(words)]
+            } for i in range(count)]
+        else:
+            items = [{
+                'front': f"What is {words[i % len(words)]} ({i + 1})?",
+                'back': ' '.join(words[i:i + 12]) or words[0]
+            } for i in range(count)]
+        return "Here you go:\n" + json.dumps(items)
+
+
+# Shared client used by every generator. Calls are paced by the rate
+# limiter and retried with exponential backoff and full jitter, honoring any
+# retry delay the API asks for. Fatal errors are raised straight away.
+class LLMClient:
+    def __init__(self, backend, limiter=None, max_retries=4, base_delay=1.0, max_delay=30.0,
+                 expected_output_tokens=1024):
+        self.backend = backend
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expected_output_tokens = expected_output_tokens
+        self.retries = 0
+        self._errors = None
+        self._errors_lock = threading.Lock()
+
+    @property
+    def model_name(self):
+        return self.backend.model_name
+
+    # (retryable, handled) exception classes of the backend, handled being
+    # retryable and fatal ones. Resolved once, on the first call, so the
+    # client libraries are not imported at startup.
+    def error_classes(self):
+        with self._errors_lock:
+            if self._errors is None:
+                retryable, fatal = self.backend.error_classes()
+                self._errors = (retryable, retryable + fatal)
+            return self._errors
+
+    # Return the response text for a prompt, or None if the model gave no candidates
+    def generate(self, prompt):
+        tokens = estimate_tokens(prompt) + self.expected_output_tokens
+        _, handled = self.error_classes()
+        for attempt in range(self.max_retries + 1):
+            with span('rate_limit_wait'):
+                self.limiter.acquire(tokens)
+            try:
+                with span('llm_call'):
+                    text = self.backend.generate(prompt)
+                LLM_CALLS.inc(outcome='ok')
+                return text
+            except handled as e:
+                time.sleep(self._retry_delay(attempt, e))
+
+    # Same as generate() for coroutines, waits and backoff do not hold a thread
+    async def agenerate(self, prompt):
+        tokens = estimate_tokens(prompt) + self.expected_output_tokens
+        _, handled = self.error_classes()
+        for attempt in range(self.max_retries + 1):
+            with span('rate_limit_wait'):
+                await self.limiter.acquire_async(tokens)
+            try:
+                with span('llm_call'):
+                    text = await self.backend.agenerate(prompt)
+                LLM_CALLS.inc(outcome='ok')
+                return text
+            except handled as e:
+                await asyncio.sleep(self._retry_delay(attempt, e))
+
+    # Yield the response text as it is generated. Errors are only retried
+    # before the first chunk, after that the caller already used the output.
+    # Every attempt is counted, also when the caller stops reading early.
+    def generate_stream(self, prompt):
+        tokens = estimate_tokens(prompt) + self.expected_output_tokens
+        _, handled = self.error_classes()
+        for attempt in range(self.max_retries + 1):
+            with span('rate_limit_wait'):
+                self.limiter.acquire(tokens)
+            started = False
+            outcome = 'error'
+            start = time.perf_counter()
+            try:
+                for text in self.backend.generate_stream(prompt):
+                    if not started:
+                        observe_stage('llm_first_chunk', time.perf_counter() - start)
+                        started = True
+                    yield text
+                outcome = 'ok'
+                return
+            except GeneratorExit:
+                outcome = 'cancelled'
+                raise
+            except handled as e:
+                if started:
+                    raise LLMError(f"Gemini stream failed midway: {e}") from e
+                # Counted by _retry_delay
+                outcome = None
+                time.sleep(self._retry_delay(attempt, e))
+            finally:
+                if outcome is not None:
+                    observe_stage('llm_call', time.perf_counter() - start)
+                    LLM_CALLS.inc(outcome=outcome)
+
+    # How long to wait before the next attempt, raises if the error cannot be retried
+    def _retry_delay(self, attempt, error):
+        if not isinstance(error, self.error_classes()[0]):
+            LLM_CALLS.inc(outcome='fatal')
+            raise LLMFatalError(str(error)) from error
+        if attempt == self.max_retries:
+            LLM_CALLS.inc(outcome='error')
+            raise LLMError(f"Gemini call failed after {attempt + 1} attempts: {error}") from error
+        delay = self.backoff_delay(attempt, error)
+        self.retries += 1
+        LLM_CALLS.inc(outcome='retry')
+        LLM_RETRIES.inc()
+        logger.warning("Retryable Gemini error on attempt %d, retrying in %.1fs: %s", attempt + 1, delay, error)
+        return delay
+
+    def backoff_delay(self, attempt, error):
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            # Everyone backs off when the API says the quota is exhausted
+            self.limiter.pause(retry_after)
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+# Extract the retry delay the API asked for, if any
+def retry_after_seconds(error):
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return float(retry_after)
+    message = str(error)
+    for pattern in RETRY_DELAY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+# Build the shared client from the environment. LLM_BACKEND=fake swaps in
+# the offline backend for load tests.
+def client_from_env(model_name):
+    if os.getenv('LLM_BACKEND', 'gemini') == 'fake':
+        backend = FakeBackend(
+            latency=float(os.getenv('FAKE_LLM_LATENCY_MS', '500')) / 1000,
+            failure_rate=float(os.getenv('FAKE_LLM_FAILURE_RATE', '0'))
+        )
+    else:
+        backend = GeminiBackend(model_name, api_key=os.getenv('API_KEY'))
+
+    limiter = RateLimiter(
+        requests_per_minute=int(os.getenv('LLM_REQUESTS_PER_MINUTE', '300')),
+        tokens_per_minute=int(os.getenv('LLM_TOKENS_PER_MINUTE', '1000000'))
+    )
+    return LLMClient(backend, limiter, max_retries=int(os.getenv('LLM_MAX_RETRIES', '4')))
@@ -0,0 +1,100 @@
+import io
+import threading
+
+from blob_store import Blob, BlobNotFound
+from extractor import render_pdf_page, run_in_pool
+from telemetry import counter, span
+
+# Mimetype for each supported render format
+RENDER_MIMETYPES = {'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+PAGE_CACHE_LOOKUPS = counter('flashy_page_cache_lookups_total', 'Rendered page lookups by result', ['result'])
+
+
+# Cache of rendered PDF pages keyed by document hash and page number, kept
+# in a blob store (see blob_store.py). Pages are rendered on first request
+# at a preview-sized DPI, and the least recently used images are evicted
+# once the cache grows past its quota. With a shared store every node
+# counts its own renders, so the quota is enforced approximately.
+class PageImageCache:
+    def __init__(self, blobs, max_bytes=512 * 1024 * 1024, dpi=110, fmt='jpeg', quality=75):
+        if fmt not in RENDER_MIMETYPES:
+            raise ValueError(f"Unsupported render format: {fmt}")
+        self.blobs = blobs
+        self.max_bytes = max_bytes
+        self.dpi = dpi
+        self.fmt = fmt
+        self.quality = quality
+        self.mimetype = RENDER_MIMETYPES[fmt]
+        # Concurrent requests for the same page wait for a single render
+        self._render_locks = [threading.Lock() for _ in range(64)]
+        self._size_lock = threading.Lock()
+        self._total_bytes = self._scan_size()
+
+    def key_for(self, doc_hash, page_num):
+        extension = 'jpg' if self.fmt == 'jpeg' else self.fmt
+        return f'{doc_hash}/page_{page_num}.{extension}'
+
+    # Return the cached image of a page as a Blob, rendering it first if
+    # needed. `pdf_file()` gives a context manager for a local path of the PDF.
+    def get_or_render(self, doc_hash, page_num, pdf_file):
+        key = self.key_for(doc_hash, page_num)
+        blob = self._open(key)
+        if blob is not None:
+            PAGE_CACHE_LOOKUPS.inc(result='hit')
+            return blob
+
+        with self._render_locks[hash(key) % len(self._render_locks)]:
+            # Another request may have rendered the page while we waited
+            blob = self._open(key)
+            if blob is not None:
+                PAGE_CACHE_LOOKUPS.inc(result='hit')
+                return blob
+            # Rendering runs on the extractor's worker processes
+            PAGE_CACHE_LOOKUPS.inc(result='render')
+            with span('render'), pdf_file() as pdf_path:
+                data = run_in_pool(render_pdf_page, pdf_path, page_num, self.dpi, self.fmt, self.quality)
+            self.blobs.put_bytes(key, data)
+
+        with self._size_lock:
+            self._total_bytes += len(data)
+            over_quota = self._total_bytes > self.max_bytes
+        if over_quota:
+            self.evict(keep=key)
+        return Blob(io.BytesIO(data), len(data))
+
+    # Open a cached image and refresh its access time used for LRU ordering,
+    # None if not cached
+    def _open(self, key):
+        if not self.blobs.touch(key):
+            return None
+        try:
+            return self.blobs.open(key)
+        except BlobNotFound:
+            return None
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self.blobs.entries())
+
+    # Delete least recently used images until the cache is back under quota
+    def evict(self, keep=None):
+        entries = sorted(self.blobs.entries())
+        total = sum(size for _, size, _ in entries)
+        # Leave some headroom so every new render does not trigger a full scan
+        target = int(self.max_bytes * 0.9)
+        for _, size, key in entries:
+            if total <= target:
+                break
+            if key == keep:
+                continue
+            self.blobs.delete(key)
+            total -= size
+
+        with self._size_lock:
+            self._total_bytes = total
+
+    # Drop every cached page of a document
+    def remove(self, doc_hash):
+        self.blobs.delete_prefix(f'{doc_hash}/')
+        with self._size_lock:
+            self._total_bytes = self._scan_size()
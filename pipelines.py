@@ -0,0 +1,190 @@
+import logging
+import os
+
+from admission import Overloaded
+from text_prep import prepare_pages
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Request parsing, responses and job pipeline steps of the generation routes,
+# shared by the Flask app (app.py) and the ASGI app (asgi.py). Responses are
+# (body, status[, headers]) tuples, which both frameworks send as JSON, so
+# each app only adds its own await or thread around the calls.
+
+# Cards one generation request may ask for, and how many when it does not say
+MAX_FLASHCARDS = int(os.getenv('MAX_FLASHCARDS', '100'))
+DEFAULT_FLASHCARDS = 10
+
+# Quiz questions generated when a premium request asks for a quiz
+QUIZ_QUESTIONS = 5
+
+FLASHCARD_NUMBER_ERROR = f'flashcard_number must be a whole number from 1 to {MAX_FLASHCARDS}'
+UPLOAD_EXPIRED_ERROR = 'Upload not found or expired. Please upload the file again.'
+BUSY_ERROR = 'The server is busy, please try again shortly.'
+
+
+def error_response(message, status, retry_after=None):
+    if retry_after is None:
+        return {'error': message}, status
+    return {'error': message}, status, {'Retry-After': str(retry_after)}
+
+
+# `flashcard_number` of a generation request, a positive int of at most
+# MAX_FLASHCARDS. Raises ValueError for anything else.
+def parse_flashcard_number(value, default=DEFAULT_FLASHCARDS):
+    if value is None or value == '':
+        return default
+    if isinstance(value, (bool, float)):
+        raise ValueError(f"Invalid flashcard_number: {value!r}")
+    try:
+        number = int(value)
+    except TypeError:
+        raise ValueError(f"Invalid flashcard_number: {value!r}")
+    if not 1 <= number <= MAX_FLASHCARDS:
+        raise ValueError(f"flashcard_number out of range: {number}")
+    return number
+
+
+# Returns (flashcard_number, error_response), see parse_flashcard_number
+def requested_flashcard_number(value):
+    try:
+        return parse_flashcard_number(value), None
+    except ValueError:
+        return None, error_response(FLASHCARD_NUMBER_ERROR, 400)
+
+
+# Fields of a /process, /process_free or streaming request body. `username`
+# and `course` only matter to the premium routes, which store the cards.
+class GenerationRequest:
+    def __init__(self, upload_id, pages, flashcard_number, quiz=None, course='General', username=None,
+                 use_cache=True):
+        self.upload_id = upload_id
+        self.pages = pages
+        self.flashcard_number = flashcard_number
+        self.quiz = quiz
+        self.course = course
+        self.username = username
+        self.use_cache = use_cache
+
+    @property
+    def quiz_number(self):
+        return QUIZ_QUESTIONS if self.quiz == 'yes' else 0
+
+    def log_fields(self):
+        return {'pages': self.pages, 'flashcard_number': self.flashcard_number, 'quiz': self.quiz,
+                'course': self.course, 'username': self.username}
+
+
+# Parse a generation request body, returns (GenerationRequest, error_response).
+# Clients can set no_cache to force fresh cards for the same text.
+def parse_generation_request(data):
+    data = data or {}
+    flashcard_number, error = requested_flashcard_number(data.get('flashcard_number'))
+    if error:
+        return None, error
+    return GenerationRequest(
+        data.get('upload_id'), data.get('pages'), flashcard_number, quiz=data.get('quiz'),
+        course=data.get('course', 'General'), username=data.get('username'),
+        use_cache=not data.get('no_cache', False)
+    ), None
+
+
+# Look up the selected pages of an upload session and prepare their text
+# for the prompts. Reads the page index and is CPU-bound, the ASGI app runs
+# it on a thread. Returns (PreparedText, error_response).
+def select_upload_text(upload_sessions, upload_id, selected_pages):
+    parsed = upload_sessions.get(upload_id)
+    if parsed is None:
+        return None, error_response(UPLOAD_EXPIRED_ERROR, 404)
+
+    try:
+        # Pages were parsed during preview, only look them up here
+        pages = upload_sessions.selected_pages(parsed, selected_pages or [])
+    except (IndexError, TypeError, ValueError):
+        return None, error_response('Invalid page selection', 400)
+    with span('text_prep'):
+        return prepare_pages(pages), None
+
+
+# Plan a generation request of `username` is scheduled under when the
+# session tells: the session's plan when it is the logged-in user. Returns
+# (known, plan), callers look up the stored plan when it is not known.
+def session_plan(session, username):
+    if not username:
+        return True, None
+    if session.get('username') == username:
+        return True, session.get('plan')
+    return False, None
+
+
+def profile_plan(profile):
+    return profile['plan'] if profile else None
+
+
+# Admit a generation request of `user` (a username, or the address of an
+# anonymous user), returns (Ticket, error_response). Shed requests get a
+# 429 with Retry-After.
+def admit(admission, user, plan):
+    try:
+        return admission.admit(user, plan), None
+    except Overloaded as e:
+        return None, error_response(str(e), 429, retry_after=e.retry_after)
+
+
+# Answer to a request whose job could not be queued
+def queue_full_response():
+    return error_response(BUSY_ERROR, 503, retry_after=10)
+
+
+# Answer to a queued job: where to follow it, plus anything in `report`.
+# `url_for` is the serving framework's.
+def job_accepted(job, url_for, report=None):
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('.get_job', job_id=job.id, _external=True),
+        'events_url': url_for('.job_events', job_id=job.id, _external=True),
+        **(report or {})
+    }, 202
+
+
+# Status of a job for polling, or a 404
+def job_status(job):
+    if job is None:
+        return error_response('Job not found', 404)
+    return job.to_dict(), 200
+
+
+# Event a reconnecting SSE client saw last, -1 for a new client
+def last_event_id(headers):
+    try:
+        return int(headers.get('Last-Event-ID', -1))
+    except ValueError:
+        return -1
+
+
+# Report segment progress of a generation job
+def generation_progress(job, start, end):
+    def on_progress(done, total):
+        job.update('generating', start + (end - start) * done / total, segments_done=done, segments_total=total)
+    return on_progress
+
+
+# Move a job to its generating stage, returns the keyword arguments of
+# generate_deck/agenerate_deck that report its progress up to `end`
+def start_generating(job, generation, end):
+    job.update('generating', 0.1)
+    return {'on_progress': generation_progress(job, 0.1, end), 'use_cache': generation.use_cache, 'tier': job.tier}
+
+
+# Result of the free tier pipeline
+def free_job_result(job, flashcards):
+    logger.debug("Job %s generated %d flashcards", job.id, len(flashcards))
+    return {'flashcards': flashcards}
+
+
+# Premium pipeline step between generating and storing the cards
+def premium_job_storing(job, flashcards, quiz_cards):
+    logger.debug("Job %s generated %d flashcards and %d quiz cards", job.id, len(flashcards), len(quiz_cards))
+    job.update('storing', 0.9, flashcard_count=len(flashcards), quiz_count=len(quiz_cards))
@@ -0,0 +1,130 @@
+import copy
+import datetime
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.errors import PyMongoError
+
+from telemetry import counter
+
+logger = logging.getLogger(__name__)
+
+CACHE_LOOKUPS = counter('flashy_llm_cache_lookups_total', 'Gemini response cache lookups by result', ['result'])
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    return WHITESPACE_PATTERN.sub(' ', text or '').strip()
+
+
+# Content-addressed cache of generated flashcards and quizzes.
+# An in-process LRU sits in front of an optional Mongo collection that
+# expires entries with a TTL index, so the same slide deck uploaded again
+# is answered without calling the model.
+class ResponseCache:
+    def __init__(self, max_entries=1024, ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.collection = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    # Use a Mongo collection as the persistent tier
+    def attach(self, collection):
+        self.collection = collection
+        try:
+            collection.create_index('created_at', expireAfterSeconds=self.ttl)
+        except PyMongoError as e:
+            logger.warning("Could not create TTL index on the response cache: %s", e)
+
+    def key(self, kind, text, count, model):
+        payload = json.dumps([kind, normalize_text(text), int(count), model])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                CACHE_LOOKUPS.inc(result='memory_hit')
+                return copy.deepcopy(entry[1])
+
+        value = self._get_persistent(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(result='miss')
+                return None
+            self.hits += 1
+            self.mongo_hits += 1
+            CACHE_LOOKUPS.inc(result='mongo_hit')
+        self._remember(key, value, now)
+        return copy.deepcopy(value)
+
+    def _get_persistent(self, key):
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({'_id': key}, {'value': 1, 'created_at': 1})
+        except PyMongoError as e:
+            logger.warning("Response cache lookup failed: %s", e)
+            return None
+        if not doc:
+            return None
+        # The TTL monitor only runs once a minute, so check expiry ourselves
+        created_at = doc.get('created_at')
+        if created_at and (datetime.datetime.utcnow() - created_at).total_seconds() >= self.ttl:
+            return None
+        return doc.get('value')
+
+    def set(self, key, value, kind=None):
+        self._remember(key, copy.deepcopy(value), time.time())
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one(
+                {'_id': key},
+                {'$set': {'value': value, 'kind': kind, 'created_at': datetime.datetime.utcnow()}},
+                upsert=True
+            )
+        except PyMongoError as e:
+            logger.warning("Response cache write failed: %s", e)
+
+    def _remember(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+        CACHE_LOOKUPS.inc(result='bypass')
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'mongo_hits': self.mongo_hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries)
+            }
@@ -0,0 +1,270 @@
+import datetime
+import logging
+import os
+import sys
+import uuid
+from collections import Counter
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from card_store import FLASHCARD, QUIZ, card_hash, card_id, inserted_despite_duplicates
+from export import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Spaced repetition with the SM-2 schedule. Every stored card gets a
+# document in `reviews` holding its schedule, keyed like the per-card store.
+# The cards themselves are looked up in the card store when they are due.
+# The due queue is an index range on (username, due), so its cost depends
+# on the cards asked for, not on the size of the library.
+
+# Ease of a new card and the lowest ease a card can drop to
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+
+# Intervals of the first two successful reviews, in days
+FIRST_INTERVAL = 1
+SECOND_INTERVAL = 6
+
+# A failed card comes back within the same study session
+RELEARN_DELAY = datetime.timedelta(minutes=int(os.getenv('REVIEW_RELEARN_MINUTES', '10')))
+
+# Answer grades, SM-2 counts 3 and above as recalled
+MIN_QUALITY = 0
+MAX_QUALITY = 5
+PASSING_QUALITY = 3
+
+# Most due cards served at once and reviews recorded in one request
+MAX_DUE_CARDS = 200
+MAX_REVIEW_BATCH = 500
+
+# Fields of a review document that make up the schedule
+SCHEDULE_FIELDS = {'due': 1, 'interval': 1, 'ease': 1, 'reps': 1, 'lapses': 1}
+
+# Times a batch of reviews is read and written again when other requests
+# changed some of its cards in between
+RECORD_ATTEMPTS = 5
+
+# Writes remembered on a review document in `recorded_by`, enough to tell
+# whether a write of a batch applied when other writes followed it
+RECENT_WRITES = 8
+
+
+class InvalidReview(ValueError):
+    pass
+
+
+# Review documents for newly stored cards, due straight away
+def review_documents(username, course, flashcards=(), quizzes=(), now=None):
+    now = now or datetime.datetime.utcnow()
+    documents = []
+    for kind, cards in ((FLASHCARD, flashcards), (QUIZ, quizzes)):
+        for card in cards:
+            documents.append({
+                '_id': card_id(username, course, kind, card_hash(card)),
+                'username': username,
+                'course': course,
+                'kind': kind,
+                'due': now,
+                'interval': 0,
+                'ease': INITIAL_EASE,
+                'reps': 0,
+                'lapses': 0,
+                'review_count': 0
+            })
+    return documents
+
+
+# Next schedule of a card answered with `quality` (0-5) at `reviewed_at`
+def schedule(state, quality, reviewed_at):
+    reps = state.get('reps', 0)
+    interval = state.get('interval', 0)
+    ease = state.get('ease', INITIAL_EASE)
+    lapses = state.get('lapses', 0)
+
+    miss = MAX_QUALITY - quality
+    ease = round(max(MIN_EASE, ease + 0.1 - miss * (0.08 + miss * 0.02)), 3)
+    if quality < PASSING_QUALITY:
+        return {
+            'reps': 0, 'interval': 0, 'ease': ease, 'lapses': lapses + (1 if reps else 0),
+            'due': reviewed_at + RELEARN_DELAY, 'last_reviewed': reviewed_at
+        }
+
+    reps += 1
+    if reps == 1:
+        interval = FIRST_INTERVAL
+    elif reps == 2:
+        interval = SECOND_INTERVAL
+    else:
+        interval = round(interval * ease, 2)
+    return {
+        'reps': reps, 'interval': interval, 'ease': ease, 'lapses': lapses,
+        'due': reviewed_at + datetime.timedelta(days=interval), 'last_reviewed': reviewed_at
+    }
+
+
+# Check the reviews of a request: a list of {card_id, quality, reviewed_at?}.
+# Returns (card_id, quality, reviewed_at) tuples in the order they happened.
+def parse_reviews(reviews, now=None):
+    if not isinstance(reviews, list) or not reviews:
+        raise InvalidReview('reviews must be a non-empty list')
+    if len(reviews) > MAX_REVIEW_BATCH:
+        raise InvalidReview(f'At most {MAX_REVIEW_BATCH} reviews can be recorded at once')
+
+    now = now or datetime.datetime.utcnow()
+    parsed = []
+    for review in reviews:
+        try:
+            quality = int(review['quality'])
+            reviewed_at = parse_timestamp(review.get('reviewed_at')) or now
+            parsed.append((str(review['card_id']), quality, min(reviewed_at, now)))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise InvalidReview('Every review needs a card_id and a quality')
+        if not MIN_QUALITY <= quality <= MAX_QUALITY:
+            raise InvalidReview(f'quality must be between {MIN_QUALITY} and {MAX_QUALITY}')
+    return sorted(parsed, key=lambda review: review[2])
+
+
+def due_query(username, course=None, now=None):
+    query = {'username': username}
+    if course:
+        query['course'] = course
+    query['due'] = {'$lte': now or datetime.datetime.utcnow()}
+    return query
+
+
+# Filter matching a review document only while it has the schedule that was
+# read. `review_count` grows with every recorded review. Documents written
+# before it was stored have none and were never reviewed.
+def unchanged(username, state):
+    query = {'_id': state['_id'], 'username': username}
+    query['review_count'] = state['review_count'] if 'review_count' in state else {'$exists': False}
+    return query
+
+
+class ReviewStore:
+    def __init__(self, db):
+        self.collection = db.reviews
+
+    # Start reviewing newly stored cards. Cards already scheduled keep their state.
+    def add(self, username, course, flashcards=(), quizzes=()):
+        documents = review_documents(username, course, flashcards, quizzes)
+        if not documents:
+            return 0
+        try:
+            return len(self.collection.insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            return inserted_despite_duplicates(e)
+
+    # The schedules of the `limit` most overdue cards of a user, or of one
+    # course. Served from the (username, [course,] due) index, no deck is
+    # loaded. The cards are in the card store under the same `_id`.
+    def due(self, username, limit, course=None, now=None):
+        cursor = self.collection.find(
+            due_query(username, course, now),
+            dict(SCHEDULE_FIELDS, course=1, kind=1)
+        ).sort('due', ASCENDING).limit(limit)
+        return list(cursor)
+
+    # Record a batch of reviews: one read of the cards' schedules and one
+    # unordered bulk write, however many cards were reviewed. Returns the
+    # new schedules by card ID, unknown cards are left out. Cards another
+    # request reviewed in between are read and written again.
+    def record(self, username, reviews):
+        updated = {}
+        for _ in range(RECORD_ATTEMPTS):
+            reviews = self._record_once(username, reviews, updated)
+            if not reviews:
+                break
+        else:
+            logger.warning("Dropped %d reviews of %s after repeated conflicts", len(reviews), username)
+        return updated
+
+    # One read and write of a batch, adds the new schedules to `updated`.
+    # Returns the reviews of cards that changed since they were read.
+    def _record_once(self, username, reviews, updated):
+        card_ids = list({reviewed_id for reviewed_id, _, _ in reviews})
+        states = {
+            doc['_id']: doc
+            for doc in self.collection.find(
+                {'_id': {'$in': card_ids}, 'username': username}, dict(SCHEDULE_FIELDS, review_count=1)
+            )
+        }
+
+        schedules, counts = {}, Counter()
+        for reviewed_id, quality, reviewed_at in reviews:
+            state = schedules.get(reviewed_id, states.get(reviewed_id))
+            if state is None:
+                continue
+            schedules[reviewed_id] = schedule(state, quality, reviewed_at)
+            counts[reviewed_id] += 1
+        if not schedules:
+            return []
+
+        # A write whose card changed or was deleted since it was read matches
+        # nothing. Bulk results only count matches, so every write leaves the
+        # batch's token on its card, and cards without it are read again.
+        # Deleted cards are not found then and count as unknown.
+        token = uuid.uuid4().hex
+        written = list(schedules)
+        result = self.collection.bulk_write([
+            UpdateOne(unchanged(username, states[reviewed_id]), {
+                '$set': schedules[reviewed_id],
+                '$inc': {'review_count': counts[reviewed_id]},
+                '$push': {'recorded_by': {'$each': [token], '$slice': -RECENT_WRITES}}
+            })
+            for reviewed_id in written
+        ], ordered=False)
+        conflicts = set()
+        if result.matched_count < len(written):
+            applied = {
+                doc['_id'] for doc in self.collection.find({'_id': {'$in': written}, 'recorded_by': token}, {'_id': 1})
+            }
+            conflicts = set(written) - applied
+
+        for reviewed_id in written:
+            if reviewed_id not in conflicts:
+                updated[reviewed_id] = schedules[reviewed_id]
+        return [review for review in reviews if review[0] in conflicts]
+
+
+# Write side of the review store for the ASGI app, on a Motor database
+class AsyncReviewStore:
+    def __init__(self, db):
+        self.collection = db.reviews
+
+    async def add(self, username, course, flashcards=(), quizzes=()):
+        documents = review_documents(username, course, flashcards, quizzes)
+        if not documents:
+            return 0
+        try:
+            return len((await self.collection.insert_many(documents, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            return inserted_despite_duplicates(e)
+
+
+# Schedule every card stored before reviews existed. Re-running it is safe.
+#   python reviews.py backfill
+def backfill(db, card_store):
+    reviews = ReviewStore(db)
+    scheduled = 0
+    for username in db.flashcards.distinct('username'):
+        for deck, cards in card_store.export(username):
+            flashcards, quizzes = [], []
+            for kind, card in cards:
+                (quizzes if kind == QUIZ else flashcards).append(card)
+            scheduled += reviews.add(username, deck.get('course'), flashcards, quizzes)
+    return scheduled
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['backfill']:
+        sys.exit('usage: python reviews.py backfill')
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from card_store import ensure_indexes, store_from_env
+    load_dotenv()
+    database = MongoClient(os.getenv('MONGO_URI')).flashy
+    ensure_indexes(database)
+    print(f"Scheduled {backfill(database, store_from_env(database))} cards")
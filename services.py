@@ -0,0 +1,185 @@
+import importlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Property computed once on first access. Unlike functools.cached_property
+# it holds the owner's lock, so concurrent first requests build one instance.
+class lazy:
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+
+    def __get__(self, owner, owner_type=None):
+        if owner is None:
+            return self
+        with owner._lock:
+            if self.name not in owner.__dict__:
+                owner.__dict__[self.name] = self.factory(owner)
+            return owner.__dict__[self.name]
+
+
+# Backends shared by the requests of one app. Nothing here connects to Mongo
+# or loads a heavy module until a request needs it, so the app can answer
+# health checks as soon as the process starts.
+class Services:
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.RLock()
+
+    # Instance of a lazy backend if it was already created, without creating it
+    def peek(self, name):
+        return self.__dict__.get(name)
+
+    @lazy
+    def mongo_client(self):
+        from pymongo import MongoClient
+        # connect=False defers the connection to the first operation
+        return MongoClient(self.config['MONGO_URI'], connect=False)
+
+    @lazy
+    def db(self):
+        from card_store import ensure_indexes
+        db = self.mongo_client.flashy
+        # Indexes for the course, deck and user lookups
+        ensure_indexes(db)
+        return db
+
+    # Gemini response cache with its persistent tier attached. Generation
+    # routes resolve it before the first prompt, also on paths that never
+    # touch `db` otherwise.
+    @lazy
+    def response_cache(self):
+        from gemini import response_cache
+        response_cache.attach(self.db.llm_cache)
+        return response_cache
+
+    @lazy
+    def users(self):
+        return self.db.users
+
+    # bcrypt runs on its own bounded pool, see BCRYPT_ROUNDS and HASH_WORKERS
+    @lazy
+    def password_hasher(self):
+        from accounts import PasswordHasher
+        return PasswordHasher()
+
+    # Profiles served by /userAccount, see PROFILE_CACHE_TTL_SECONDS
+    @lazy
+    def profiles(self):
+        from accounts import ProfileCache
+        return ProfileCache(self.users)
+
+    # Where generated cards are stored, see FLASHCARD_STORAGE
+    @lazy
+    def card_store(self):
+        from card_store import store_from_env
+        return store_from_env(self.db)
+
+    # Spaced repetition schedule of every stored card, see reviews.py
+    @lazy
+    def review_store(self):
+        from reviews import ReviewStore
+        return ReviewStore(self.db)
+
+    # Drops rephrased duplicates before cards are stored, see SEMANTIC_DEDUP
+    @lazy
+    def deduplicator(self):
+        if os.getenv('SEMANTIC_DEDUP', '1') != '1':
+            return None
+        from dedup import deduplicator_from_env
+        return deduplicator_from_env(self.db, self.card_store)
+
+    # Blob store of uploads or rendered pages, on this machine or shared
+    # through GridFS, see BLOB_STORE. `folder` holds the local files.
+    def blob_store(self, bucket, folder):
+        from blob_store import blob_store_from_env
+        return blob_store_from_env(bucket, folder, lambda: self.db)
+
+    # Rendered PDF pages, bounded by size with least recently used eviction
+    @lazy
+    def page_cache(self):
+        from page_cache import PageImageCache
+        return PageImageCache(
+            self.blob_store('pages', self.config['PAGE_CACHE_FOLDER']),
+            max_bytes=int(os.getenv('PAGE_CACHE_MAX_MB', '512')) * 1024 * 1024,
+            dpi=int(os.getenv('PAGE_RENDER_DPI', '110')),
+            fmt=os.getenv('PAGE_RENDER_FORMAT', 'jpeg')
+        )
+
+    @lazy
+    def upload_sessions(self):
+        from sessions import UploadSessions
+        return UploadSessions(
+            self.blob_store('uploads', self.config['UPLOAD_FOLDER']),
+            ttl=int(os.getenv('UPLOAD_TTL_SECONDS', '3600')),
+            on_expire=self.page_cache.remove
+        )
+
+    # Motor database for the ASGI app, see asgi.py. The indexes are created
+    # through the sync client by `db`.
+    @lazy
+    def async_db(self):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(self.config['MONGO_URI'], connect=False).flashy
+
+    @lazy
+    def async_card_store(self):
+        from card_store import async_store_from_env
+        return async_store_from_env(self.async_db)
+
+    @lazy
+    def async_review_store(self):
+        from reviews import AsyncReviewStore
+        return AsyncReviewStore(self.async_db)
+
+    # Generation jobs of the ASGI app, run as tasks on its event loop
+    @lazy
+    def async_job_queue(self):
+        from jobs import AsyncJobQueue
+        return AsyncJobQueue(
+            max_running=int(os.getenv('ASYNC_JOB_CONCURRENCY', '500')),
+            max_queued=int(os.getenv('JOB_QUEUE_SIZE', '100'))
+        )
+
+    # Background workers for /process and /process_free
+    @lazy
+    def job_queue(self):
+        from jobs import JobQueue
+        return JobQueue(
+            max_workers=int(os.getenv('JOB_WORKERS', '4')),
+            max_queued=int(os.getenv('JOB_QUEUE_SIZE', '100'))
+        )
+
+    # Per-user and queue depth limits of generation requests, see admission.TIERS
+    @lazy
+    def admission(self):
+        from admission import Admission
+        return Admission(self.queued_jobs)
+
+    # Jobs of a tier waiting to start, in both serving modes
+    def queued_jobs(self, tier):
+        queued = self.job_queue.queued(tier)
+        async_job_queue = self.peek('async_job_queue')
+        if async_job_queue is not None:
+            queued += async_job_queue.queued(tier)
+        return queued
+
+    # Create everything ahead of the first request, see WARM_UP
+    def warm_up(self):
+        try:
+            for name in ('db', 'response_cache', 'card_store', 'deduplicator', 'password_hasher', 'upload_sessions', 'job_queue'):
+                getattr(self, name)
+            # Parsers load in the extractor workers, only Gemini runs in this process
+            if os.getenv('LLM_BACKEND', 'gemini') != 'fake':
+                importlib.import_module('google.generativeai')
+        except Exception:
+            logger.exception("Warm-up failed, backends will be created on first use")
+        else:
+            logger.info("Warm-up finished")
+
+    def warm_up_in_background(self):
+        threading.Thread(target=self.warm_up, name='warm-up', daemon=True).start()
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from blob_store import BlobNotFound
+
+# Uploads are streamed to disk in chunks so large files are never held in memory
+CHUNK_SIZE = 1024 * 1024
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def is_valid_upload_id(upload_id):
+    return isinstance(upload_id, str) and bool(UPLOAD_ID_PATTERN.match(upload_id))
+
+
+# Page index of a parsed upload. The document text is stored once as blocks
+# joined by newlines: the paragraphs of a DOCX or PPTX page, or a whole PDF
+# page. `block_offsets` holds where each block starts, plus one past the end,
+# and `page_blocks` the first block of each page, plus the block count.
+def build_index(upload_id, file_ext, pages, preview=None):
+    chunks = preview if preview is not None else [[page] for page in pages]
+    block_offsets, page_blocks, position = [], [], 0
+    for chunk in chunks:
+        page_blocks.append(len(block_offsets))
+        for block in chunk:
+            block_offsets.append(position)
+            position += len(block) + 1
+    page_blocks.append(len(block_offsets))
+    block_offsets.append(position)
+    return {
+        'upload_id': upload_id,
+        'file_ext': file_ext,
+        'text': '\n'.join(block for chunk in chunks for block in chunk),
+        'block_offsets': block_offsets,
+        'page_blocks': page_blocks
+    }
+
+
+def page_count(parsed):
+    return len(parsed['page_blocks']) - 1
+
+
+# Offsets of the first and one past the last block of a (1-based) page
+def _page_span(parsed, page_num):
+    page_num = int(page_num)
+    if not 1 <= page_num <= page_count(parsed):
+        raise IndexError(f"Page {page_num} out of range")
+    return parsed['page_blocks'][page_num - 1], parsed['page_blocks'][page_num]
+
+
+# Text of one (1-based) page
+def page_text(parsed, page_num):
+    first, last = _page_span(parsed, page_num)
+    if first == last:
+        return ''
+    offsets = parsed['block_offsets']
+    return parsed['text'][offsets[first]:offsets[last] - 1]
+
+
+# Paragraphs of one (1-based) page, as shown in the DOCX and PPTX preview
+def page_paragraphs(parsed, page_num):
+    first, last = _page_span(parsed, page_num)
+    offsets, text = parsed['block_offsets'], parsed['text']
+    return [text[offsets[i]:offsets[i + 1] - 1] for i in range(first, last)]
+
+
+# Content-hashed upload sessions with a cache of the parsed page text.
+# The same document uploaded twice maps to the same upload ID, so parsing
+# happens once per document and /process only looks pages up. Documents and
+# their page index are kept in a blob store (see blob_store.py), with a
+# shared store any worker or node can serve any step of an upload.
+class UploadSessions:
+    def __init__(self, blobs, max_cached=64, ttl=3600, on_expire=None):
+        self.blobs = blobs
+        self.max_cached = max_cached
+        self.ttl = ttl
+        self.on_expire = on_expire
+        # Uploads served from the cache still refresh their blobs this often,
+        # so an upload in use is never swept
+        self.touch_interval = min(ttl / 4, 300)
+        # upload ID -> [parsed, last time its blobs were touched]
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def _document_key(upload_id, file_ext):
+        return f'{upload_id}.{file_ext}'
+
+    @staticmethod
+    def _index_key(upload_id):
+        return f'{upload_id}.json'
+
+    # Save an uploaded file under its content hash, returns the upload ID
+    def save(self, file, file_ext):
+        hasher = hashlib.sha256(file_ext.encode('utf-8'))
+        with self.blobs.writer() as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+            upload_id = hasher.hexdigest()[:32]
+            out.commit(self._document_key(upload_id, file_ext))
+
+        # Re-uploading a known document keeps its parsed index alive as well
+        self.blobs.touch(self._index_key(upload_id))
+
+        self.sweep()
+        return upload_id
+
+    # Local path of an uploaded document, for the parsers and the page
+    # renderer. A context manager, raises BlobNotFound once it expired.
+    def document_file(self, upload_id, file_ext):
+        return self.blobs.local_path(self._document_key(upload_id, file_ext))
+
+    # Return the parsed session for an upload ID, or None if unknown or
+    # expired. Using a session keeps its document and index from expiring.
+    def get(self, upload_id):
+        if not is_valid_upload_id(upload_id):
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(upload_id)
+            if entry is not None:
+                self._cache.move_to_end(upload_id)
+                parsed, touched_at = entry
+                due = now - touched_at >= self.touch_interval
+                if due:
+                    entry[1] = now
+        if entry is not None:
+            if due and not self._touch(upload_id, parsed['file_ext']):
+                # Swept by another worker sharing the store
+                with self._lock:
+                    self._cache.pop(upload_id, None)
+                return None
+            return parsed
+
+        # Another worker may have parsed this upload, fall back to the stored index
+        try:
+            parsed = json.loads(self.blobs.read(self._index_key(upload_id)))
+        except (BlobNotFound, ValueError):
+            return None
+
+        self._touch(upload_id, parsed['file_ext'])
+        self._remember(upload_id, parsed)
+        return parsed
+
+    # Refresh the last access of an upload's index and document, False if
+    # the index is gone
+    def _touch(self, upload_id, file_ext):
+        self.blobs.touch(self._document_key(upload_id, file_ext))
+        return self.blobs.touch(self._index_key(upload_id))
+
+    # Store the page index of a parsed upload, see build_index
+    def put(self, upload_id, file_ext, pages, preview=None):
+        parsed = build_index(upload_id, file_ext, pages, preview)
+        self.blobs.put_bytes(self._index_key(upload_id), json.dumps(parsed).encode('utf-8'))
+        self._remember(upload_id, parsed)
+        return parsed
+
+    def _remember(self, upload_id, parsed):
+        with self._lock:
+            self._cache[upload_id] = [parsed, time.time()]
+            self._cache.move_to_end(upload_id)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    # Text of the selected (1-based) pages, sliced from the page index
+    def selected_pages(self, parsed, selected_pages):
+        return [page_text(parsed, page_num) for page_num in selected_pages]
+
+    # Remove uploads that have not been touched within the TTL
+    def sweep(self, force=False):
+        now = time.time()
+        if not force and now - self._last_sweep < min(self.ttl, 60):
+            return
+        self._last_sweep = now
+
+        expired = set()
+        for key in self.blobs.sweep(self.ttl):
+            upload_id = key.split('.', 1)[0]
+            if is_valid_upload_id(upload_id):
+                expired.add(upload_id)
+
+        with self._lock:
+            for upload_id in expired:
+                self._cache.pop(upload_id, None)
+
+        if self.on_expire:
+            for upload_id in expired:
+                self.on_expire(upload_id)
@@ -0,0 +1,106 @@
+import json
+import re
+
+# Characters that can change the parser state, everything else is skipped
+SPECIAL_CHARS = re.compile(r'[\[\]{}"\\]')
+
+
+# Incremental parser for a JSON array of objects arriving in chunks.
+# feed() returns every object that was completed by the chunk, so cards can
+# be used while the model is still writing. Prose before the array and
+# after its closing bracket is ignored, and a truncated response keeps the
+# objects that were already complete.
+class IncrementalArrayParser:
+    def __init__(self):
+        self.started = False
+        # True once the closing bracket of the array was seen
+        self.done = False
+        self.skipped = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._current = []
+
+    def feed(self, chunk):
+        items = []
+        if self.done or not chunk:
+            return items
+
+        pos = 0
+        if not self.started:
+            pos = chunk.find('[')
+            if pos == -1:
+                return items
+            self.started = True
+            pos += 1
+
+        # Start of the not yet buffered part of the current object
+        segment_start = pos if self._depth else None
+        skip_until = pos + 1 if self._escape else pos
+        self._escape = False
+
+        for match in SPECIAL_CHARS.finditer(chunk, pos):
+            i = match.start()
+            if i < skip_until:
+                continue
+            ch = match.group()
+
+            if self._in_string:
+                if ch == '\\':
+                    skip_until = i + 2
+                    if i + 1 == len(chunk):
+                        self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if self._depth == 0:
+                    if ch == '[':
+                        # Nested arrays at the top level are not cards
+                        self._depth = 1
+                        self._current = []
+                        segment_start = i
+                        continue
+                    segment_start = i
+                    self._current = []
+                self._depth += 1
+            elif ch in '}]':
+                if self._depth == 0:
+                    if ch == ']':
+                        self.done = True
+                        break
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    self._current.append(chunk[segment_start:i + 1])
+                    segment_start = None
+                    item = self._decode(''.join(self._current))
+                    self._current = []
+                    if item is not None:
+                        items.append(item)
+
+        if self._depth and segment_start is not None:
+            self._current.append(chunk[segment_start:])
+        return items
+
+    def _decode(self, text):
+        try:
+            item = json.loads(text)
+        except ValueError:
+            self.skipped += 1
+            return None
+        if not isinstance(item, dict):
+            self.skipped += 1
+            return None
+        return item
+
+
+# Parse every complete object of the first JSON array in `text`.
+# Returns (items, complete) where complete is False for truncated output.
+def parse_json_array(text):
+    parser = IncrementalArrayParser()
+    items = parser.feed(text)
+    return items, parser.done
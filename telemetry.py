@@ -0,0 +1,239 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits up to long Gemini calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+# One JSON object per line, with any `extra` fields next to the message
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# LOG_LEVEL sets the threshold, LOG_FORMAT=json switches to one JSON object per line
+def configure_logging():
+    handler = logging.StreamHandler(sys.stderr)
+    if os.getenv('LOG_FORMAT', 'text') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name + format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts, then sum and count
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield self.name + '_bucket' + format_labels(self.labelnames, key, [('le', bound)]), cumulative
+            yield self.name + '_bucket' + format_labels(self.labelnames, key, [('le', '+Inf')]), values[-1]
+            yield self.name + '_sum' + format_labels(self.labelnames, key), values[-2]
+            yield self.name + '_count' + format_labels(self.labelnames, key), values[-1]
+
+
+# A value read at scrape time, for state that is already tracked elsewhere
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def samples(self):
+        yield self.name, self.read()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    # Register a metric once, modules that are imported again get the same one
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    # Prometheus text exposition format
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name} {value}" for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge(name, help, read):
+    return REGISTRY.register(Gauge(name, help, read))
+
+
+STAGE_SECONDS = histogram('flashy_stage_seconds', 'Time spent in each pipeline stage', ['stage'])
+REQUEST_SECONDS = histogram('flashy_http_request_seconds', 'Request handling time', ['endpoint', 'method', 'status'])
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    logger.debug("%s took %.1f ms", stage, seconds * 1000, extra={'stage': stage, 'duration_ms': seconds * 1000})
+
+
+# Time a pipeline stage, e.g. `with span('parse'):`
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+# Request timing for every route, plus cProfile on a sample of requests.
+# Only one request is profiled at a time since profilers are per-process
+# on newer Pythons; profiles are written to `output_dir` as .prof files.
+class RequestInstrumentation:
+    def __init__(self, sample_rate=0.0, output_dir='profiles'):
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self._profiling = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+
+    def _before(self):
+        g.request_start = time.perf_counter()
+        if self.sample_rate and random.random() < self.sample_rate and self._profiling.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _after(self, response):
+        g.response_status = response.status_code
+        return response
+
+    def _teardown(self, error=None):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                self._save(profiler)
+            finally:
+                self._profiling.release()
+
+        start = g.pop('request_start', None)
+        if start is not None:
+            status = 500 if error is not None else getattr(g, 'response_status', '')
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                endpoint=request.endpoint or 'unknown', method=request.method, status=status
+            )
+
+    def _save(self, profiler):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-{uuid.uuid4().hex[:8]}.prof")
+        profiler.dump_stats(path)
+        logger.info("Profiled %s %s to %s", request.method, request.path, path)
+
+
+def instrumentation_from_env():
+    return RequestInstrumentation(
+        sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+        output_dir=os.getenv('PROFILE_DIR', 'profiles')
+    )
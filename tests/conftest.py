@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Offline settings, read by the project modules at import: the fake Gemini
+# backend, parsing in-process and no semantic dedup model
+os.environ.update({
+    'LLM_BACKEND': 'fake',
+    'FAKE_LLM_LATENCY_MS': '0',
+    'SEMANTIC_DEDUP': '0',
+    'EXTRACT_WORKERS': '0',
+    'MONGO_URI': 'mongodb://localhost',
+    'SECRET_KEY': 'test',
+    'LOG_LEVEL': 'WARNING'
+})
+
+
+# Flask app on mongomock, with uploads and rendered pages under tmp_path
+@pytest.fixture
+def app(tmp_path):
+    mongomock = pytest.importorskip('mongomock')
+    from app import create_app
+    flask_app = create_app({
+        'TESTING': True,
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'PAGE_CACHE_FOLDER': str(tmp_path / 'page_cache')
+    })
+    # Lazy backends are cached on the instance, see services.lazy
+    flask_app.extensions['flashy'].__dict__['mongo_client'] = mongomock.MongoClient()
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def services(app):
+    return app.extensions['flashy']
+
+
+# A small text PDF, one paragraph per page
+@pytest.fixture
+def make_pdf(tmp_path):
+    fitz = pytest.importorskip('fitz')
+
+    def make(pages, name='doc.pdf'):
+        path = tmp_path / name
+        doc = fitz.open()
+        for text in pages:
+            doc.new_page().insert_textbox(fitz.Rect(72, 72, 520, 770), text)
+        doc.save(str(path))
+        doc.close()
+        return path
+    return make
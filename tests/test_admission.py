@@ -0,0 +1,170 @@
+import asyncio
+import threading
+
+import pytest
+
+from admission import Admission, AsyncFairSlots, FairExecutor, FairQueue, Overloaded, Tier
+
+WEIGHTS = {'premium': 4, 'free': 1}
+TIERS = {
+    'premium': Tier(weight=4, max_user_jobs=2, max_queued=3),
+    'free': Tier(weight=1, max_user_jobs=1, max_queued=1)
+}
+
+
+def drain(queue):
+    order = []
+    while (entry := queue.pop()) is not None:
+        order.append(entry[2])
+    return order
+
+
+def test_tiers_are_served_by_weight():
+    queue = FairQueue(WEIGHTS)
+    for n in range(10):
+        queue.push('premium', f'p{n}')
+        queue.push('free', f'f{n}')
+    first = drain(queue)[:10]
+    assert sum(item.startswith('p') for item in first) == 8
+    # Free items are still served while premium ones wait
+    assert any(item.startswith('f') for item in first[:5])
+
+
+def test_order_within_a_tier_is_fifo():
+    queue = FairQueue(WEIGHTS)
+    for n in range(5):
+        queue.push('free', n)
+    assert drain(queue) == [0, 1, 2, 3, 4]
+    assert queue.pop() is None
+
+
+def test_idle_tier_does_not_bank_turns():
+    queue = FairQueue(WEIGHTS)
+    for n in range(20):
+        queue.push('premium', f'p{n}')
+    drain(queue)
+    # Free was idle while premium ran alone, it gets its share, not a backlog of turns
+    for n in range(10):
+        queue.push('premium', f'p{n}')
+        queue.push('free', f'f{n}')
+    first = drain(queue)[:5]
+    assert sum(item.startswith('f') for item in first) == 1
+
+
+def test_unknown_plans_queue_as_free():
+    queue = FairQueue(WEIGHTS)
+    queue.push(None, 'anonymous')
+    queue.push('enterprise', 'unknown plan')
+    assert queue.queued('free') == 2
+    assert queue.pop()[0] == 'free'
+
+
+def test_fair_executor_runs_calls():
+    executor = FairExecutor(2, WEIGHTS)
+    futures = [executor.submit(pow, 2, n, tier='premium' if n % 2 else 'free') for n in range(6)]
+    assert [future.result(timeout=5) for future in futures] == [1, 2, 4, 8, 16, 32]
+
+    def fail():
+        raise ValueError('boom')
+    with pytest.raises(ValueError):
+        executor.submit(fail).result(timeout=5)
+
+
+def test_async_slots_hand_over_in_fair_order():
+    async def main():
+        slots = AsyncFairSlots(1, WEIGHTS)
+        order = []
+
+        async def use(name, tier):
+            async with slots.slot(tier):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await slots.acquire('free')
+        tasks = [asyncio.create_task(use(f'f{n}', 'free')) for n in range(2)]
+        tasks += [asyncio.create_task(use(f'p{n}', 'premium')) for n in range(4)]
+        await asyncio.sleep(0)
+        assert slots.queued() == 6
+        slots.release()
+        await asyncio.gather(*tasks)
+        assert slots.in_use() == 0
+        return order
+
+    order = asyncio.run(main())
+    assert sorted(order) == ['f0', 'f1', 'p0', 'p1', 'p2', 'p3']
+    assert order.index('f1') > order.index('p2')
+
+
+def test_user_limit_per_tier():
+    admission = Admission(lambda tier: 0, TIERS)
+    tickets = [admission.admit('ana', 'premium') for _ in range(2)]
+    with pytest.raises(Overloaded) as shed:
+        admission.admit('ana', 'premium')
+    assert shed.value.retry_after >= 1
+    # Other users are not affected
+    admission.admit('ben', 'premium')
+    assert admission.active() == {'premium': 3}
+
+    tickets[0].release()
+    tickets[0].release()
+    admission.admit('ana', 'premium')
+    assert admission.active() == {'premium': 3}
+
+
+def test_full_tier_queue_sheds_with_retry_after():
+    queued = {'premium': 0, 'free': 1}
+    admission = Admission(queued.get, TIERS)
+    with pytest.raises(Overloaded) as shed:
+        admission.admit('1.2.3.4', None)
+    assert 'busy' in str(shed.value)
+    assert 1 <= shed.value.retry_after <= 60
+    # A full free queue does not shed premium requests
+    assert admission.admit('ana', 'premium').tier == 'premium'
+
+
+def test_release_is_thread_safe():
+    admission = Admission(lambda tier: 0, {'free': Tier(weight=1, max_user_jobs=1000, max_queued=1)})
+    tickets = [admission.admit('ana', 'free') for _ in range(1000)]
+    threads = [threading.Thread(target=lambda chunk=tickets[n::4]: [t.release() for t in chunk]) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert admission.active() == {}
+
+
+# Anonymous users behind a load balancer are told apart by X-Forwarded-For
+def test_anonymous_clients_behind_a_proxy(tmp_path, make_pdf):
+    mongomock = pytest.importorskip('mongomock')
+    from app import create_app
+    from jobs import JobQueue
+    app = create_app({'TESTING': True, 'TRUSTED_PROXIES': 1, 'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+                      'PAGE_CACHE_FOLDER': str(tmp_path / 'page_cache')})
+    services = app.extensions['flashy']
+    services.__dict__['mongo_client'] = mongomock.MongoClient()
+    # No workers, admitted jobs stay in progress
+    services.__dict__['job_queue'] = JobQueue(max_workers=0)
+
+    client = app.test_client()
+    with open(make_pdf(['Mitochondria produce most of the ATP of the cell. ' * 5]), 'rb') as f:
+        upload_id = client.post('/preview_free_upload', data={'file': (f, 'doc.pdf')}).json['upload_id']
+
+    def process(address):
+        return client.post('/process_free', json={'upload_id': upload_id, 'pages': [1], 'flashcard_number': 2},
+                           headers={'X-Forwarded-For': address})
+
+    assert process('203.0.113.1').status_code == 202
+    assert process('203.0.113.2').status_code == 202
+    shed = process('203.0.113.1')
+    assert shed.status_code == 429
+    assert 'Retry-After' in shed.headers
+
+
+def test_asgi_client_address_from_forwarded_for():
+    pytest.importorskip('quart')
+    from asgi import forwarded_scope
+    scope = {'client': ('10.0.0.5', 4000), 'headers': [(b'x-forwarded-for', b'198.51.100.7, 203.0.113.1')]}
+    assert forwarded_scope(scope, 1)['client'] == ('203.0.113.1', 4000)
+    assert forwarded_scope(scope, 2)['client'] == ('198.51.100.7', 4000)
+    # Fewer entries than trusted proxies, the address is not trusted
+    assert forwarded_scope(scope, 3) is scope
@@ -0,0 +1,72 @@
+import io
+import os
+import time
+
+import pytest
+
+from blob_store import TEMP_FILE_TTL, BlobNotFound, LocalBlobStore
+
+
+def age(store, key, seconds):
+    then = time.time() - seconds
+    os.utime(store.path(key), (then, then))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalBlobStore(tmp_path / 'blobs')
+
+
+def test_put_open_and_delete(store):
+    store.put('doc.pdf', io.BytesIO(b'x' * 3000000))
+    store.put_bytes('abc/page_1.jpg', b'image')
+    with store.open('doc.pdf') as blob:
+        assert blob.size == 3000000
+        assert sum(len(chunk) for chunk in blob) == 3000000
+    assert store.read('abc/page_1.jpg') == b'image'
+
+    store.delete_prefix('abc/')
+    assert not store.exists('abc/page_1.jpg')
+    with pytest.raises(BlobNotFound):
+        store.open('abc/page_1.jpg')
+    assert not store.touch('abc/page_1.jpg')
+
+
+@pytest.mark.parametrize('key', ['../secret', 'a/../../b', '/etc/passwd', 'a b', 'upload.part'])
+def test_invalid_keys(store, key):
+    with pytest.raises(ValueError):
+        store.put_bytes(key, b'')
+
+
+def test_sweep_deletes_blobs_not_touched_within_ttl(store):
+    for key in ('old.json', 'used.json', 'new.json'):
+        store.put_bytes(key, b'{}')
+    age(store, 'old.json', 120)
+    age(store, 'used.json', 120)
+    assert store.touch('used.json')
+
+    assert store.sweep(60) == ['old.json']
+    assert sorted(key for _, _, key in store.entries()) == ['new.json', 'used.json']
+
+
+def test_unfinished_writes_are_not_blobs(store):
+    with store.writer() as out:
+        out.write(b'half an upload')
+        temp_file = out.tmp_path
+        # Not counted, and not swept while the write may still be running
+        assert list(store.entries()) == []
+        assert store.sweep(0) == []
+        assert os.path.exists(temp_file)
+        out.commit('upload.pdf')
+    assert [key for _, _, key in store.entries()] == ['upload.pdf']
+
+
+def test_abandoned_writes_are_swept(store):
+    writer = store.writer()
+    writer.write(b'left behind')
+    writer.file.close()
+    then = time.time() - TEMP_FILE_TTL - 1
+    os.utime(writer.tmp_path, (then, then))
+
+    assert store.sweep(3600) == []
+    assert not os.path.exists(writer.tmp_path)
@@ -0,0 +1,63 @@
+import datetime
+import time
+
+import pytest
+
+from pymongo.errors import OperationFailure
+
+from card_store import CLOCK_SKEW_MARGIN, EXPORT_OVERLAP, EmbeddedCardStore, PerCardStore, export_point
+
+mongomock = pytest.importorskip('mongomock')
+
+CARDS = [{'front': 'a', 'back': 'b'}, {'front': 'c', 'back': 'd'}]
+QUIZ = [{'question': 'q', 'options': ['1', '2', '3', '4'], 'answer': '1'}]
+
+
+@pytest.fixture(params=[EmbeddedCardStore, PerCardStore])
+def store(request):
+    return request.param(mongomock.MongoClient().flashy)
+
+
+def test_version_only_changes_when_cards_are_added(store):
+    store.add('ann', 'Biology', CARDS, QUIZ)
+    assert store.deck_version('ann', 'Biology') == 1
+
+    # Regenerating the same deck keeps the ETag
+    store.add('ann', 'Biology', CARDS, QUIZ)
+    assert store.deck_version('ann', 'Biology') == 1
+
+    store.add('ann', 'Biology', [{'front': 'e', 'back': 'f'}] + CARDS)
+    assert store.deck_version('ann', 'Biology') == 2
+    assert len(store.get_deck('ann', 'Biology')['flashcards']) == 3
+
+
+def test_unchanged_decks_are_left_out_of_incremental_exports(store):
+    store.add('ann', 'Biology', CARDS)
+    store.add('ann', 'History', CARDS)
+    time.sleep(0.01)
+    since = datetime.datetime.utcnow()
+
+    store.add('ann', 'Biology', CARDS)
+    assert [deck['course'] for deck, _ in store.export('ann', since)] == []
+
+
+class ServerClock:
+    def __init__(self, local_time=None):
+        self.local_time = local_time
+
+    def command(self, name):
+        assert name == 'hello'
+        if self.local_time is None:
+            raise OperationFailure('hello failed')
+        return {'isWritablePrimary': True, 'localTime': self.local_time}
+
+
+def test_exports_start_from_the_server_clock():
+    # The app host's clock may be ahead of Mongo's, which sets updated_at
+    server_now = datetime.datetime.utcnow() - datetime.timedelta(minutes=10)
+    assert export_point(ServerClock(server_now)) == server_now - EXPORT_OVERLAP
+
+    before = datetime.datetime.utcnow()
+    point = export_point(ServerClock())
+    assert before - point >= CLOCK_SKEW_MARGIN + EXPORT_OVERLAP - datetime.timedelta(seconds=1)
+    assert point <= datetime.datetime.utcnow() - CLOCK_SKEW_MARGIN - EXPORT_OVERLAP
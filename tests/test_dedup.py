@@ -0,0 +1,83 @@
+import threading
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+from card_store import FLASHCARD, EmbeddedCardStore
+from dedup import SemanticDeduplicator
+
+mongomock = pytest.importorskip('mongomock')
+
+
+# Deterministic embeddings instead of the sentence-transformers model:
+# equal texts get equal unit vectors, different texts near-orthogonal ones
+class HashedDeduplicator(SemanticDeduplicator):
+    def embed(self, texts):
+        rows = []
+        for text in texts:
+            row = np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(256)
+            rows.append(row / np.linalg.norm(row))
+        return np.array(rows, dtype=np.float32)
+
+
+CARDS = [{'front': 'What is ATP?', 'back': 'Energy currency'}, {'front': 'What is DNA?', 'back': 'Genome'}]
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().flashy
+
+
+def test_duplicates_within_a_batch_are_dropped(db):
+    dedup = HashedDeduplicator(db, EmbeddedCardStore(db))
+    kept, vectors = dedup.filter('ann', 'Bio', FLASHCARD, CARDS + [dict(CARDS[0])])
+    assert kept == CARDS
+    assert vectors.shape == (2, 256)
+    assert dedup.dropped == 1
+
+
+def test_only_remembered_cards_count_as_duplicates(db):
+    dedup = HashedDeduplicator(db, EmbeddedCardStore(db))
+    # The write of these cards failed, they must not block the next attempt
+    dedup.filter('ann', 'Bio', FLASHCARD, CARDS)
+    kept, vectors = dedup.filter('ann', 'Bio', FLASHCARD, CARDS)
+    assert kept == CARDS
+
+    dedup.remember('ann', 'Bio', FLASHCARD, vectors)
+    assert dedup.filter('ann', 'Bio', FLASHCARD, CARDS)[0] == []
+
+    # Persisted for other processes, which start with a cold cache
+    other = HashedDeduplicator(db, EmbeddedCardStore(db))
+    assert other.filter('ann', 'Bio', FLASHCARD, CARDS)[0] == []
+    assert other.filter('ann', 'Chem', FLASHCARD, CARDS)[0] == CARDS
+
+
+def test_stored_decks_are_backfilled(db):
+    store = EmbeddedCardStore(db)
+    store.add('ann', 'Bio', CARDS[:1])
+    dedup = HashedDeduplicator(db, store)
+    assert dedup.filter('ann', 'Bio', FLASHCARD, CARDS)[0] == CARDS[1:]
+
+
+def test_concurrent_stores_of_a_deck_keep_one_copy(db):
+    dedup = HashedDeduplicator(db, EmbeddedCardStore(db))
+    written = []
+    start = threading.Barrier(2)
+
+    def write(flashcards, quiz_cards):
+        # A job filtering during this write would keep the same cards
+        time.sleep(0.05)
+        written.extend(flashcards)
+
+    def store():
+        start.wait()
+        dedup.store('ann', 'Bio', list(CARDS), [], write)
+
+    threads = [threading.Thread(target=store) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert written == CARDS
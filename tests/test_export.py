@@ -0,0 +1,109 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import time
+
+import pytest
+
+import app as app_module
+from card_store import FLASHCARD, QUIZ
+from export import (ANKI_HEADER, CHUNK_SIZE, CSV_HEADER, isoformat, parse_timestamp, write_anki, write_csv,
+                    write_ndjson)
+
+EXPORTED_AT = datetime.datetime(2024, 5, 1, 12, 0, 0, 250000)
+FLASHCARDS = [{'front': 'What is ATP?', 'back': 'Energy, "currency", of cells'}, {'front': 'DNA', 'back': 'Genome'}]
+QUIZZES = [{'question': 'Which organelle makes ATP?', 'options': ['Nucleus', 'Mitochondrion'],
+            'answer': 'Mitochondrion'}]
+
+
+def decks():
+    yield ({'course': 'Biology', 'version': 3, 'updated_at': EXPORTED_AT},
+           iter([(FLASHCARD, card) for card in FLASHCARDS] + [(QUIZ, card) for card in QUIZZES]))
+    yield {'course': 'Chemistry', 'version': 1}, iter([(FLASHCARD, {'front': 'H2O', 'back': 'Water'})])
+
+
+def body(chunks):
+    return b''.join(chunks).decode('utf-8')
+
+
+def test_timestamps():
+    assert isoformat(EXPORTED_AT) == '2024-05-01T12:00:00.250Z'
+    assert parse_timestamp('2024-05-01T12:00:00.250Z') == EXPORTED_AT
+    assert parse_timestamp('2024-05-01T14:00:00.250+02:00') == EXPORTED_AT
+    assert parse_timestamp('') is None
+    with pytest.raises(ValueError):
+        parse_timestamp('yesterday')
+
+
+def test_ndjson():
+    lines = [json.loads(line) for line in body(write_ndjson(decks(), 'ann', None, EXPORTED_AT)).splitlines()]
+    assert lines[0] == {'type': 'export', 'version': 1, 'username': 'ann', 'since': None,
+                        'exported_at': '2024-05-01T12:00:00.250Z'}
+    assert lines[1] == {'type': 'deck', 'course': 'Biology', 'version': 3, 'updated_at': '2024-05-01T12:00:00.250Z'}
+    assert [line['card'] for line in lines[2:5]] == FLASHCARDS + QUIZZES
+    assert [line['type'] for line in lines[2:5]] == [FLASHCARD, FLASHCARD, QUIZ]
+    assert lines[5]['updated_at'] is None
+    assert lines[-1] == {'type': 'done', 'decks': 2, 'cards': 4, 'exported_at': '2024-05-01T12:00:00.250Z'}
+
+
+def test_csv():
+    rows = list(csv.reader(io.StringIO(body(write_csv(decks(), 'ann', None, EXPORTED_AT)))))
+    assert rows[0] == CSV_HEADER
+    assert rows[1] == ['Biology', FLASHCARD, 'What is ATP?', 'Energy, "currency", of cells', '', '', '']
+    assert rows[3] == ['Biology', QUIZ, '', '', 'Which organelle makes ATP?', 'Nucleus | Mitochondrion',
+                       'Mitochondrion']
+    assert rows[4][0] == 'Chemistry'
+
+
+def test_anki():
+    text = body(write_anki(decks(), 'ann', None, EXPORTED_AT))
+    assert text.startswith(ANKI_HEADER)
+    rows = list(csv.reader(io.StringIO(text[len(ANKI_HEADER):]), delimiter='\t'))
+    assert rows[0] == ['What is ATP?', 'Energy, "currency", of cells', 'Flashy::Biology']
+    assert rows[2] == ['Which organelle makes ATP?\n\nA) Nucleus\nB) Mitochondrion', 'Mitochondrion',
+                       'Flashy::Biology']
+    assert rows[3][2] == 'Flashy::Chemistry'
+
+
+def test_large_exports_stream_in_chunks():
+    cards = [(FLASHCARD, {'front': f'Question {i}', 'back': 'x' * 100}) for i in range(2000)]
+    chunks = list(write_ndjson(iter([({'course': 'Big'}, iter(cards))]), 'ann', None, EXPORTED_AT))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 2 * CHUNK_SIZE for chunk in chunks)
+
+
+@pytest.fixture
+def export_point(monkeypatch):
+    # mongomock has no `hello` command
+    points = []
+    monkeypatch.setattr(app_module, 'export_point', lambda db: points.pop(0))
+    return points
+
+
+def test_export_route(client, services, export_point):
+    services.card_store.add('ann', 'Biology', FLASHCARDS, QUIZZES)
+    time.sleep(0.01)
+    export_point.append(datetime.datetime.utcnow())
+    response = client.get('/export', query_string={'username': 'ann', 'format': 'csv'},
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'flashy-ann.csv' in response.headers['Content-Disposition']
+    rows = list(csv.reader(io.StringIO(gzip.decompress(response.data).decode('utf-8'))))
+    assert len(rows) == 1 + len(FLASHCARDS) + len(QUIZZES)
+
+    # Only decks written after the previous export come back
+    since = response.headers['X-Exported-At']
+    time.sleep(0.01)
+    services.card_store.add('ann', 'Chemistry', [{'front': 'H2O', 'back': 'Water'}])
+    export_point.append(datetime.datetime.utcnow())
+    lines = client.get('/export', query_string={'username': 'ann', 'since': since}).data.decode().splitlines()
+    assert [json.loads(line)['course'] for line in lines if json.loads(line)['type'] == 'deck'] == ['Chemistry']
+
+
+@pytest.mark.parametrize('params', [{}, {'username': 'ann', 'format': 'xml'}, {'username': 'ann', 'since': 'soon'}])
+def test_invalid_export_requests(client, params):
+    assert client.get('/export', query_string=params).status_code == 400
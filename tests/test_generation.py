@@ -0,0 +1,38 @@
+import pytest
+
+import generation
+from generation import allocate, generate_deck, split_segments
+
+SEGMENTS = ['a' * 10, 'b' * 1000, 'c' * 30, 'd' * 5, 'e' * 400, 'f' * 60]
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 6, 7, 40])
+def test_allocate_prompts_every_segment(count):
+    plan = allocate(SEGMENTS, count)
+    assert sum(n for _, n in plan) == count
+    assert all(n >= 1 for _, n in plan)
+    # Merged segments are neighbours, in order
+    assert ''.join(text for text, _ in plan) == ''.join(SEGMENTS)
+
+
+def test_allocate_follows_segment_size():
+    plan = dict(allocate(['a' * 100, 'b' * 500], 8))
+    assert plan == {'a' * 100: 2, 'b' * 500: 6}
+
+
+def test_few_cards_still_cover_the_whole_text(monkeypatch):
+    prompts = []
+
+    def fake_flashcards(segment, n, **kwargs):
+        prompts.append(segment)
+        return [{'front': f'{len(prompts)}-{i}', 'back': ''} for i in range(n)]
+
+    monkeypatch.setattr(generation, 'generate_flashcards', fake_flashcards)
+    text = '\n'.join(f'Paragraph {i} about topic {i}. ' * 4 for i in range(12))
+    segments = split_segments(text, token_budget=20)
+    assert len(segments) > 3
+
+    flashcards, _ = generate_deck(text, 3, token_budget=20)
+    assert len(flashcards) == 3
+    for segment in segments:
+        assert any(segment in prompt for prompt in prompts)
@@ -0,0 +1,110 @@
+import gzip
+
+import pytest
+
+from card_store import EmbeddedCardStore, PerCardStore
+from http_utils import MIN_COMPRESS_SIZE, decode_cursor, encode_cursor, make_etag
+
+CARDS = [{'front': f'Question {i}', 'back': f'Answer {i}'} for i in range(25)]
+QUIZ = [{'question': 'Which?', 'options': ['a', 'b', 'c', 'd'], 'answer': 'a'}]
+
+
+def test_cursors_round_trip():
+    for value in [0, 17, ['Biology', 3], {'after': 'abc'}]:
+        cursor = encode_cursor(value)
+        assert '=' not in cursor
+        assert decode_cursor(cursor) == value
+    assert encode_cursor(None) is None
+    assert decode_cursor('') is None
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor!')
+
+
+def test_etags_follow_their_parts():
+    assert make_etag('flashcards', 'ann', 1) == make_etag('flashcards', 'ann', 1)
+    assert make_etag('flashcards', 'ann', 1) != make_etag('flashcards', 'ann', 2)
+
+
+@pytest.fixture(params=[EmbeddedCardStore, PerCardStore])
+def card_store(request, services):
+    # Lazy backends are cached on the instance, see services.lazy
+    store = services.__dict__['card_store'] = request.param(services.db)
+    store.add('ann', 'Biology', CARDS, QUIZ)
+    return store
+
+
+def test_whole_deck(client, card_store):
+    response = client.get('/flashcards', query_string={'username': 'ann', 'selectedCourse': 'Biology'})
+    assert response.status_code == 200
+    assert response.json['flashcards'] == CARDS
+    assert response.json['quizzes'] == QUIZ
+    assert response.json['version'] == 1
+
+
+def test_pages_follow_the_cursor(client, card_store):
+    fronts, cursor, pages = [], None, 0
+    while True:
+        params = {'username': 'ann', 'selectedCourse': 'Biology', 'limit': 10}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.post('/flashcards', json=params).json
+        assert len(page['flashcards']) <= 10
+        fronts += [card['front'] for card in page['flashcards']]
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == 3
+    assert sorted(fronts) == sorted(card['front'] for card in CARDS)
+
+    quizzes = client.get('/flashcards', query_string={'username': 'ann', 'selectedCourse': 'Biology', 'limit': 10,
+                                                      'type': 'quizzes'}).json
+    assert quizzes['quizzes'] == QUIZ
+    assert quizzes['next_cursor'] is None
+
+
+@pytest.mark.parametrize('params', [{'limit': 0}, {'limit': 'ten'}, {'limit': 5, 'cursor': '%%%'},
+                                    {'type': 'notes'}])
+def test_invalid_page_requests(client, card_store, params):
+    response = client.get('/flashcards', query_string=dict(params, username='ann', selectedCourse='Biology'))
+    assert response.status_code == 400
+
+
+def test_unchanged_deck_answers_304(client, card_store):
+    params = {'username': 'ann', 'selectedCourse': 'Biology', 'limit': 10}
+    first = client.get('/flashcards', query_string=params)
+    etag = first.headers['ETag']
+
+    again = client.get('/flashcards', query_string=params, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    # Another page has its own ETag
+    other = client.get('/flashcards', query_string=dict(params, limit=5), headers={'If-None-Match': etag})
+    assert other.status_code == 200
+
+    # A write changes the deck version
+    card_store.add('ann', 'Biology', [{'front': 'New', 'back': 'Card'}])
+    changed = client.get('/flashcards', query_string=params, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.json['version'] == 2
+
+
+def test_courses_etag(client, card_store):
+    first = client.get('/courses', query_string={'username': 'ann'})
+    assert first.json == {'courses': ['Biology']}
+    again = client.get('/courses', query_string={'username': 'ann'}, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_large_decks_are_compressed(client, card_store):
+    params = {'username': 'ann', 'selectedCourse': 'Biology'}
+    plain = client.get('/flashcards', query_string=params, headers={'Accept-Encoding': 'identity'})
+    assert len(plain.data) >= MIN_COMPRESS_SIZE
+    assert 'Content-Encoding' not in plain.headers
+
+    zipped = client.get('/flashcards', query_string=params, headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in zipped.headers['Vary']
+    assert gzip.decompress(zipped.data) == plain.data
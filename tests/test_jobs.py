@@ -0,0 +1,170 @@
+import asyncio
+import io
+import logging
+import time
+
+import pytest
+
+from app import BULK_FILE_ERROR
+from jobs import FAILED, JOB_ERROR, SUCCEEDED, AsyncJobQueue, JobQueue, QueueFull
+
+
+def stages(job):
+    return [event['stage'] for event in job.events]
+
+
+def test_job_succeeds_with_its_result():
+    jobs = JobQueue(max_workers=2)
+
+    def pipeline(job, text, count=1):
+        job.update('generating', 0.5, segments_done=1)
+        return {'text': text * count}
+
+    job = jobs.submit('test', pipeline, 'ab', count=2)
+    jobs.join()
+
+    assert job.status == SUCCEEDED
+    assert job.progress == 1.0
+    assert job.to_dict()['result'] == {'text': 'abab'}
+    assert stages(job) == ['queued', 'running', 'generating', SUCCEEDED]
+    assert [event['seq'] for event in job.events] == [0, 1, 2, 3]
+    assert job.events[2]['segments_done'] == 1
+
+
+def test_failed_job_reports_a_fixed_error(caplog):
+    jobs = JobQueue(max_workers=1)
+
+    def pipeline(job):
+        raise RuntimeError('no cards for mongodb://user:secret@db')
+
+    with caplog.at_level(logging.ERROR, logger='jobs'):
+        job = jobs.submit('test', pipeline)
+        jobs.join()
+
+    data = job.to_dict()
+    assert data['status'] == FAILED
+    # The exception is logged, not sent to clients
+    assert data['error'] == JOB_ERROR
+    assert 'secret' in caplog.text
+    assert 'result' not in data
+
+
+def test_failed_async_job_reports_a_fixed_error():
+    async def main():
+        jobs = AsyncJobQueue(max_running=1)
+
+        async def pipeline(job):
+            raise RuntimeError('no cards for mongodb://user:secret@db')
+
+        job = jobs.submit('test', pipeline)
+        await jobs.join()
+        return job.to_dict()
+
+    data = asyncio.run(main())
+    assert data['status'] == FAILED
+    assert data['error'] == JOB_ERROR
+
+
+def test_full_queue_rejects_jobs():
+    # Without workers nothing leaves the queue
+    jobs = JobQueue(max_workers=0, max_queued=1)
+    jobs.submit('test', lambda job: None)
+    with pytest.raises(QueueFull):
+        jobs.submit('test', lambda job: None)
+    assert jobs.queued() == 1
+
+
+def test_finished_jobs_expire_after_ttl():
+    jobs = JobQueue(max_workers=1, ttl=0)
+    job = jobs.submit('test', lambda job: None)
+    jobs.join()
+    assert jobs.get(job.id) is job
+
+    time.sleep(0.01)
+    jobs.submit('test', lambda job: None)
+    assert jobs.get(job.id) is None
+
+
+def test_sse_stream_resumes_after_last_event_id():
+    jobs = JobQueue(max_workers=1)
+    job = jobs.submit('test', lambda job: 'done')
+    jobs.join()
+
+    body = ''.join(job.sse_stream())
+    assert body.count('event: progress') == len(job.events)
+    assert body.endswith('\n\n') and 'event: done' in body
+
+    resumed = ''.join(job.sse_stream(last_event_id=len(job.events) - 2))
+    assert resumed.count('event: progress') == 1
+
+
+def test_job_routes(client, services, app):
+    with app.app_context():
+        job = services.job_queue.submit('test', lambda job: {'flashcards': []})
+    services.job_queue.join()
+
+    response = client.get(f'/jobs/{job.id}')
+    assert response.status_code == 200
+    assert response.json['status'] == SUCCEEDED
+    assert response.json['result'] == {'flashcards': []}
+
+    response = client.get(f'/jobs/{job.id}/events')
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert 'event: progress' in body and 'event: done' in body
+
+    assert client.get('/jobs/unknown').status_code == 404
+    assert client.get('/jobs/unknown/events').status_code == 404
+
+
+def test_process_free_runs_as_a_job(client, services, make_pdf, monkeypatch):
+    from gemini import response_cache
+    monkeypatch.setattr(response_cache, 'collection', None)
+    pdf = make_pdf(['Photosynthesis converts light energy into chemical energy stored in glucose. ' * 5])
+    with open(pdf, 'rb') as f:
+        preview = client.post('/preview_free_upload', data={'file': (f, 'doc.pdf')})
+    assert preview.status_code == 200
+    upload_id = preview.json['upload_id']
+
+    response = client.post('/process_free', json={'upload_id': upload_id, 'pages': [1], 'flashcard_number': 3})
+    assert response.status_code == 202
+    services.job_queue.join()
+
+    job = client.get(response.json['status_url']).json
+    assert job['status'] == SUCCEEDED
+    assert len(job['result']['flashcards']) == 3
+    # The persistent cache tier is attached though nothing else used Mongo
+    assert response_cache.collection.name == 'llm_cache'
+
+
+@pytest.mark.parametrize('flashcard_number', ['abc', -1, 0, 10 ** 6, True, 2.5])
+def test_invalid_flashcard_number_is_rejected_before_queueing(client, services, flashcard_number):
+    response = client.post('/process_free', json={'upload_id': '0' * 32, 'pages': [1],
+                                                  'flashcard_number': flashcard_number})
+    assert response.status_code == 400
+    assert services.job_queue.queued() == 0
+
+
+def test_bulk_job_reports_each_file(client, services, make_pdf, caplog):
+    pdf = make_pdf(['Mitochondria produce most of the chemical energy of the cell as ATP. ' * 5])
+    with open(pdf, 'rb') as good:
+        response = client.post('/process_bulk', data={
+            'files': [(good, 'good.pdf'), (io.BytesIO(b'not a pdf'), 'broken.pdf'), (io.BytesIO(b'x'), 'notes.txt')],
+            'username': 'ana', 'course': 'biology', 'flashcard_number': '3'
+        })
+    assert response.status_code == 202
+    assert [entry['status'] for entry in response.json['files']] == ['queued', 'queued', 'skipped']
+    with caplog.at_level(logging.ERROR):
+        services.job_queue.join()
+
+    job = services.job_queue.get(response.json['job_id'])
+    files = job.to_dict()['files']
+    assert [entry['status'] for entry in files] == ['generated', 'failed', 'skipped']
+    # The cause is logged, the client only gets a fixed message
+    assert files[1]['error'] == BULK_FILE_ERROR
+    assert 'broken.pdf' in caplog.text
+    assert len(job.result['flashcards']) == 3
+    # Events carry the entry that changed, not the whole list
+    file_events = [event for event in job.events if 'file' in event]
+    assert file_events and all('files' not in event for event in job.events)
+    assert {event['file']['index'] for event in file_events} == {0, 1}
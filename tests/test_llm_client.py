@@ -0,0 +1,71 @@
+import sys
+
+import pytest
+
+from llm_client import LLM_CALLS, FakeBackend, LLMClient, LLMError, LLMFatalError
+
+
+class Retryable(Exception):
+    pass
+
+
+class Fatal(Exception):
+    pass
+
+
+# Backend failing with the given errors before answering
+class ScriptedBackend:
+    model_name = 'scripted'
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def error_classes(self):
+        return (Retryable,), (Fatal,)
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'answer'
+
+    def generate_stream(self, prompt):
+        yield from self.generate(prompt)
+
+
+def calls(outcome):
+    return dict(LLM_CALLS.samples()).get(f'flashy_llm_calls_total{{outcome="{outcome}"}}', 0)
+
+
+def client(backend, max_retries=2):
+    return LLMClient(backend, max_retries=max_retries, base_delay=0)
+
+
+def test_retryable_errors_are_retried():
+    backend = ScriptedBackend(Retryable('busy'), Retryable('busy'))
+    assert client(backend).generate('prompt') == 'answer'
+    assert backend.calls == 3
+
+
+def test_fatal_errors_are_not_retried():
+    backend = ScriptedBackend(Fatal('bad request'))
+    with pytest.raises(LLMFatalError):
+        client(backend).generate('prompt')
+    assert backend.calls == 1
+
+
+def test_retries_are_bounded():
+    backend = ScriptedBackend(*[Retryable('busy')] * 3)
+    with pytest.raises(LLMError):
+        client(backend).generate('prompt')
+    assert backend.calls == 3
+
+
+def test_stream_closed_early_is_counted_without_loading_the_sdk():
+    stream = client(FakeBackend(latency=0, jitter=0)).generate_stream('Create 3 flashcards from: ' + 'word ' * 400)
+    before = calls('cancelled')
+    next(stream)
+    stream.close()
+    assert calls('cancelled') == before + 1
+    assert 'google.generativeai' not in sys.modules
@@ -0,0 +1,127 @@
+import contextlib
+import os
+import threading
+import time
+
+import pytest
+
+import page_cache
+from blob_store import LocalBlobStore
+from page_cache import PageImageCache
+
+
+class FakeRenderer:
+    def __init__(self, size=100, delay=0):
+        self.size = size
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, pdf_path, page_num, dpi, fmt, quality):
+        self.calls.append(page_num)
+        time.sleep(self.delay)
+        return bytes([page_num % 256]) * self.size
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    renderer = FakeRenderer()
+    monkeypatch.setattr(page_cache, 'render_pdf_page', renderer)
+    return renderer
+
+
+@pytest.fixture
+def blobs(tmp_path):
+    return LocalBlobStore(tmp_path / 'pages')
+
+
+def no_pdf():
+    return contextlib.nullcontext('doc.pdf')
+
+
+def read(blob):
+    return b''.join(blob)
+
+
+def age(blobs, key, seconds):
+    then = time.time() - seconds
+    os.utime(blobs.path(key), (then, then))
+
+
+def test_pages_are_rendered_once(blobs, renderer):
+    cache = PageImageCache(blobs)
+    assert read(cache.get_or_render('abc', 1, no_pdf)) == b'\x01' * 100
+    assert read(cache.get_or_render('abc', 1, no_pdf)) == b'\x01' * 100
+    assert cache.get_or_render('abc', 2, no_pdf).size == 100
+    assert renderer.calls == [1, 2]
+    assert blobs.exists('abc/page_1.jpg')
+
+    # Another process finds the rendered pages
+    assert read(PageImageCache(blobs).get_or_render('abc', 1, no_pdf)) == b'\x01' * 100
+    assert renderer.calls == [1, 2]
+
+
+def test_concurrent_requests_wait_for_one_render(blobs, renderer):
+    renderer.delay = 0.05
+    cache = PageImageCache(blobs)
+    start = threading.Barrier(4)
+    images = []
+
+    def request():
+        start.wait()
+        images.append(read(cache.get_or_render('abc', 3, no_pdf)))
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert renderer.calls == [3]
+    assert images == [b'\x03' * 100] * 4
+
+
+def test_least_recently_used_pages_are_evicted(blobs, renderer):
+    cache = PageImageCache(blobs, max_bytes=350)
+    for page in (1, 2, 3):
+        cache.get_or_render('abc', page, no_pdf)
+    age(blobs, 'abc/page_1.jpg', 30)
+    age(blobs, 'abc/page_2.jpg', 20)
+    age(blobs, 'abc/page_3.jpg', 10)
+    # Reading a page makes it recently used
+    cache.get_or_render('abc', 1, no_pdf)
+
+    # Over quota, evicted down to 90% of it
+    cache.get_or_render('abc', 4, no_pdf)
+    assert [blobs.exists(f'abc/page_{page}.jpg') for page in (1, 2, 3, 4)] == [True, False, True, True]
+    assert cache._total_bytes == 300
+
+
+def test_removed_documents_free_their_quota(blobs, renderer):
+    cache = PageImageCache(blobs)
+    cache.get_or_render('abc', 1, no_pdf)
+    cache.get_or_render('def', 1, no_pdf)
+    cache.remove('abc')
+    assert not blobs.exists('abc/page_1.jpg')
+    assert blobs.exists('def/page_1.jpg')
+    assert cache._total_bytes == 100
+    # Cached pages count towards the quota of a new process
+    assert PageImageCache(blobs)._total_bytes == 100
+
+
+def test_render_formats(blobs):
+    assert PageImageCache(blobs, fmt='png').key_for('abc', 2) == 'abc/page_2.png'
+    with pytest.raises(ValueError):
+        PageImageCache(blobs, fmt='gif')
+
+
+def test_page_image_route(client, make_pdf):
+    with open(make_pdf(['First page', 'Second page']), 'rb') as f:
+        upload_id = client.post('/preview_free_upload', data={'file': (f, 'doc.pdf')}).json['upload_id']
+
+    response = client.get(f'/page_image/{upload_id}/2')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.data.startswith(b'\xff\xd8')
+    assert 'max-age=86400' in response.headers['Cache-Control']
+
+    assert client.get(f'/page_image/{upload_id}/3').status_code == 404
+    assert client.get(f'/page_image/{"0" * 32}/1').status_code == 404
@@ -0,0 +1,121 @@
+import datetime
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+import response_cache as response_cache_module
+from response_cache import ResponseCache
+
+mongomock = pytest.importorskip('mongomock')
+
+CARDS = [{'front': 'What is ATP?', 'back': 'Energy currency'}]
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().flashy.llm_cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache_module, 'time', clock)
+    return clock
+
+
+def test_keys_ignore_whitespace_but_not_the_request():
+    cache = ResponseCache()
+    key = cache.key('flashcards', 'Cells  divide\nby mitosis. ', 5, 'model')
+    assert key == cache.key('flashcards', 'Cells divide by mitosis.', 5, 'model')
+    assert key != cache.key('flashcards', 'Cells divide by mitosis.', 6, 'model')
+    assert key != cache.key('quiz', 'Cells divide by mitosis.', 5, 'model')
+    assert key != cache.key('flashcards', 'Cells divide by mitosis.', 5, 'other-model')
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', [1])
+    cache.set('b', [2])
+    assert cache.get('a') == [1]
+    cache.set('c', [3])
+    assert cache.get('b') is None
+    assert cache.get('a') == [1]
+    assert cache.get('c') == [3]
+    assert cache.stats()['entries'] == 2
+
+
+def test_callers_get_copies():
+    cache = ResponseCache()
+    cards = [dict(card) for card in CARDS]
+    cache.set('a', cards)
+    cards[0]['front'] = 'changed'
+    cache.get('a')[0]['back'] = 'changed'
+    assert cache.get('a') == CARDS
+
+
+def test_memory_entries_expire(clock):
+    cache = ResponseCache(ttl=60)
+    cache.set('a', CARDS)
+    clock.now += 59
+    assert cache.get('a') == CARDS
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_mongo_tier_outlives_the_process(collection):
+    first = ResponseCache()
+    first.attach(collection)
+    first.set('a', CARDS, 'flashcards')
+    assert collection.find_one({'_id': 'a'})['kind'] == 'flashcards'
+
+    # A new process starts with an empty LRU
+    second = ResponseCache()
+    second.attach(collection)
+    assert second.get('a') == CARDS
+    assert second.get('a') == CARDS
+    stats = second.stats()
+    assert (stats['mongo_hits'], stats['memory_hits'], stats['hit_rate']) == (1, 1, 1.0)
+
+
+def test_expired_mongo_entries_are_misses(collection):
+    cache = ResponseCache(ttl=60)
+    cache.attach(collection)
+    collection.insert_one({'_id': 'a', 'value': CARDS,
+                           'created_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=61)})
+    assert cache.get('a') is None
+    assert 'created_at_1' in collection.index_information()
+
+
+class UnreachableCollection:
+    def find_one(self, *args, **kwargs):
+        raise ServerSelectionTimeoutError('no servers')
+
+    def update_one(self, *args, **kwargs):
+        raise ServerSelectionTimeoutError('no servers')
+
+    def create_index(self, *args, **kwargs):
+        raise ServerSelectionTimeoutError('no servers')
+
+
+def test_mongo_failures_fall_back_to_memory():
+    cache = ResponseCache()
+    cache.attach(UnreachableCollection())
+    assert cache.get('a') is None
+    cache.set('a', CARDS)
+    assert cache.get('a') == CARDS
+
+
+def test_bypasses_are_counted():
+    cache = ResponseCache()
+    cache.record_bypass()
+    assert cache.stats() == {'hits': 0, 'memory_hits': 0, 'mongo_hits': 0, 'misses': 0, 'bypassed': 1,
+                             'hit_rate': 0.0, 'entries': 0}
@@ -0,0 +1,165 @@
+import datetime
+
+import pytest
+
+from card_store import FLASHCARD, EmbeddedCardStore, PerCardStore, card_hash, card_id
+from reviews import (INITIAL_EASE, MIN_EASE, RELEARN_DELAY, InvalidReview, ReviewStore, parse_reviews,
+                     review_documents, schedule)
+
+mongomock = pytest.importorskip('mongomock')
+
+NOW = datetime.datetime(2024, 3, 1, 12, 0)
+CARDS = [{'front': 'a', 'back': 'b'}, {'front': 'c', 'back': 'd'}]
+NEW = {'reps': 0, 'interval': 0, 'ease': INITIAL_EASE, 'lapses': 0}
+
+
+def days(n):
+    return datetime.timedelta(days=n)
+
+
+def test_first_reviews_use_fixed_intervals():
+    first = schedule(NEW, 4, NOW)
+    assert (first['reps'], first['interval'], first['due']) == (1, 1, NOW + days(1))
+    second = schedule(first, 4, NOW + days(1))
+    assert (second['reps'], second['interval']) == (2, 6)
+    third = schedule(second, 4, NOW + days(7))
+    assert third['interval'] == round(6 * second['ease'], 2)
+
+
+def test_ease_follows_the_answer_grade():
+    assert schedule(NEW, 5, NOW)['ease'] == 2.6
+    assert schedule(NEW, 4, NOW)['ease'] == 2.5
+    assert schedule(NEW, 3, NOW)['ease'] == 2.36
+    # Repeated hard answers stop at the lowest ease
+    state = NEW
+    for _ in range(20):
+        state = schedule(state, 0, NOW)
+    assert state['ease'] == MIN_EASE
+
+
+def test_failed_card_is_relearned_soon():
+    learned = schedule(schedule(NEW, 5, NOW), 5, NOW + days(1))
+    failed = schedule(learned, 1, NOW + days(7))
+    assert (failed['reps'], failed['interval'], failed['lapses']) == (0, 0, 1)
+    assert failed['due'] == NOW + days(7) + RELEARN_DELAY
+    # Failing a card that was never learned is not a lapse
+    assert schedule(NEW, 2, NOW)['lapses'] == 0
+
+
+def test_reviews_are_checked_and_ordered():
+    reviews = parse_reviews([
+        {'card_id': 'b', 'quality': 3},
+        {'card_id': 'a', 'quality': '5', 'reviewed_at': '2024-03-01T10:00:00Z'}
+    ], now=NOW)
+    assert reviews == [('a', 5, NOW - datetime.timedelta(hours=2)), ('b', 3, NOW)]
+    # Reviews cannot happen in the future
+    assert parse_reviews([{'card_id': 'a', 'quality': 1, 'reviewed_at': '2030-01-01'}], now=NOW)[0][2] == NOW
+    for reviews in ([], [{'card_id': 'a'}], [{'card_id': 'a', 'quality': 6}], 'a'):
+        with pytest.raises(InvalidReview):
+            parse_reviews(reviews, now=NOW)
+
+
+def test_review_documents_hold_no_card():
+    document = review_documents('ann', 'Biology', CARDS[:1], now=NOW)[0]
+    assert document['_id'] == card_id('ann', 'Biology', FLASHCARD, card_hash(CARDS[0]))
+    assert 'card' not in document
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().flashy
+
+
+def test_record_applies_reviews_in_order(db):
+    store = ReviewStore(db)
+    store.add('ann', 'Biology', CARDS)
+    first, second = sorted(doc['_id'] for doc in store.due('ann', 10))
+
+    updated = store.record('ann', [(first, 5, NOW), (first, 5, NOW + days(1)), (second, 1, NOW), ('gone', 5, NOW)])
+    assert set(updated) == {first, second}
+    assert (updated[first]['reps'], updated[first]['interval']) == (2, 6)
+    stored = db.reviews.find_one({'_id': first})
+    assert stored['review_count'] == 2 and stored['reps'] == 2
+    # Another user cannot review the card
+    assert store.record('ben', [(first, 5, NOW)]) == {}
+
+
+def test_concurrent_reviews_are_not_lost(db):
+    store = ReviewStore(db)
+    store.add('ann', 'Biology', CARDS[:1])
+    reviewed_id = store.due('ann', 1)[0]['_id']
+    find = store.collection.find
+    raced = []
+
+    # Another request records a review between this one's read and write
+    def racing_find(*args, **kwargs):
+        docs = list(find(*args, **kwargs))
+        if not raced:
+            raced.append(True)
+            ReviewStore(db).record('ann', [(reviewed_id, 5, NOW)])
+        return iter(docs)
+
+    store.collection.find = racing_find
+    updated = store.record('ann', [(reviewed_id, 5, NOW + days(1))])
+    stored = db.reviews.find_one({'_id': reviewed_id})
+    assert stored['review_count'] == 2
+    assert stored['reps'] == updated[reviewed_id]['reps'] == 2
+    assert db.reviews.count_documents({}) == 1
+
+
+def test_card_deleted_while_recording_is_unknown(db):
+    store = ReviewStore(db)
+    store.add('ann', 'Biology', CARDS)
+    gone, kept = sorted(doc['_id'] for doc in store.due('ann', 10))
+    find = store.collection.find
+    deleted = []
+
+    # The card is removed between this request's read and write
+    def deleting_find(*args, **kwargs):
+        docs = list(find(*args, **kwargs))
+        if not deleted:
+            deleted.append(True)
+            db.reviews.delete_one({'_id': gone})
+        return iter(docs)
+
+    store.collection.find = deleting_find
+    updated = store.record('ann', [(gone, 5, NOW), (kept, 5, NOW)])
+    assert set(updated) == {kept}
+    # Nothing is written in place of the deleted schedule
+    assert db.reviews.count_documents({}) == 1
+
+
+@pytest.mark.parametrize('card_store', [EmbeddedCardStore, PerCardStore])
+def test_due_cards_come_from_the_card_store(client, services, card_store):
+    store = card_store(services.db)
+    services.__dict__['card_store'] = store
+    store.add('ann', 'Biology', CARDS)
+    services.review_store.add('ann', 'Biology', CARDS)
+    # A schedule whose card is no longer stored is left out
+    services.review_store.add('ann', 'Biology', [{'front': 'x', 'back': 'y'}])
+
+    response = client.get('/reviews/due', query_string={'username': 'ann', 'limit': 10})
+    assert response.status_code == 200
+    assert sorted(card['card']['front'] for card in response.json['cards']) == ['a', 'c']
+
+
+def test_embedded_due_cards_do_not_load_decks(db):
+    store = EmbeddedCardStore(db)
+    store.add('ann', 'Biology', CARDS)
+    reviews = ReviewStore(db)
+    reviews.add('ann', 'Biology', CARDS)
+    due = reviews.due('ann', 10)
+
+    store.get_deck = None
+    assert sorted(card['front'] for card in store.cards_by_id('ann', due).values()) == ['a', 'c']
+
+
+def test_embedded_decks_from_before_the_lookup_are_added_once(db):
+    store = EmbeddedCardStore(db)
+    store.add('ann', 'Biology', CARDS)
+    db.embedded_cards.delete_many({})
+    reviews = ReviewStore(db)
+    reviews.add('ann', 'Biology', CARDS)
+
+    assert len(store.cards_by_id('ann', reviews.due('ann', 10))) == 2
+    assert db.embedded_cards.count_documents({'username': 'ann'}) == 2
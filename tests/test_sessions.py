@@ -0,0 +1,95 @@
+import io
+import os
+import time
+
+import pytest
+
+from blob_store import LocalBlobStore
+from sessions import UploadSessions, build_index, page_count, page_paragraphs, page_text
+
+PDF_PAGES = ['First page', '', 'Third page\nwith two lines']
+SLIDES = [['Title', 'Point one', 'Point two'], [], ['Summary']]
+
+
+def test_pdf_pages_are_one_block_each():
+    parsed = build_index('a' * 32, 'pdf', PDF_PAGES)
+    assert page_count(parsed) == 3
+    assert [page_text(parsed, page_num) for page_num in (1, 2, 3)] == PDF_PAGES
+    assert page_paragraphs(parsed, 3) == ['Third page\nwith two lines']
+
+
+def test_preview_paragraphs_are_blocks_of_their_page():
+    pages = ['\n'.join(paragraphs) for paragraphs in SLIDES]
+    parsed = build_index('a' * 32, 'pptx', pages, preview=SLIDES)
+    assert page_count(parsed) == 3
+    assert [page_paragraphs(parsed, page_num) for page_num in (1, 2, 3)] == SLIDES
+    assert [page_text(parsed, page_num) for page_num in (1, 2, 3)] == pages
+    # The text is stored once, not per page and again per paragraph
+    assert parsed['text'] == 'Title\nPoint one\nPoint two\nSummary'
+
+
+@pytest.mark.parametrize('page_num', [0, 4, -1])
+def test_pages_out_of_range(page_num):
+    parsed = build_index('a' * 32, 'pdf', PDF_PAGES)
+    with pytest.raises(IndexError):
+        page_text(parsed, page_num)
+
+
+def test_empty_document():
+    parsed = build_index('a' * 32, 'docx', [], preview=[])
+    assert page_count(parsed) == 0
+    assert parsed['text'] == ''
+
+
+class Upload:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+
+def test_upload_sessions_round_trip(tmp_path):
+    blobs = LocalBlobStore(tmp_path)
+    upload_sessions = UploadSessions(blobs)
+    upload_id = upload_sessions.save(Upload(b'%PDF-1.4 content'), 'pdf')
+    # Same content, same upload ID
+    assert upload_sessions.save(Upload(b'%PDF-1.4 content'), 'pdf') == upload_id
+    assert upload_sessions.get(upload_id) is None
+
+    upload_sessions.put(upload_id, 'pdf', PDF_PAGES)
+    # Another worker only has the stored index
+    parsed = UploadSessions(blobs).get(upload_id)
+    assert parsed['file_ext'] == 'pdf'
+    assert upload_sessions.selected_pages(parsed, [3, 1]) == [PDF_PAGES[2], PDF_PAGES[0]]
+    with pytest.raises(IndexError):
+        upload_sessions.selected_pages(parsed, [9])
+
+    assert upload_sessions.get('../../etc/passwd') is None
+
+
+def test_sessions_in_use_do_not_expire(tmp_path):
+    blobs = LocalBlobStore(tmp_path)
+    upload_sessions = UploadSessions(blobs, ttl=60)
+    upload_id = upload_sessions.save(Upload(b'%PDF-1.4 content'), 'pdf')
+    upload_sessions.put(upload_id, 'pdf', PDF_PAGES)
+    keys = [f'{upload_id}.pdf', f'{upload_id}.json']
+
+    def age_all(seconds):
+        then = time.time() - seconds
+        for key in keys:
+            os.utime(blobs.path(key), (then, then))
+
+    # Read from the store by another worker
+    age_all(50)
+    assert UploadSessions(blobs, ttl=60).get(upload_id) is not None
+    assert blobs.sweep(30) == []
+
+    # Served from the cache, touched again once touch_interval passed
+    age_all(50)
+    upload_sessions._cache[upload_id][1] -= upload_sessions.touch_interval
+    assert upload_sessions.get(upload_id) is not None
+    assert blobs.sweep(30) == []
+
+    # Swept elsewhere, the cached copy is dropped too
+    for key in keys:
+        blobs.delete(key)
+    upload_sessions._cache[upload_id][1] -= upload_sessions.touch_interval
+    assert upload_sessions.get(upload_id) is None
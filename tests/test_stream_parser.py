@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from stream_parser import IncrementalArrayParser, parse_json_array
+
+CARDS = [
+    {'front': 'What does {x} mean?', 'back': 'A "placeholder" [usually]'},
+    {'front': 'Escapes', 'back': 'back\\slash and \\"quote\\" and \\u00e9'},
+    {'front': 'Nested', 'back': {'list': [1, {'a': 2}]}}
+]
+RESPONSE = 'Here are your cards:\n```json\n' + json.dumps(CARDS) + '\n```\nAnything else? [no]'
+
+
+def feed_in_chunks(text, size):
+    parser = IncrementalArrayParser()
+    items = []
+    for start in range(0, len(text), size):
+        items += parser.feed(text[start:start + size])
+    return items, parser
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 10 ** 6])
+def test_chunking_does_not_change_the_result(size):
+    items, parser = feed_in_chunks(RESPONSE, size)
+    assert items == CARDS
+    assert parser.done and parser.skipped == 0
+
+
+def test_every_split_point():
+    for split in range(len(RESPONSE) + 1):
+        parser = IncrementalArrayParser()
+        items = parser.feed(RESPONSE[:split]) + parser.feed(RESPONSE[split:])
+        assert items == CARDS, split
+
+
+def test_items_arrive_as_soon_as_they_are_complete():
+    parser = IncrementalArrayParser()
+    first = json.dumps(CARDS[0])
+    assert parser.feed('[' + first[:-1]) == []
+    assert parser.feed('}, {"fr') == [CARDS[0]]
+    assert not parser.done
+
+
+def test_truncated_output_keeps_complete_items():
+    text = json.dumps(CARDS)
+    items, complete = parse_json_array(text[:text.index('Nested') - 5])
+    assert items == CARDS[:2]
+    assert not complete
+
+
+def test_non_objects_and_invalid_items_are_skipped():
+    parser = IncrementalArrayParser()
+    items = parser.feed('[{"front": "a", "back": "b"}, ["x"], {"front": nope}, {"front": "c", "back": "d"}]')
+    assert items == [{'front': 'a', 'back': 'b'}, {'front': 'c', 'back': 'd'}]
+    assert parser.skipped == 2
+
+
+def test_no_array():
+    assert parse_json_array('Sorry, I cannot help with that.') == ([], False)
@@ -0,0 +1,70 @@
+from llm_client import CHARS_PER_TOKEN
+from text_prep import MIN_REPEAT_CHARS, fit_budget, normalize_page, prepare_pages
+
+BODIES = [
+    'Photosynthesis converts light energy into chemical energy stored in glucose.',
+    'The Calvin cycle fixes carbon dioxide in the stroma of the chloroplast.',
+    'Cellular respiration releases the energy stored in glucose as ATP.',
+    'Mitochondria carry out the citric acid cycle and oxidative phosphorylation.',
+]
+
+
+def page(number, body):
+    return f'Biology 101 - Lecture Notes\n{body}\n\nPage {number} of {len(BODIES)}'
+
+
+def test_normalize_page():
+    text = 'Energy  is\tstored\r\nin glu-\ncose.\x00\n\n\n\nNext   paragraph '
+    assert normalize_page(text) == 'Energy is stored\nin glucose.\n\nNext paragraph'
+    # Hyphens before capitals are kept, e.g. "Krebs-\nCycle" names
+    assert normalize_page('Krebs-\nCycle') == 'Krebs-\nCycle'
+
+
+def test_running_headers_and_page_numbers_are_removed():
+    prepared = prepare_pages([page(n, body) for n, body in enumerate(BODIES, start=1)])
+    # The first copy of the header keeps the title in the prompt
+    assert prepared.text.count('Biology 101 - Lecture Notes') == 1
+    assert 'Page' not in prepared.text
+    for body in BODIES:
+        assert body in prepared.text
+    assert prepared.tokens < prepared.extracted_tokens
+    assert prepared.report() == {'input_tokens': prepared.tokens, 'input_tokens_saved': prepared.tokens_saved}
+
+
+def test_few_pages_keep_their_edge_lines():
+    # Two pages are not enough to tell a running header from content
+    prepared = prepare_pages([page(1, BODIES[0]), page(2, BODIES[1])])
+    assert prepared.text.count('Biology 101 - Lecture Notes') == 2
+
+
+def test_repeated_paragraphs_are_dropped():
+    repeated = 'Remember that enzymes lower the activation energy of a reaction.'
+    assert len(repeated) >= MIN_REPEAT_CHARS
+    prepared = prepare_pages([f'{BODIES[0]}\n\n{repeated}', f'{repeated}\n\n{BODIES[1]}', 'Example:\n\nExample:'])
+    assert prepared.text.count(repeated) == 1
+    # Short repeats are likely content
+    assert prepared.text.count('Example:') == 2
+
+
+def test_budget_shortens_every_page():
+    pages = [' '.join([body] * 20) for body in BODIES]
+    prepared = prepare_pages(pages, token_budget=200)
+    assert prepared.truncated
+    assert prepared.tokens <= 200
+    # Every page is still represented
+    for body in BODIES:
+        assert body.split()[0] in prepared.text
+
+    assert not prepare_pages(pages, token_budget=0).truncated
+
+
+def test_fit_budget_cuts_at_word_breaks():
+    pages = ['alpha beta gamma delta ' * 10, 'one two three four ' * 10]
+    fitted, truncated = fit_budget(pages, token_budget=30)
+    assert truncated
+    assert sum(len(page) for page in fitted) <= 30 * CHARS_PER_TOKEN
+    for original, page in zip(pages, fitted):
+        assert original.startswith(page)
+        assert original[len(page)] == ' '
+
+    assert fit_budget(pages, token_budget=10000) == (pages, False)
@@ -0,0 +1,178 @@
+import logging
+import os
+import re
+from collections import Counter
+
+from llm_client import CHARS_PER_TOKEN, estimate_tokens
+from telemetry import counter
+
+logger = logging.getLogger(__name__)
+
+INPUT_TOKENS = counter('flashy_input_tokens_total', 'Document tokens of generation requests', ['stage'])
+
+# Document tokens sent for one request, 0 disables the cap. Over it, every
+# selected page is shortened by the same share.
+INPUT_TOKEN_BUDGET = int(os.getenv('INPUT_TOKEN_BUDGET', '120000'))
+
+# Non-empty lines at the top and bottom of a page checked for headers and footers
+EDGE_LINES = 3
+
+# An edge line is boilerplate when it is on at least this share of the pages
+BOILERPLATE_SHARE = 0.5
+BOILERPLATE_MIN_PAGES = 3
+
+# Longer repeated lines are more likely content, they are de-duplicated instead
+BOILERPLATE_MAX_WORDS = 10
+
+# Repeated lines and paragraphs shorter than this are kept, e.g. "Example:"
+MIN_REPEAT_CHARS = 40
+
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x0e-\x1f\x7f\u00ad\ufffd]')
+HYPHEN_BREAK = re.compile(r'(\w)-\n(?=[a-z])')
+SPACE_RUNS = re.compile(r'[^\S\n]+')
+LINE_EDGES = re.compile(r' *\n *')
+BLANK_RUNS = re.compile(r'\n{3,}')
+PARAGRAPH_BREAK = re.compile(r'\n\n')
+NON_WORD = re.compile(r'[\W_]+')
+DIGITS = re.compile(r'\d+')
+# Line keys of page and slide numbers such as "12", "Page 3 of 10" or "Slide 4"
+PAGE_NUMBER_KEY = re.compile(r'^(?:page|slide|p)? ?#(?: (?:of )?#)?$')
+
+
+# Document text ready for prompts, with the token counts before and after
+class PreparedText:
+    def __init__(self, text, extracted_tokens, truncated=False):
+        self.text = text
+        self.extracted_tokens = extracted_tokens
+        self.tokens = estimate_tokens(text)
+        self.truncated = truncated
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.extracted_tokens - self.tokens)
+
+    def report(self):
+        return {'input_tokens': self.tokens, 'input_tokens_saved': self.tokens_saved}
+
+
+# Control characters, hyphenation breaks and whitespace runs of one page
+def normalize_page(text):
+    text = CONTROL_CHARS.sub('', text.replace('\r\n', '\n').replace('\r', '\n'))
+    text = LINE_EDGES.sub('\n', SPACE_RUNS.sub(' ', text))
+    text = HYPHEN_BREAK.sub(r'\1', text)
+    return BLANK_RUNS.sub('\n\n', text).strip()
+
+
+# Lines that only differ in numbers share a key, so "Page 3" matches "Page 4"
+def line_key(line):
+    return DIGITS.sub('#', NON_WORD.sub(' ', line.lower())).strip()
+
+
+def text_key(text):
+    return NON_WORD.sub(' ', text.lower()).strip()
+
+
+def edge_indexes(lines):
+    content = [i for i, line in enumerate(lines) if line]
+    return set(content[:EDGE_LINES] + content[-EDGE_LINES:])
+
+
+# Keys of the edge lines repeated on enough pages to be running headers or footers
+def boilerplate_keys(pages_lines):
+    if len(pages_lines) < BOILERPLATE_MIN_PAGES:
+        return set()
+    counts = Counter()
+    for lines in pages_lines:
+        counts.update({line_key(lines[i]) for i in edge_indexes(lines)})
+    threshold = max(2, BOILERPLATE_SHARE * len(pages_lines))
+    return {
+        key for key, count in counts.items()
+        if key and count >= threshold and key.count(' ') < BOILERPLATE_MAX_WORDS
+    }
+
+
+# Drop page numbers and every copy of a running header or footer but the
+# first, which still gives the prompt the document's title
+def strip_boilerplate(lines, boilerplate, seen):
+    edges = edge_indexes(lines)
+    kept = []
+    for i, line in enumerate(lines):
+        if i in edges:
+            key = line_key(line)
+            if PAGE_NUMBER_KEY.match(key) or key in seen:
+                continue
+            if key in boilerplate:
+                seen.add(key)
+        kept.append(line)
+    return '\n'.join(kept).strip()
+
+
+# Drop paragraphs and long lines already seen on an earlier page or paragraph
+def drop_repeats(text, seen):
+    paragraphs = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        key = text_key(paragraph)
+        if len(key) >= MIN_REPEAT_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        lines = []
+        for line in paragraph.split('\n'):
+            key = text_key(line)
+            if len(key) >= MIN_REPEAT_CHARS and line != paragraph:
+                if key in seen:
+                    continue
+                seen.add(key)
+            lines.append(line)
+        if lines:
+            paragraphs.append('\n'.join(lines))
+    return '\n\n'.join(paragraphs)
+
+
+# Shorten every page by the same share to fit the budget, cutting at a line
+# break or space, so the whole selection stays represented
+def fit_budget(pages, token_budget):
+    total = sum(len(page) for page in pages)
+    max_chars = token_budget * CHARS_PER_TOKEN - 2 * len(pages)
+    if total <= max_chars:
+        return pages, False
+    share = max(0, max_chars) / total
+    fitted = []
+    for page in pages:
+        limit = int(len(page) * share)
+        cut = page.rfind('\n', 0, limit + 1)
+        if cut <= limit // 2:
+            cut = page.rfind(' ', 0, limit + 1)
+        fitted.append(page[:cut if cut > limit // 2 else limit].rstrip())
+    return fitted, True
+
+
+# Turn the raw text of the selected pages into prompt input: running headers,
+# footers and page numbers are removed, whitespace is normalized, repeated
+# paragraphs are dropped and the result is capped at `token_budget`
+def prepare_pages(pages, token_budget=INPUT_TOKEN_BUDGET):
+    # What the prompts were built from before, pages joined as extracted
+    extracted_tokens = estimate_tokens(''.join(pages))
+
+    pages_lines = [normalize_page(page).split('\n') for page in pages]
+    boilerplate = boilerplate_keys(pages_lines)
+    seen_boilerplate, seen = set(), set()
+    prepared = [
+        drop_repeats(strip_boilerplate(lines, boilerplate, seen_boilerplate), seen)
+        for lines in pages_lines
+    ]
+    prepared = [page for page in prepared if page]
+
+    truncated = False
+    if token_budget:
+        prepared, truncated = fit_budget(prepared, token_budget)
+
+    result = PreparedText('\n\n'.join(prepared), extracted_tokens, truncated)
+    INPUT_TOKENS.inc(extracted_tokens, stage='extracted')
+    INPUT_TOKENS.inc(result.tokens, stage='prepared')
+    logger.debug(
+        "Prepared %d pages: %d of %d input tokens kept%s", len(pages), result.tokens, extracted_tokens,
+        ', truncated to the budget' if truncated else '',
+        extra={'input_tokens': result.tokens, 'input_tokens_saved': result.tokens_saved}
+    )
+    return result